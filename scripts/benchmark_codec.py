@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Compare the network logger codecs.
+
+Encodes and decodes the data for a number of monitors with each codec (and
+with compression), and prints the size and the time taken.
+
+    python scripts/benchmark_codec.py --monitors 2000 --rounds 5
+"""
+
+import argparse
+import time
+import zlib
+from typing import Any, Callable, Tuple
+
+from simplemonitor.Monitors.monitor import MonitorFail, MonitorNull
+from simplemonitor.util import codec
+
+
+def make_data(count: int) -> dict:
+    monitors = [MonitorNull("monitor-{}".format(i), {}) for i in range(count)]
+    monitors += [MonitorFail("failing-{}".format(i), {}) for i in range(count // 100)]
+    for monitor in monitors:
+        monitor.run_test()
+    return {
+        "version": 2,
+        "name": "benchmark",
+        "monitors": {
+            monitor.name: {
+                "cls_type": monitor.monitor_type,
+                "data": monitor.to_python_dict(),
+            }
+            for monitor in monitors
+        },
+    }
+
+
+def best_of(rounds: int, function: Callable[..., Any], *args: Any) -> Tuple[Any, float]:
+    """Run function rounds times; return its result and the quickest time."""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function(*args)
+        taken = time.perf_counter() - start
+        if taken < best:
+            best = taken
+    return result, best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--monitors", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    options = parser.parse_args()
+
+    data = make_data(options.monitors)
+    print(
+        "{:<8} {:>10} {:>10} {:>10} {:>10}".format(
+            "codec", "bytes", "zlib bytes", "encode ms", "decode ms"
+        )
+    )
+    for name in codec.CODECS:
+        payload, encode_time = best_of(options.rounds, codec.encode, data, name)
+        _, decode_time = best_of(options.rounds, codec.decode, payload)
+        print(
+            "{:<8} {:>10} {:>10} {:>10.1f} {:>10.1f}".format(
+                name,
+                len(payload),
+                len(zlib.compress(payload)),
+                encode_time * 1000,
+                decode_time * 1000,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
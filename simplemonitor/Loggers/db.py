@@ -125,6 +125,7 @@ class DBFullLogger(DBLogger):
     """Logs results to a sqlite3 db."""
 
     logger_type = "db"
+    supports_backfill = True
 
     def save_result(
         self,
@@ -148,7 +149,7 @@ class DBFullLogger(DBLogger):
         cursor = self.db_handle.cursor()
 
         join_string = ":"
-        timestamp = int(time.time())
+        timestamp = int(self._time())
         if hostname == "":
             hostname = self.hostname
 
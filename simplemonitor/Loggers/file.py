@@ -37,6 +37,7 @@ class FileLogger(Logger):
     """Log monitor status to a file."""
 
     logger_type = "logfile"
+    supports_backfill = True
     filename = ""
     only_failures = False
     buffered = True
@@ -120,6 +121,7 @@ class FileLoggerNG(Logger):
     """
 
     logger_type = "logfileng"
+    supports_backfill = True
     only_failures = False
 
     def __init__(self, config_options: Optional[dict] = None) -> None:
@@ -20,6 +20,11 @@ class Logger:
     logger_type = "unknown"
 
     supports_batch = False
+    # loggers which keep a history want results which arrive late (see
+    # save_backfill); those showing the current state don't
+    supports_backfill = False
+    # set while logging a backfilled result, to the time it was from
+    _log_time = None  # type: Optional[float]
     doing_batch = False
     batch_data = None  # type: Optional[Dict[str, Any]]
     connected = True
@@ -113,11 +118,29 @@ class Logger:
         Subclasses must override this with their implementation."""
         raise NotImplementedError
 
+    def save_backfill(self, name: str, monitor: Monitor, timestamp: float) -> None:
+        """Record a result from the past, which a remote instance saved while
+        it couldn't reach us."""
+        self._log_time = timestamp
+        try:
+            self.save_result2(name, monitor)
+        finally:
+            self._log_time = None
+
+    def _time(self) -> float:
+        """The time to log a result at: now, or the time a backfilled result
+        was from."""
+        if self._log_time is None:
+            return time.time()
+        return self._log_time
+
     def _get_datestring(self) -> str:
         """Format the current datetime according to the dateformat setting and timezone."""
         if self.dateformat == "iso8601":
-            return format_datetime(arrow.now(), self.tz)
-        return str(int(time.time()))
+            if self._log_time is None:
+                return format_datetime(arrow.now(), self.tz)
+            return format_datetime(arrow.get(self._log_time), self.tz)
+        return str(int(self._time()))
 
     @property
     def dependencies(self) -> list:
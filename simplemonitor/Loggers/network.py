@@ -5,14 +5,39 @@ Network logging support for SimpleMonitor
 import datetime
 import hmac
 import logging
+import multiprocessing
+import select
+import selectors
 import socket
 import struct
-from threading import Thread
-from typing import TYPE_CHECKING, Dict, Optional, TypedDict, Union, cast
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock, Thread
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypedDict,
+    Union,
+    cast,
+)
 
-from ..Monitors.monitor import Monitor
-from ..util import LoggerConfigurationError
-from ..util.json_encoding import json_dumps, json_loads
+from ..Monitors.monitor import Monitor, RemoteMonitor
+from ..util import (
+    LoggerConfigurationError,
+    codec,
+    short_hostname,
+    size_string_to_bytes,
+)
+from ..util.resolver import create_connection
+from ..util.spool import Spool
 from .logger import Logger, register
 
 if TYPE_CHECKING:
@@ -25,6 +50,42 @@ if TYPE_CHECKING:
 
 _DIGEST_NAME = "md5"
 
+# A persistent connection starts with this, then a byte of flags. After that
+# each message is sent as a frame: its length as a 4-byte big-endian integer,
+# then the message.
+_FRAMED_PREAMBLE = b"SMFR"
+_FLAG_ACKS = 0x01
+_FRAME_HEADER = struct.Struct(">I")
+_ACK = b"\x06"
+_NAK = b"\x15"
+
+# A payload starting with this is zlib compressed using _ZLIB_DICTIONARY as a
+# preset dictionary (uncompressed JSON payloads start with "{"). The MAC covers
+# the compressed payload, so it's checked before we decompress anything.
+# Changing the dictionary means using a new prefix, or older listeners won't
+# be able to decompress it.
+_COMPRESSED = b"Z"
+_ZLIB_DICTIONARY = (
+    b'"_failed_at": {"__simplemonitor_arrow": "", "last_failure": '
+    b'{"__simplemonitor_arrow": "", "failures": 1, "unavailable_seconds": 0, '
+    b'"last_error_count": 0, "skip_dep": null, "interval": 5, "_state": '
+    b'{"__simplemonitor_monitorstate": "FAILED"}}, "removed": []}'
+    b'{"version": 3, "name": "", "seq": 1, "full": true, "monitors": {"": '
+    b'{"cls_type": "", "data": {"_config_options": {}, "name": "", "_deps": [], '
+    b'"_dependencies": [], "_urgent": true, "_notify": true, "group": '
+    b'["default"], "_tolerance": 0, "remote_alerting": false, '
+    b'"_recover_command": null, "_recovered_command": null, "recover_info": "", '
+    b'"recovered_info": "", "_minimum_gap": 0, "failure_doc": null, "enabled": '
+    b'true, "gps": null, "slug": null, "probe_ttl": 0, "running_on": "", '
+    b'"_state": {"__simplemonitor_monitorstate": "OK"}, "_force_run": false, '
+    b'"_first_load": {"__simplemonitor_arrow": "", "ran_this_time": false, '
+    b'"uptime_start": {"__simplemonitor_arrow": "", "error_count": 0, '
+    b'"last_result": "", "full": false, "monitors": {"": {"data": '
+    b'{"last_update": {"__simplemonitor_arrow": "+00:00"}, "success_count": 1, '
+    b'"tests_run": 1}}, "": {"data": {"last_update": {"__simplemonitor_arrow": '
+    b'"+00:00"}, "success_count": 1, "tests_run": 1}}'
+)
+
 
 class RemoteHost(TypedDict):
     last_seen: datetime.datetime
@@ -51,10 +112,83 @@ class NetworkLogger(Logger):
         self.key = bytearray(
             self.get_config_option("key", required=True, allow_empty=False), "utf-8"
         )
+        self.persistent = cast(
+            bool,
+            self.get_config_option("persistent", required_type="bool", default=False),
+        )
+        self.acks = cast(
+            bool, self.get_config_option("acks", required_type="bool", default=False)
+        )
+        self.timeout = cast(
+            int,
+            self.get_config_option(
+                "timeout", required_type="int", default=10, minimum=1
+            ),
+        )
+        self.compress = cast(
+            bool,
+            self.get_config_option("compress", required_type="bool", default=False),
+        )
+        self.codec = cast(
+            str,
+            self.get_config_option(
+                "codec", default="json", allowed_values=list(codec.CODECS.keys())
+            ),
+        )
+        self.relay = cast(
+            bool, self.get_config_option("relay", required_type="bool", default=False)
+        )
+        # remote monitors to relay, by the instance they came from:
+        # {origin: {"via": [hostname, ...], "monitors": {name: ...}}}
+        self._relay_batch = {}  # type: Dict[str, dict]
+        self._sock = None  # type: Optional[socket.socket]
+        self._backoff = 0
+        self._next_attempt = 0.0
+        # what we last sent over the persistent connection, to send changes
+        # against, and the sequence number of the last message
+        self._sent = {}  # type: Dict[str, dict]
+        self._sent_relayed = {}  # type: Dict[str, Dict[str, dict]]
+        self._seq = 0
+
+        spool_file = cast(Optional[str], self.get_config_option("spool_file"))
+        self._spool = None  # type: Optional[Spool]
+        if spool_file:
+            spool_keep = cast(
+                str,
+                self.get_config_option(
+                    "spool_keep",
+                    default="all",
+                    allowed_values=["all", "merge"],
+                ),
+            )
+            self._spool = Spool(
+                spool_file,
+                cast(
+                    int,
+                    size_string_to_bytes(
+                        cast(str, self.get_config_option("spool_max_bytes")) or "16M"
+                    ),
+                ),
+                _merge_batches if spool_keep == "merge" else None,
+            )
+        self.spool_rate = cast(
+            int,
+            self.get_config_option(
+                "spool_rate", required_type="int", default=10, minimum=1
+            ),
+        )
+        self._spool_tokens = float(self.spool_rate)
+        self._spool_refilled = time.monotonic()
+
+    max_backoff = 300
 
     def describe(self) -> str:
         return "Sending monitor results to {0}:{1}".format(self.host, self.port)
 
+    def start_batch(self) -> None:
+        super().start_batch()
+        self._relay_batch = {}
+
     def save_result2(self, name: str, monitor: Monitor) -> None:
         if not self.doing_batch:  # pragma: no cover
             self.logger_logger.error(
@@ -62,6 +196,9 @@ class NetworkLogger(Logger):
             )
             return
         self.logger_logger.debug("network logger: %s %s", name, monitor)
+        if isinstance(monitor, RemoteMonitor):
+            self._save_relayed(name, monitor)
+            return
         if monitor.monitor_type == "unknown":
             self.logger_logger.error(
                 "Cannot serialize monitor %s, has type 'unknown'.", name
@@ -76,6 +213,7 @@ class NetworkLogger(Logger):
                 data = {
                     "cls_type": monitor.monitor_type,
                     "data": monitor.to_python_dict(),
+                    "description": monitor.describe(),
                 }
                 if self.batch_data is not None:
                     self.batch_data[monitor.name] = data
@@ -84,30 +222,353 @@ class NetworkLogger(Logger):
         except Exception:  # pylint: disable=broad-except
             self.logger_logger.exception("Failed to serialize monitor %s", name)
 
+    def _save_relayed(self, name: str, monitor: RemoteMonitor) -> None:
+        """Add a monitor we got from another instance to the batch to relay.
+
+        Each instance the monitor passes through (starting with the one it
+        runs on) is listed in its via list; a listener ignores monitors
+        which have already been through it, so loops don't go round forever."""
+        if not self.relay:
+            return
+        origin = monitor.origin or monitor.running_on
+        group = self._relay_batch.get(origin)
+        if group is None:
+            group = self._relay_batch[origin] = {
+                "via": list(monitor.via or [monitor.running_on]) + [short_hostname()],
+                "monitors": {},
+            }
+        group["monitors"][name] = {
+            "cls_type": monitor.monitor_type,
+            "data": monitor.to_python_dict(),
+            "description": monitor.description,
+        }
+
     def process_batch(self) -> None:
         try:
-            payload = json_dumps(
-                {
-                    "version": 2,
-                    "name": self.hostname,
-                    "monitors": self.batch_data,
+            if self.persistent:
+                self._send_frame(self._changes_message)
+            else:
+                self._send(self._sign(codec.encode(self._batch_message(), self.codec)))
+        except Exception as exception:  # pylint: disable=broad-except
+            if isinstance(exception, ConnectionError):
+                self.logger_logger.warning("Failed to send network data: %s", exception)
+            else:
+                self.logger_logger.exception(
+                    "Failed to send network data: %s", exception
+                )
+            if self._spool is not None:
+                self._spool.append(dict(self._batch_message(), timestamp=time.time()))
+            return
+        # the remote has the current state; now it can have what it missed
+        self._replay_spool()
+
+    def _batch_message(self) -> Dict[str, object]:
+        """Make a version 2 message, which has everything in the batch."""
+        message = {
+            "version": 2,
+            "name": self.hostname,
+            "monitors": self.batch_data,
+        }  # type: Dict[str, object]
+        if self._relay_batch:
+            message["relayed"] = self._relay_batch
+        return message
+
+    def _send(self, message: bytes) -> None:
+        sock = self._connect()
+        try:
+            sock.sendall(message)
+        finally:
+            sock.close()
+
+    def _replay_spool(self) -> None:
+        """Send what's in the spool, oldest first, at up to spool_rate batches
+        a second (on average; the allowance builds up between loops).
+
+        Spooled batches are marked as backfill: the listener passes them to
+        its loggers which keep history, but they don't replace the current
+        state it has for us. They're always sent over a persistent
+        connection, so the listener processes them in order."""
+        if self._spool is None or len(self._spool) == 0:
+            return
+        now = time.monotonic()
+        self._spool_tokens = min(
+            self._spool_tokens + (now - self._spool_refilled) * self.spool_rate,
+            self.spool_rate * 60.0,
+        )
+        self._spool_refilled = now
+        if self._spool_tokens < 1:
+            return
+        records = self._spool.load()
+        if self._spool.merge is not None:
+            records = self._spool.merge(records)
+        sent = 0
+        try:
+            while sent < len(records) and self._spool_tokens >= 1:
+                message = self._sign(
+                    codec.encode(dict(records[sent], backfill=True), self.codec)
+                )
+                self._send_frame(lambda fresh: message)
+                sent += 1
+                self._spool_tokens -= 1
+        except Exception as exception:  # pylint: disable=broad-except
+            self.logger_logger.warning(
+                "Failed to send spooled network data: %s", exception
+            )
+        finally:
+            if not self.persistent:
+                self.close()
+        if sent:
+            self.logger_logger.info(
+                "Sent %d spooled batches; %d left", sent, len(records) - sent
+            )
+            self._spool.replace(records[sent:])
+
+    def _sign(self, payload: bytes) -> bytes:
+        if self.compress:
+            compressor = zlib.compressobj(zdict=_ZLIB_DICTIONARY)
+            payload = _COMPRESSED + compressor.compress(payload) + compressor.flush()
+        mac = hmac.new(self.key, payload, _DIGEST_NAME)
+        return struct.pack("B", mac.digest_size) + mac.digest() + payload
+
+    def _changes_message(self, full: bool) -> bytes:
+        """Make a version 3 message for the persistent connection.
+
+        The first message on a connection has all our monitors; after that
+        we only send what has changed since the previous message: whole
+        monitors for new ones, otherwise just the changed fields, and the
+        names of monitors which have gone away. Relayed monitors are sent
+        the same way, for each instance they came from.
+
+            {
+                "version": 3,
+                "name": "instance_name",
+                "seq": 1234,
+                "full": false,
+                "monitors": {name: {"cls_type": ..., "data": {...}}, ...},
+                "removed": [name, ...],
+                "relayed": {
+                    "origin_name": {
+                        "via": [hostname, ...],
+                        "full": false,
+                        "monitors": {...},
+                        "removed": [...]
+                    }
+                }
+            }
+        """
+        batch = self.batch_data or {}
+        if full:
+            monitors = batch
+            removed = []  # type: List[str]
+        else:
+            monitors, removed = self._changes(self._sent, batch)
+        self._sent = batch
+        message = {
+            "version": 3,
+            "name": self.hostname,
+            "full": full,
+            "monitors": monitors,
+            "removed": removed,
+        }  # type: Dict[str, object]
+
+        relayed = {}  # type: Dict[str, dict]
+        for origin, group in self._relay_batch.items():
+            previous = self._sent_relayed.get(origin)
+            if full or previous is None:
+                relayed[origin] = dict(group, full=True, removed=[])
+                continue
+            monitors, removed = self._changes(previous, group["monitors"])
+            if monitors or removed:
+                relayed[origin] = {
+                    "via": group["via"],
+                    "full": False,
+                    "monitors": monitors,
+                    "removed": removed,
                 }
+        if not full:
+            for origin, previous in self._sent_relayed.items():
+                if origin not in self._relay_batch:
+                    relayed[origin] = {
+                        "via": [],
+                        "full": False,
+                        "monitors": {},
+                        "removed": list(previous),
+                    }
+        self._sent_relayed = {
+            origin: group["monitors"] for origin, group in self._relay_batch.items()
+        }
+        if relayed:
+            message["relayed"] = relayed
+
+        self._seq += 1
+        message["seq"] = self._seq
+        return self._sign(codec.encode(message, self.codec))
+
+    @staticmethod
+    def _changes(
+        previous: Dict[str, dict], batch: Dict[str, dict]
+    ) -> Tuple[Dict[str, dict], List[str]]:
+        """Work out what has changed between two batches of monitors."""
+        monitors = {}
+        for name, entry in batch.items():
+            sent = previous.get(name)
+            if (
+                sent is None
+                or sent["cls_type"] != entry["cls_type"]
+                or sent["description"] != entry["description"]
+                or sent["data"].keys() - entry["data"].keys()
+            ):
+                monitors[name] = entry
+                continue
+            old_data = sent["data"]
+            changes = {
+                key: value
+                for key, value in entry["data"].items()
+                if key not in old_data or old_data[key] != value
+            }
+            if changes:
+                monitors[name] = {"data": changes}
+        removed = [name for name in previous if name not in batch]
+        return monitors, removed
+
+    def _connect(self) -> socket.socket:
+        sock, resolve_time, _ = create_connection(
+            (self.host, self.port), timeout=self.timeout
+        )
+        self.logger_logger.debug("Resolved %s in %0.3fs", self.host, resolve_time)
+        return sock
+
+    def _send_frame(self, make_message: Callable[[bool], bytes]) -> None:
+        """Send a message over our persistent connection, (re)connecting if needed.
+
+        make_message is called with True if the connection is new, so the
+        message must have everything rather than changes.
+
+        After a failure, we don't try to connect again until a backoff period
+        (which doubles each time, up to max_backoff seconds) has passed."""
+        if self._sock is None and time.monotonic() < self._next_attempt:
+            raise ConnectionError(
+                "not sending to {}:{}; will reconnect in {:.0f}s".format(
+                    self.host, self.port, self._next_attempt - time.monotonic()
+                )
             )
-            mac = hmac.new(self.key, payload, _DIGEST_NAME)
-            send_bytes = struct.pack("B", mac.digest_size) + mac.digest() + payload
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # a connection which has died since we last used it is replaced once
+        fresh = False
+        while True:
             try:
-                try:
-                    sock.connect((self.host, self.port))
-                except socket.error:
-                    sock.close()
-                    sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
-                    sock.connect((self.host, self.port))
-                sock.send(send_bytes)
-            finally:
-                sock.close()
-        except Exception as exception:  # pylint: disable=broad-except
-            self.logger_logger.exception("Failed to send network data: %s", exception)
+                if self._sock is None or not _is_open(self._sock):
+                    self.close()
+                    fresh = True
+                    self._sock = self._connect()
+                    self._sock.sendall(
+                        _FRAMED_PREAMBLE
+                        + struct.pack("B", _FLAG_ACKS if self.acks else 0)
+                    )
+                message = make_message(fresh)
+                self._sock.sendall(_FRAME_HEADER.pack(len(message)) + message)
+                if self.acks:
+                    reply = self._sock.recv(1)
+                    if reply == _NAK:
+                        raise ValueError("remote rejected our data")
+                    if reply != _ACK:
+                        raise ConnectionError("connection closed before ack")
+                self._backoff = 0
+                return
+            except (OSError, ValueError) as error:
+                self.close()
+                if fresh:
+                    self._backoff = min(max(self._backoff * 2, 1), self.max_backoff)
+                    self._next_attempt = time.monotonic() + self._backoff
+                    raise ConnectionError(
+                        "sending to {}:{} failed: {}".format(
+                            self.host, self.port, error
+                        )
+                    ) from error
+
+    def close(self) -> None:
+        """Close the persistent connection, if we have one."""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def _is_open(sock: socket.socket) -> bool:
+    """Check a connection hasn't been closed by the other end.
+
+    The listener never sends anything unprompted, so a connection with
+    something to read has been closed (or is broken)."""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+class _Connection:
+    """A remote instance's connection to the Listener, and what it has sent."""
+
+    def __init__(self, sock: socket.socket, address: str) -> None:
+        self.sock = sock
+        self.address = address
+        self.buffer = bytearray()
+        self.last_active = time.monotonic()
+        # None until we know if this is a persistent (framed) connection
+        self.framed = None  # type: Optional[bool]
+        self.acks = False
+        # frames waiting to be processed, in order, and if a worker is on them
+        self.frames = deque()  # type: Deque[bytes]
+        self.busy = False
+        self.lock = Lock()
+        # the sequence number we expect in the next version 3 message
+        self.seq = None  # type: Optional[int]
+
+
+def _unwrap(key: bytes, serialized: bytes, source: str, max_size: int) -> bytes:
+    """Check the MAC on data received from a remote instance, and return the
+    (decompressed) payload."""
+    try:
+        # first byte is the size of the MAC
+        mac_size = serialized[0]
+        # then the MAC
+        their_digest = serialized[1 : mac_size + 1]
+        # then the rest is the serialized data
+        payload = serialized[mac_size + 1 :]
+    except IndexError as error:  # pragma: no cover
+        raise ValueError(
+            "Did not receive any or enough data from {}".format(source)
+        ) from error
+    my_digest = hmac.new(key, payload, _DIGEST_NAME).digest()
+    if not hmac.compare_digest(their_digest, my_digest):
+        raise ValueError(
+            "Mismatched MAC for network logging data from %s\n"
+            "Mismatched key? Old version of SimpleMonitor?\n" % source
+        )
+    if payload[:1] == _COMPRESSED:
+        payload = _decompress(payload[1:], source, max_size)
+    return payload
+
+
+def _decompress(payload: bytes, source: str, max_size: int) -> bytes:
+    decompressor = zlib.decompressobj(zdict=_ZLIB_DICTIONARY)
+    try:
+        data = decompressor.decompress(payload, max_size)
+    except zlib.error as error:
+        raise ValueError(
+            "Could not decompress data from {}: {}".format(source, error)
+        ) from error
+    if decompressor.unconsumed_tail:
+        raise ValueError("Decompressed data from {} is too large".format(source))
+    return data
+
+
+def _unwrap_binary(key: bytes, serialized: bytes, source: str, max_size: int) -> bytes:
+    """As _unwrap, but run in a listener shard process: the payload is also
+    decoded, and handed back in the binary codec, which is much quicker for
+    the main process to decode (and to pass between processes) than JSON."""
+    payload = _unwrap(key, serialized, source, max_size)
+    if payload[:1] == codec.CODECS["binary"].prefix:
+        return payload
+    return codec.encode(codec.decode(payload), "binary")
 
 
 class Listener(Thread):
@@ -117,7 +578,23 @@ class Listener(Thread):
     This class isn't actually a Logger, but is the receiving-end
     implementation for network logging.
 
-    Here seemed a reasonable place to put it."""
+    Here seemed a reasonable place to put it.
+
+    Connections are read concurrently by a single thread using a selector, so
+    a slow or stalled remote doesn't hold up the others. Once a remote has sent
+    all its data, checking the MAC, decoding it and updating our remote
+    monitors is done by a pool of worker threads.
+
+    With processes set, checking and decoding is instead spread over that
+    many processes, so it can use more than one core. Each remote host always
+    goes to the same process; the decoded data comes back to the worker
+    thread, which applies it."""
+
+    recv_size = 256 * 1024
+    max_message_size = 64 * 1024 * 1024
+    idle_timeout = 30
+    # persistent connections are expected to be quiet between loops
+    framed_idle_timeout = 3600
 
     def __init__(
         self,
@@ -126,6 +603,8 @@ class Listener(Thread):
         key: Optional[str] = None,
         bind_host: str = "",
         ipv4_only: bool = False,
+        workers: int = 4,
+        processes: int = 0,
     ) -> None:
         """Set up the thread.
 
@@ -145,101 +624,263 @@ class Listener(Thread):
                 self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.bind((bind_host, port))
+        self.sock.listen(128)
+        self.sock.setblocking(False)
         self.simplemonitor = simplemonitor
         self.key = bytearray(key, "utf-8")
         self.logger = logging.getLogger("simplemonitor.logger.networklistener")
+        # how we appear in the via list of relayed monitors
+        self.hostname = short_hostname()
         self.running = False  # type: bool
+        self._selector = selectors.DefaultSelector()
+        self._connections = {}  # type: Dict[socket.socket, _Connection]
+        # each worker thread waits on a shard while it decodes, so there must
+        # be enough of them to keep all the shards busy
+        self._workers = ThreadPoolExecutor(
+            max_workers=max(workers, processes), thread_name_prefix="listener"
+        )
+        # a single process per shard, picked by the remote address; spawned
+        # rather than forked, as we have threads running
+        self._shards = [self._new_shard() for _ in range(processes)]  # type: List[ProcessPoolExecutor]
+        self._shards_lock = Lock()
+        # decoding happens in parallel, but updates are applied one at a time
+        self._update_lock = Lock()
+
+    @property
+    def port(self) -> int:
+        return cast(int, self.sock.getsockname()[1])
 
     def run(self) -> None:
         """The main body of our thread.
 
-        The loop here keeps going until we're killed by the main app.
-        When the main app kills us (with join()), socket.listen throws socket.error.
+        The loop here keeps going until the main app sets running to False.
         """
         self.running = True
-        conn: Optional[socket.socket] = None
-        addr: Optional[socket._RetAddress] = None
-        while self.running:
-            try:
-                self.sock.listen(5)
-                conn, addr = self.sock.accept()
-                conn.settimeout(5.0)
-                assert conn is not None
-                assert addr is not None
-                self.logger.debug("Got connection from %s", addr[0])
-                serialized = bytearray()
-                while 1:
-                    data = conn.recv(1024)
-                    if not data:
-                        break
-                    serialized += data
-                conn.close()
-                if len(serialized) == 0:
-                    self.logger.debug("No data from %s", addr[0])
+        self._selector.register(self.sock, selectors.EVENT_READ)
+        try:
+            while self.running:
+                for key, _ in self._selector.select(timeout=1):
+                    if key.fileobj is self.sock:
+                        self._accept()
+                    else:
+                        self._read(self._connections[cast(socket.socket, key.fileobj)])
+                self._close_idle()
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception("Listener thread caught exception")
+        finally:
+            for connection in list(self._connections.values()):
+                self._close(connection)
+            self._selector.close()
+            self.sock.close()
+            self._workers.shutdown(wait=False)
+            for shard in self._shards:
+                shard.shutdown(wait=False)
+        self.logger.warning("Listener stopped")
+
+    def _accept(self) -> None:
+        try:
+            conn, addr = self.sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.logger.exception("Error accepting connection")
+            return
+        self.logger.debug("Got connection from %s", addr[0])
+        conn.setblocking(False)
+        connection = _Connection(conn, addr[0])
+        self._connections[conn] = connection
+        self._selector.register(conn, selectors.EVENT_READ)
+
+    def _read(self, connection: _Connection) -> None:
+        try:
+            data = connection.sock.recv(self.recv_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as error:
+            self.logger.warning(
+                "Error receiving from %s: %s", connection.address, error
+            )
+            self._close(connection)
+            return
+        connection.last_active = time.monotonic()
+        if data:
+            connection.buffer += data
+            if connection.framed is None:
+                self._check_framed(connection)
+            if connection.framed:
+                self._read_frames(connection)
+            elif len(connection.buffer) > self.max_message_size:
+                self.logger.error(
+                    "Too much data from %s; dropping connection", connection.address
+                )
+                self._close(connection)
+            return
+        self._close(connection)
+        if connection.framed:
+            if connection.buffer:
+                self.logger.warning(
+                    "Connection from %s closed part way through a frame",
+                    connection.address,
+                )
+            return
+        if len(connection.buffer) == 0:
+            self.logger.debug("No data from %s", connection.address)
+            return
+        self.logger.debug("Finished receiving from %s", connection.address)
+        self._workers.submit(
+            self._process, bytes(connection.buffer), connection.address
+        )
+
+    @staticmethod
+    def _check_framed(connection: _Connection) -> None:
+        """See if a connection starts with the persistent connection preamble.
+
+        Otherwise it's the old style of one message per connection, which
+        starts with the size of the MAC (so can't look like the preamble)."""
+        buffer = connection.buffer
+        length = min(len(buffer), len(_FRAMED_PREAMBLE))
+        if buffer[:length] != _FRAMED_PREAMBLE[:length]:
+            connection.framed = False
+        elif len(buffer) > len(_FRAMED_PREAMBLE):
+            connection.framed = True
+            connection.acks = bool(buffer[len(_FRAMED_PREAMBLE)] & _FLAG_ACKS)
+            del buffer[: len(_FRAMED_PREAMBLE) + 1]
+
+    def _read_frames(self, connection: _Connection) -> None:
+        buffer = connection.buffer
+        header_size = _FRAME_HEADER.size
+        while len(buffer) >= header_size:
+            (length,) = _FRAME_HEADER.unpack_from(buffer)
+            if length > self.max_message_size:
+                self.logger.error(
+                    "Frame too large from %s; dropping connection", connection.address
+                )
+                self._close(connection)
+                return
+            if len(buffer) < header_size + length:
+                return
+            frame = bytes(buffer[header_size : header_size + length])
+            del buffer[: header_size + length]
+            with connection.lock:
+                connection.frames.append(frame)
+                if connection.busy:
                     continue
-                self.logger.debug("Finished receiving from %s", addr[0])
+                connection.busy = True
+            self._workers.submit(self._process_frames, connection)
+
+    def _process_frames(self, connection: _Connection) -> None:
+        """Process a connection's frames in the order they arrived."""
+        while True:
+            with connection.lock:
+                if not connection.frames:
+                    connection.busy = False
+                    return
+                frame = connection.frames.popleft()
+            ok = self._process(frame, connection.address, connection)
+            if connection.acks:
                 try:
-                    # first byte is the size of the MAC
-                    mac_size = serialized[0]
-                    # then the MAC
-                    their_digest = serialized[1 : mac_size + 1]
-                    # then the rest is the serialized data
-                    serialized = serialized[mac_size + 1 :]
-                    mac = hmac.new(self.key, serialized, _DIGEST_NAME)
-                    my_digest = mac.digest()
-                except IndexError as error:  # pragma: no cover
-                    raise ValueError(
-                        "Did not receive any or enough data from {}".format(addr[0])
-                    ) from error
-                if isinstance(my_digest, str):
-                    self.logger.debug(
-                        "Computed my digest to be %s; remote is %s",
-                        my_digest,
-                        their_digest,
-                    )
-                else:
-                    self.logger.debug(
-                        "Computed my digest to be %s; remote is %s",
-                        my_digest.hex(),
-                        their_digest.hex(),
-                    )
-                if not hmac.compare_digest(their_digest, my_digest):
-                    raise Exception(
-                        "Mismatched MAC for network logging data from %s\n"
-                        "Mismatched key? Old version of SimpleMonitor?\n" % addr[0]
-                    )
-                result = json_loads(bytes(serialized))  # type: dict
-                version = result.get("version", 1)
-                if version == 1:
-                    self.logger.debug("Received version 1 data from %s", addr[0])
-                    self.simplemonitor.update_remote_monitor(result, addr[0])
-                elif version == 2:
-                    self.logger.debug("Received version 2 data from %s", addr[0])
-                    self._handle_data_v2(result, addr[0])
-                else:
-                    self.logger.critical(
-                        "Received unknown version %s data from %s cannot process",
-                        version,
-                        addr[0],
-                    )
-            except socket.timeout:
-                if addr:
-                    self.logger.warning("Timeout during recv from %s", addr[0])
-                if conn:
-                    conn.close()
-            except socket.error as exception:
-                if exception.errno == 4:
-                    # Interrupted system call
-                    self.logger.warning(
-                        "Interrupted system call in thread, I think that's a ^C"
+                    connection.sock.send(_ACK if ok else _NAK)
+                except OSError:
+                    # the selector thread will notice it's gone
+                    pass
+
+    def _close(self, connection: _Connection) -> None:
+        self._selector.unregister(connection.sock)
+        del self._connections[connection.sock]
+        connection.sock.close()
+
+    def _close_idle(self) -> None:
+        now = time.monotonic()
+        for connection in list(self._connections.values()):
+            if connection.framed:
+                timeout = self.framed_idle_timeout
+            else:
+                timeout = self.idle_timeout
+            if connection.last_active < now - timeout:
+                self.logger.warning("Timeout during recv from %s", connection.address)
+                self._close(connection)
+
+    def _process(
+        self,
+        serialized: bytes,
+        source: str,
+        connection: Optional[_Connection] = None,
+    ) -> bool:
+        """Check, decode and apply the data received from a remote instance."""
+        try:
+            result = self._decode(serialized, source)
+            with self._update_lock:
+                self._handle_data(result, source, connection)
+            return True
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception("Failed to process data from %s", source)
+            if connection is not None:
+                # make the remote reconnect and start again with everything
+                connection.seq = None
+                try:
+                    connection.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            return False
+
+    def _decode(self, serialized: bytes, source: str) -> dict:
+        if not self._shards:
+            return cast(
+                dict,
+                codec.decode(
+                    _unwrap(bytes(self.key), serialized, source, self.max_message_size)
+                ),
+            )
+        index = zlib.crc32(source.encode("utf-8")) % len(self._shards)
+        shard = self._shards[index]
+        try:
+            payload = shard.submit(
+                _unwrap_binary,
+                bytes(self.key),
+                serialized,
+                source,
+                self.max_message_size,
+            ).result()
+        except BrokenProcessPool as error:
+            with self._shards_lock:
+                if self._shards[index] is shard:
+                    self.logger.error("Listener process %d died; restarting it", index)
+                    self._shards[index] = self._new_shard()
+            raise ValueError(
+                "Listener process died decoding data from {}".format(source)
+            ) from error
+        return cast(dict, codec.decode(payload))
+
+    @staticmethod
+    def _new_shard() -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def _handle_data(
+        self, result: dict, source: str, connection: Optional[_Connection] = None
+    ) -> None:
+        version = result.get("version", 1)
+        if version == 1:
+            self.logger.debug("Received version 1 data from %s", source)
+            self.simplemonitor.update_remote_monitor(result, source)
+        elif version == 2:
+            self.logger.debug("Received version 2 data from %s", source)
+            self._handle_data_v2(result, source)
+        elif version == 3:
+            if connection is None:
+                raise ValueError(
+                    "Version 3 data from {} must use a persistent connection".format(
+                        source
                     )
-                    self.running = False
-                    self.sock.close()
-                if self.running:
-                    self.logger.exception("Socket error caught in thread")
-            except Exception:  # pylint: disable=broad-except
-                self.logger.exception("Listener thread caught exception")
-        self.logger.warning("Listener stopped")
+                )
+            self._handle_data_v3(result, source, connection)
+        else:
+            self.logger.critical(
+                "Received unknown version %s data from %s cannot process",
+                version,
+                source,
+            )
 
     def _handle_data_v2(
         self, data: Dict[str, Union[str, int, Dict[str, dict]]], source: str
@@ -249,12 +890,20 @@ class Listener(Thread):
         {
             "version": 2,
             "name": "remote_instance_name",
-            "monitors": [ monitor data, ... ]
+            "monitors": [ monitor data, ... ],
+            "relayed": {
+                "origin_name": {"via": [hostname, ...], "monitors": [ ... ]}
+            },
+            "backfill": true,  # (optional) see _handle_backfill
+            "timestamp": 1234567890.0,  # (with backfill)
         }
         """
         remote_instance_name = str(data.get("name", source))
         if not remote_instance_name or remote_instance_name == "None":
             remote_instance_name = source
+        if data.get("backfill"):
+            self._handle_backfill(data, remote_instance_name, source)
+            return
         remote_monitors = data.get("monitors", None)
         if remote_monitors is None:
             self.logger.error(
@@ -273,3 +922,105 @@ class Listener(Thread):
                 "Bad data type for monitors from remote instance %s",
                 remote_instance_name,
             )
+        relayed = data.get("relayed")
+        if isinstance(relayed, dict):
+            self._handle_relayed(relayed, source)
+
+    def _handle_data_v3(self, data: dict, source: str, connection: _Connection) -> None:
+        """Handle data in v3 format (see NetworkLogger._changes_message)
+
+        Changes are applied on top of what we already have, so if we've missed
+        a message (or have nothing to apply them to), raise an error; the
+        connection is then closed, and the remote starts again with a full
+        message."""
+        remote_instance_name = str(data.get("name", source))
+        if not remote_instance_name or remote_instance_name == "None":
+            remote_instance_name = source
+        seq = int(data["seq"])
+        if data.get("full"):
+            self.logger.debug(
+                "Received full version 3 data from %s", remote_instance_name
+            )
+            self.simplemonitor.update_remote_monitor(
+                data["monitors"], remote_instance_name
+            )
+        elif seq != connection.seq:
+            raise ValueError(
+                "Expected message {} from {} but got {}".format(
+                    connection.seq, remote_instance_name, seq
+                )
+            )
+        else:
+            self.simplemonitor.update_remote_monitor_delta(
+                data["monitors"], data.get("removed", []), remote_instance_name
+            )
+        connection.seq = seq + 1
+        self.simplemonitor.upsert_remote_host(
+            remote_instance_name, datetime.datetime.now(), source
+        )
+        if "relayed" in data:
+            self._handle_relayed(data["relayed"], source)
+
+    def _handle_backfill(self, data: dict, name: str, source: str) -> None:
+        """Handle a batch the remote saved while it couldn't reach us.
+
+        We already have newer data for it, so the batch is only handed to the
+        loggers which keep history, at the time it was saved."""
+        timestamp = float(data.get("timestamp") or time.time())
+        self.logger.debug("Received backfill data from %s", name)
+        monitors = data.get("monitors")
+        if isinstance(monitors, dict):
+            self.simplemonitor.queue_backfill(monitors, name, timestamp)
+        relayed = data.get("relayed")
+        if not isinstance(relayed, dict):
+            return
+        for origin, group in relayed.items():
+            via = [str(host) for host in group.get("via", [])]
+            if self.hostname not in via:
+                self.simplemonitor.queue_backfill(
+                    group["monitors"], origin, timestamp, via
+                )
+
+    def _handle_relayed(self, relayed: Dict[str, dict], source: str) -> None:
+        """Handle monitors relayed to us from other instances by source.
+
+        Each group of monitors is stored under the name of the instance it
+        came from, as if that instance had sent it to us itself."""
+        for origin, group in relayed.items():
+            via = [str(name) for name in group.get("via", [])]
+            if self.hostname in via:
+                self.logger.debug(
+                    "Ignoring monitors from %s relayed by %s, as they have already "
+                    "been through us (via %s)",
+                    origin,
+                    source,
+                    ", ".join(via),
+                )
+                continue
+            if group.get("full", True):
+                self.simplemonitor.update_remote_monitor(group["monitors"], origin, via)
+            else:
+                self.simplemonitor.update_remote_monitor_delta(
+                    group["monitors"], group.get("removed", []), origin, via
+                )
+            self.simplemonitor.upsert_remote_host(
+                origin, datetime.datetime.now(), source
+            )
+
+
+def _merge_batches(batches: List[dict]) -> List[dict]:
+    """Merge version 2 messages into one with the latest state of each monitor."""
+    if not batches:
+        return batches
+    monitors = {}  # type: Dict[str, dict]
+    relayed = {}  # type: Dict[str, dict]
+    for batch in batches:
+        monitors.update(batch.get("monitors") or {})
+        for origin, group in (batch.get("relayed") or {}).items():
+            merged = relayed.setdefault(origin, {"monitors": {}})
+            merged["via"] = group["via"]
+            merged["monitors"].update(group["monitors"])
+    message = dict(batches[-1], monitors=monitors)
+    if relayed:
+        message["relayed"] = relayed
+    return [message]
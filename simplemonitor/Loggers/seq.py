@@ -20,6 +20,7 @@ class SeqLogger(Logger):
     """Logging to seq"""
 
     logger_type = "seq"
+    supports_backfill = True
     only_failures = False
     buffered = False
     dateformat = None
@@ -73,7 +74,7 @@ class SeqLogger(Logger):
     ):
         """Send an event to seq"""
         event_data = {
-            "Timestamp": str(datetime.datetime.now()),
+            "Timestamp": str(datetime.datetime.fromtimestamp(self._time())),
             "Level": "Error" if is_fail is True else "Information",
             "MessageTemplate": str(description),
             "Properties": {
@@ -4,7 +4,7 @@ Monitors for SimpleMonitor
 
 from .arlo import MonitorArloCamera
 from .compound import CompoundMonitor, RemoteHostsMonitor
-from .file import MonitorBackup
+from .file import MonitorBackup, MonitorLogTail
 from .gmirror import MonitorGmirrorStatus
 from .hass import MonitorSensor
 from .host import (
@@ -12,6 +12,7 @@ from .host import (
     MonitorCommand,
     MonitorDiskSpace,
     MonitorFileStat,
+    MonitorFileStatGlob,
     MonitorLoadAvg,
     MonitorMemory,
     MonitorPkgAudit,
@@ -27,6 +28,7 @@ from .network import (
     MonitorTCP,
     MonitorTLSCert,
 )
+from .push import MonitorPush
 from .ring import MonitorRingDoorbell
 from .service import (
     MonitorEximQueue,
@@ -50,15 +52,18 @@ __all__ = [
     "MonitorDiskSpace",
     "MonitorEximQueue",
     "MonitorFileStat",
+    "MonitorFileStatGlob",
     "MonitorGmirrorStatus",
     "MonitorHTTP",
     "MonitorHost",
     "MonitorLoadAvg",
+    "MonitorLogTail",
     "MonitorMemory",
     "MonitorPing",
     "MonitorPkgAudit",
     "MonitorPortAudit",
     "MonitorProcess",
+    "MonitorPush",
     "MonitorRC",
     "MonitorRingDoorbell",
     "MonitorSensor",
@@ -3,8 +3,9 @@ Compound checks (logical and of failure of multiple probes) for SimpleMonitor
 """
 
 import datetime
+import threading
 from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, cast
-from weakref import WeakValueDictionary
+from weakref import WeakSet, WeakValueDictionary
 
 from .monitor import Monitor, register
 
@@ -18,6 +19,10 @@ class CompoundMonitor(Monitor):
     Combine (logical-and) multiple failures for emergency escalation
 
     Check most recent proble of provided monitors, if all are fail, then report fail.
+
+    The sub-monitors tell us when they record a result, so we always know how
+    many of them are failed without having to look at them all. The engine
+    runs compound monitors after all of their sub-monitors.
     """
 
     monitor_type = "compound"
@@ -38,22 +43,14 @@ class CompoundMonitor(Monitor):
                 "min_fail", required_type="int", default=len(self.monitors), minimum=1
             ),
         )
+        self._failed = WeakSet()  # type: WeakSet[Monitor]
+        self._failed_lock = threading.Lock()
 
     def run_test(self) -> bool:
-        # we depend on the other tests to run, just check them
-        failcount = self.min_fail
-        # this check actually doesn't work, since the sub-monitors run AFTER the compound ones...
-        if self.m is not None:
-            for i in self.monitors:
-                if self.m[i].get_success_count() > 0 and self.m[i].tests_run > 0:
-                    failcount -= 1
-        if failcount < self.min_fail:
-            return self.record_success(
-                "{} monitors failed (min: {})".format(failcount, self.min_fail)
-            )
-        return self.record_fail(
-            "{} monitors failed (min: {})".format(failcount, self.min_fail)
-        )
+        # the sub-monitors have already run; we just look at the count
+        if self.fail_count() >= self.min_fail:
+            return self.record_fail(self.get_result())
+        return self.record_success(self.get_result())
 
     def describe(self) -> str:
         """Explains what we do."""
@@ -69,26 +66,33 @@ class CompoundMonitor(Monitor):
         self.all_monitors = WeakValueDictionary(mmm)
 
     def post_config_setup(self) -> None:
-        """make a nice little dict of just the monitors we need"""
-        if self.m is not None:
-            return
+        """make a nice little dict of just the monitors we need, and listen to them
+
+        This is done again after a config reload, as the monitors may have changed.
+        """
         self.m = WeakValueDictionary()
-        for i in list(self.all_monitors.keys()):
-            if i in self.monitors:
-                self.m[i] = self.all_monitors[i]
         # make sure we find all of our monitors or die during config
         for i in self.monitors:
-            if i not in list(self.m.keys()):
+            if i not in self.all_monitors:
                 raise RuntimeError("No such monitor %s in compound monitor" % i)
+            self.m[i] = self.all_monitors[i]
+        with self._failed_lock:
+            self._failed = WeakSet(
+                monitor for monitor in self.m.values() if not monitor.test_success()
+            )
+        for monitor in self.m.values():
+            monitor.add_state_listener(self._sub_monitor_changed)
+
+    def _sub_monitor_changed(self, monitor: Monitor) -> None:
+        with self._failed_lock:
+            if monitor.test_success():
+                self._failed.discard(monitor)
+            else:
+                self._failed.add(monitor)
 
     def fail_count(self) -> int:
-        """increments the fail counter by 1 if a sub-monitor failed"""
-        failcount = 0
-        if self.m is not None:
-            for i in self.monitors:
-                if self.m[i].virtual_fail_count() > 0:
-                    failcount += 1
-        return failcount
+        """the number of sub-monitors which are failed"""
+        return len(self._failed)
 
     def get_result(self) -> str:
         failcount = self.fail_count()
@@ -2,9 +2,14 @@
 File-based monitors for SimpleMonitor
 """
 
+import json
+import mmap
 import os
 import os.path
+import re
 import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple, cast
 
 from .monitor import Monitor, register
 
@@ -61,3 +66,194 @@ class MonitorBackup(Monitor):
 
     def describe(self) -> str:
         return "Checking Backup Exec runs daily, and doesn't run for too long."
+
+
+@register
+class MonitorLogTail(Monitor):
+    """Count the lines matching a regexp which are appended to a log file.
+
+    Only the data added since the last run is read (through mmap), so the size
+    of the file doesn't matter. The file's inode and the offset reached are
+    remembered, and can be saved to a state file so they survive restarts. If
+    the file is replaced (e.g. rotated) or truncated, it is read from the start.
+    """
+
+    monitor_type = "logtail"
+
+    # the most data to map at once
+    chunk_size = 64 * 1024 * 1024
+
+    def __init__(self, name: str, config_options: dict) -> None:
+        super().__init__(name, config_options)
+        self.filename = cast(str, self.get_config_option("filename", required=True))
+        self.regexp_text = cast(
+            str, self.get_config_option("regexp", required=True, allow_empty=False)
+        )
+        self.regexp = re.compile(self.regexp_text.encode("utf-8"), re.MULTILINE)
+        self.max_matches = cast(
+            int,
+            self.get_config_option(
+                "max_matches", required_type="int", minimum=0, default=0
+            ),
+        )
+        self.window = cast(
+            int,
+            self.get_config_option("window", required_type="int", minimum=0, default=0),
+        )
+        self.state_file = cast(Optional[str], self.get_config_option("state_file"))
+        self.from_start = cast(
+            bool,
+            self.get_config_option("from_start", required_type="bool", default=False),
+        )
+        self._file_id = None  # type: Optional[Tuple[int, int]]
+        self._offset = 0
+        # (time, count) for each run which found matches, for the window
+        self._history = deque()  # type: Deque[Tuple[float, int]]
+        self._last_match = b""
+        # what's in the state file, so we only write it when it changes
+        self._saved_state = None  # type: Optional[Dict[str, Any]]
+        self._load_state()
+
+    @property
+    def _state_key(self) -> str:
+        return "{}:{}".format(self.name, self.filename)
+
+    def _load_state(self) -> None:
+        if self.state_file is None:
+            return
+        try:
+            with open(self.state_file, "r") as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as error:
+            self.monitor_logger.warning(
+                "Unable to read state file %s: %s", self.state_file, error
+            )
+            return
+        if not isinstance(state, dict) or state.get("key") != self._state_key:
+            # another monitor's, or a different file's
+            return
+        self._saved_state = state
+        self._file_id = (state["dev"], state["inode"])
+        self._offset = state["offset"]
+        self._history = deque((when, count) for when, count in state["history"])
+
+    def _save_state(self) -> None:
+        if self.state_file is None or self._file_id is None:
+            return
+        state = {
+            "key": self._state_key,
+            "dev": self._file_id[0],
+            "inode": self._file_id[1],
+            "offset": self._offset,
+            "history": [list(entry) for entry in self._history],
+        }  # type: Dict[str, Any]
+        if state == self._saved_state:
+            return
+        temp_file = self.state_file + ".tmp"
+        with open(temp_file, "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(temp_file, self.state_file)
+        self._saved_state = state
+
+    def _scan(self, handle: Any, end: int) -> int:
+        """Count the complete lines from our offset up to end which match."""
+        count = 0
+        while self._offset < end:
+            start = self._offset - (self._offset % mmap.ALLOCATIONGRANULARITY)
+            length = min(end - start, self.chunk_size)
+            with mmap.mmap(
+                handle.fileno(), length, access=mmap.ACCESS_READ, offset=start
+            ) as data:
+                position = self._offset - start
+                line_end = data.rfind(b"\n", position) + 1
+                if line_end == 0:
+                    if start + length < end:
+                        # a single line longer than a chunk; take it as it is
+                        line_end = length
+                    else:
+                        # wait for the rest of the line
+                        break
+                while True:
+                    match = self.regexp.search(data, position, line_end)
+                    if match is None:
+                        break
+                    count += 1
+                    line_start = data.rfind(b"\n", 0, match.start()) + 1
+                    # carry on from the next line, so a line is only counted
+                    # once however many times it matches
+                    next_line = data.find(
+                        b"\n", max(match.start(), match.end() - 1), line_end
+                    )
+                    position = next_line + 1 if next_line >= 0 else line_end
+                    self._last_match = data[line_start:position].rstrip(b"\n")
+            self._offset = start + line_end
+        return count
+
+    def _count_in_window(self, now: float) -> int:
+        if self.window:
+            while self._history and self._history[0][0] <= now - self.window:
+                self._history.popleft()
+        return sum(count for _, count in self._history)
+
+    def run_test(self) -> bool:
+        now = time.time()
+        try:
+            with open(self.filename, "rb") as handle:
+                statinfo = os.fstat(handle.fileno())
+                file_id = (statinfo.st_dev, statinfo.st_ino)
+                if self._file_id is None and not self.from_start:
+                    # first time we've seen the file; only look at new lines
+                    self._offset = statinfo.st_size
+                elif file_id != self._file_id:
+                    if self._file_id is not None:
+                        self.monitor_logger.info("%s was replaced", self.filename)
+                    self._offset = 0
+                elif statinfo.st_size < self._offset:
+                    self.monitor_logger.info("%s was truncated", self.filename)
+                    self._offset = 0
+                self._file_id = file_id
+                count = self._scan(handle, statinfo.st_size)
+        except FileNotFoundError:
+            return self.record_fail("File %s does not exist" % self.filename)
+        except Exception as error:
+            return self.record_fail("Unable to read file: %s" % error)
+
+        if not self.window:
+            self._history.clear()
+        if count:
+            self._history.append((now, count))
+        total = self._count_in_window(now)
+        try:
+            self._save_state()
+        except OSError as error:
+            self.monitor_logger.warning(
+                "Unable to save state to %s: %s", self.state_file, error
+            )
+
+        if self.window:
+            where = "in the last {}s".format(self.window)
+        else:
+            where = "in new lines"
+        if total > self.max_matches:
+            return self.record_fail(
+                "{} lines matched {}, max {}; last was: {}".format(
+                    total,
+                    where,
+                    self.max_matches,
+                    self._last_match.decode("utf-8", errors="replace")[:200],
+                )
+            )
+        return self.record_success("{} lines matched {}".format(total, where))
+
+    def describe(self) -> str:
+        return "Checking no more than {} lines added to {} match /{}/{}".format(
+            self.max_matches,
+            self.filename,
+            self.regexp_text,
+            " in {} seconds".format(self.window) if self.window else "",
+        )
+
+    def get_params(self) -> Tuple:
+        return (self.filename, self.regexp_text, self.max_matches, self.window)
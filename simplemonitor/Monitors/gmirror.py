@@ -4,6 +4,7 @@ Gmirror array checks for simplemonitor.
 
 import subprocess
 
+from ..util.runner import run_command
 from .monitor import Monitor, register
 
 
@@ -33,11 +34,12 @@ class MonitorGmirrorStatus(Monitor):
 
         run_cmd = ["gmirror", "status", "-gs", self.array_device]
         try:
-            result = subprocess.run(run_cmd, capture_output=True, check=True)
-        except subprocess.CalledProcessError:
+            result = run_command(run_cmd, stderr=subprocess.DEVNULL)
+            result.check_returncode()
+        except subprocess.SubprocessError:
             return self.record_fail("gmirror command failed")
 
-        status_lines = result.stdout.decode("utf-8").rstrip("\n").split("\n")
+        status_lines = result.text.rstrip("\n").split("\n")
 
         # Status should be same for the array, so just grab first line
         status = status_lines[0].split()[1]
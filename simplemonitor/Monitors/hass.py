@@ -2,13 +2,74 @@
 Home Automation monitors for SimpleMonitor
 """
 
-from typing import Tuple, cast
+import threading
+from typing import Any, Dict, Optional, Tuple, Union, cast
 
 import requests
 
+from ..util.loopcache import LoopCache
 from .monitor import Monitor, register
 
 
+class _StatesCollector:
+    """Fetch the states of all the entities in a HASS instance, once per loop.
+
+    Each collector keeps a requests Session, so the connection is reused from
+    loop to loop too."""
+
+    def __init__(self, url: str, token: Optional[str], timeout: int) -> None:
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(
+            {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+            }
+        )
+        self._states: LoopCache[Union[Dict[str, Any], Exception]] = LoopCache(
+            self._fetch
+        )
+
+    def _fetch(self) -> Union[Dict[str, Any], Exception]:
+        # failures are returned rather than raised, so every monitor in the
+        # loop gets the same failure instead of each trying again
+        try:
+            call = self.session.get(f"{self.url}/api/states", timeout=self.timeout)
+            if not call.ok:
+                raise requests.HTTPError(
+                    f"{call.status_code} {call.reason}: {call.text}", response=call
+                )
+            return {entity["entity_id"]: entity for entity in call.json()}
+        except (requests.RequestException, ValueError) as error:
+            return error
+        except (KeyError, TypeError) as error:
+            return ValueError(f"unexpected response from /api/states: {error!r}")
+
+    def get(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        """Get the state of an entity, or None if HASS doesn't have it."""
+        states = self._states.get()
+        if isinstance(states, Exception):
+            raise states
+        return states.get(entity_id)
+
+
+_collectors = {}  # type: Dict[Tuple[str, Optional[str]], _StatesCollector]
+_collectors_lock = threading.Lock()
+
+
+def _get_collector(url: str, token: Optional[str], timeout: int) -> _StatesCollector:
+    url = url.rstrip("/")
+    with _collectors_lock:
+        collector = _collectors.get((url, token))
+        if collector is None:
+            collector = _collectors[(url, token)] = _StatesCollector(
+                url, token, timeout
+            )
+        collector.timeout = max(collector.timeout, timeout)
+        return collector
+
+
 @register
 class MonitorSensor(Monitor):
     """Monitor the existence of a HASS sensor"""
@@ -29,39 +90,23 @@ class MonitorSensor(Monitor):
 
     def run_test(self) -> bool:
         try:
-            # retrieve the status from hass API
-            self.monitor_logger.debug(
-                requests.get(
-                    f"{self.url}/api/states/{self.sensor}", timeout=self.timeout
-                ).text
+            # all the sensors on the same hass share one fetch of the states
+            response = _get_collector(self.url, self.token, self.timeout).get(
+                self.sensor
             )
-            call = requests.get(
-                f"{self.url}/api/states/{self.sensor}",
-                timeout=self.timeout,
-                headers={
-                    "Authorization": f"Bearer {self.token}",
-                    "Content-Type": "application/json",
-                },
-            )
-            if not call.ok:
-                raise ValueError(call.text)
-            response = call.json()
             self.monitor_logger.debug("retrieved JSON: %s", response)
-        except requests.RequestException as error:
+        except (requests.RequestException, ValueError) as error:
             # a general issue getting to the API
             # nothing special to report, this monitor should be configured to be
             # dependent of general hass API availability
             return self.record_fail(f"cannot get info from hass: {error}")
-        else:
-            # we have a response from the API
-            # now: is the sensor defined at all in hass? If not the answer is basically empty
-            if response.get("context"):
-                if response["state"] == "unavailable":
-                    return self.record_fail(
-                        "the sensor exists but state is 'unavailable'"
-                    )
-                return self.record_success()
+        # we have a response from the API
+        # now: is the sensor defined at all in hass?
+        if response is None:
             return self.record_fail("sensor not found in hass")
+        if response.get("state") == "unavailable":
+            return self.record_fail("the sensor exists but state is 'unavailable'")
+        return self.record_success()
 
     def get_params(self) -> Tuple:
         return (self.url, self.sensor)
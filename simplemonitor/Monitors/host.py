@@ -2,16 +2,34 @@
 Monitor things on a host for SimpleMonitor
 """
 
+import fnmatch
 import os
 import re
 import shlex
 import subprocess  # nosec
+import threading
 import time
-from typing import Tuple, cast
+from collections import deque
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
 
 from markupsafe import escape
 
 from ..util import bytes_to_size_string, size_string_to_bytes
+from ..util.inotify import file_watcher
+from ..util.loopcache import LoopCache
+from ..util.runner import run_command
 from .monitor import Monitor, register
 
 try:
@@ -28,6 +46,165 @@ except ImportError:
     WIN32_AVAILABLE = False
 
 
+class HostSample:
+    """One reading of the host's load, memory, swap and disk space.
+
+    Each value is either the reading, or the exception raised trying to take it.
+    """
+
+    def __init__(self) -> None:
+        self.timestamp = time.time()
+        # loadavg, memory or swap -> reading
+        self.metrics = {}  # type: Dict[str, Any]
+        # partition -> (bytes free, percent free)
+        self.disks = {}  # type: Dict[str, Union[Exception, Tuple[int, float]]]
+
+
+def _read_loadavg() -> Tuple[float, float, float]:
+    return os.getloadavg()
+
+
+def _read_memory() -> Any:
+    return psutil.virtual_memory()
+
+
+def _read_swap() -> Any:
+    return psutil.swap_memory()
+
+
+def _read_disk(partition: str) -> Tuple[int, float]:
+    if Monitor.is_windows(allow_cygwin=False):
+        win_result = win32api.GetDiskFreeSpaceEx(partition)
+        return (win_result[2], float(win_result[2]) / float(win_result[1]) * 100)
+    result = os.statvfs(partition)
+    return (
+        result.f_bavail * result.f_frsize,
+        float(result.f_bavail) / float(result.f_blocks) * 100,
+    )
+
+
+class _HostSampler:
+    """Read all the host metrics the monitors need in one pass per loop.
+
+    Enabled monitors register what they need once the config is loaded (and
+    drop it when they're removed). The first monitor to run in a loop takes a
+    sample of everything registered, and the others evaluate their thresholds
+    against it. Samples are also kept for as long as the longest registered
+    window, so averages don't need extra reads."""
+
+    _readers = {
+        "loadavg": _read_loadavg,
+        "memory": _read_memory,
+        "swap": _read_swap,
+    }  # type: Dict[str, Callable[[], Any]]
+
+    def __init__(self) -> None:
+        # monitor -> the metrics and partitions it wants, and its window
+        self._wanted = {}  # type: Dict[Monitor, Tuple[Set[str], Set[str], int]]
+        self._lock = threading.Lock()
+        self._cache = LoopCache(self._take_sample)
+        self.history = deque()  # type: Deque[HostSample]
+
+    def want(
+        self,
+        monitor: Monitor,
+        metrics: Iterable[str] = (),
+        partitions: Iterable[str] = (),
+        window: int = 0,
+    ) -> None:
+        """Register a monitor's interest in some of loadavg, memory and swap,
+        and in the free space on some partitions, and how many seconds of
+        samples it averages over. Replaces what the monitor registered
+        before."""
+        with self._lock:
+            self._wanted[monitor] = (set(metrics), set(partitions), window)
+
+    def forget(self, monitor: Monitor) -> None:
+        """Drop what a monitor registered."""
+        with self._lock:
+            self._wanted.pop(monitor, None)
+
+    def sample(self) -> HostSample:
+        """Get this loop's sample."""
+        return self._cache.get()
+
+    @staticmethod
+    def _read(reader: Callable[..., Any], *args: Any) -> Any:
+        try:
+            return reader(*args)
+        except Exception as error:
+            return error
+
+    def metric(self, metric: str) -> Any:
+        """Get loadavg, memory or swap from this loop's sample.
+
+        Metrics which weren't registered when the sample was taken are read now
+        and added to it. Raises the exception from reading it, if any."""
+        sample = self.sample()
+        with self._lock:
+            if metric not in sample.metrics:
+                sample.metrics[metric] = self._read(self._readers[metric])
+            result = sample.metrics[metric]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def disk(self, partition: str) -> Tuple[int, float]:
+        """Get the free space on a partition from this loop's sample.
+
+        As for metric(), unregistered partitions are read now."""
+        sample = self.sample()
+        with self._lock:
+            if partition not in sample.disks:
+                sample.disks[partition] = self._read(_read_disk, partition)
+            result = sample.disks[partition]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def average(
+        self, metric: str, getter: Callable[[Any], float], window: int
+    ) -> Optional[float]:
+        """Average a value derived from a metric over the last window seconds."""
+        cutoff = time.time() - window
+        values = [
+            getter(sample.metrics[metric])
+            for sample in list(self.history)
+            if sample.timestamp >= cutoff
+            and metric in sample.metrics
+            and not isinstance(sample.metrics[metric], Exception)
+        ]
+        if not values:
+            return None
+        return sum(values) / len(values)
+
+    def _take_sample(self) -> HostSample:
+        sample = HostSample()
+        metrics = set()  # type: Set[str]
+        partitions = set()  # type: Set[str]
+        window = 0
+        with self._lock:
+            for (
+                wanted_metrics,
+                wanted_partitions,
+                wanted_window,
+            ) in self._wanted.values():
+                metrics.update(wanted_metrics)
+                partitions.update(wanted_partitions)
+                window = max(window, wanted_window)
+        for metric in metrics:
+            sample.metrics[metric] = self._read(self._readers[metric])
+        for partition in partitions:
+            sample.disks[partition] = self._read(_read_disk, partition)
+        self.history.append(sample)
+        while self.history[0].timestamp < sample.timestamp - window:
+            self.history.popleft()
+        return sample
+
+
+host_sampler = _HostSampler()
+
+
 @register
 class MonitorDiskSpace(Monitor):
     """Make sure we have enough disk space."""
@@ -36,29 +213,24 @@ class MonitorDiskSpace(Monitor):
 
     def __init__(self, name: str, config_options: dict) -> None:
         super().__init__(name, config_options)
-        if self.is_windows(allow_cygwin=False):
-            self.use_statvfs = False
-            if not WIN32_AVAILABLE:
-                raise RuntimeError(
-                    "win32api is not available, but is needed for DiskSpace monitor."
-                )
-        else:
-            self.use_statvfs = True
+        if self.is_windows(allow_cygwin=False) and not WIN32_AVAILABLE:
+            raise RuntimeError(
+                "win32api is not available, but is needed for DiskSpace monitor."
+            )
         self.partition = self.get_config_option("partition", required=True)
         self.limit = size_string_to_bytes(
             self.get_config_option("limit", required=True)
         )
 
+    def post_config_setup(self) -> None:
+        if self.enabled:
+            host_sampler.want(self, partitions=[self.partition])
+        else:
+            host_sampler.forget(self)
+
     def run_test(self) -> bool:
         try:
-            if self.use_statvfs:
-                result = os.statvfs(self.partition)
-                space = result.f_bavail * result.f_frsize
-                percent = float(result.f_bavail) / float(result.f_blocks) * 100
-            else:
-                win_result = win32api.GetDiskFreeSpaceEx(self.partition)
-                space = win_result[2]
-                percent = float(win_result[2]) / float(win_result[1]) * 100
+            space, percent = host_sampler.disk(self.partition)
         except Exception as error:
             return self.record_fail("Couldn't get free disk space: %s" % error)
 
@@ -79,6 +251,9 @@ class MonitorDiskSpace(Monitor):
 
         return "Checking for at least %s free space on %s" % (limit, self.partition)
 
+    def unload(self) -> None:
+        host_sampler.forget(self)
+
     def get_params(self) -> Tuple:
         return (self.limit, self.partition)
 
@@ -107,10 +282,17 @@ class MonitorFileStat(Monitor):
         else:
             self.maxsize = None
         self.filename = self.get_config_option("filename", required=True)
+        self.watch = cast(
+            bool,
+            self.get_config_option("watch", required_type="bool", default=False),
+        )
 
     def run_test(self) -> bool:
         try:
-            statinfo = os.stat(self.filename)
+            if self.watch:
+                statinfo = file_watcher.stat(self.filename)  # type: Any
+            else:
+                statinfo = os.stat(self.filename)
         except FileNotFoundError:
             return self.record_fail("File %s does not exist" % self.filename)
         except Exception as error:
@@ -157,6 +339,165 @@ class MonitorFileStat(Monitor):
         return (self.filename, self.minsize, self.maxage)
 
 
+@register
+class MonitorFileStatGlob(Monitor):
+    """Make sure every file matching a pattern isn't too old and/or too small.
+
+    The directory is read with os.scandir(), so the stat() data comes from the
+    directory listing where the platform provides it. The directory's mtime is
+    remembered; if it hasn't changed (and it was last changed well before the
+    scan), no files have been added or removed, and if only the age is being checked, only files which failed last time (and
+    so might have been updated since) are stat()ed again.
+    """
+
+    monitor_type = "filestat_glob"
+
+    # filesystem timestamps can be coarse, and lag the clock, so a directory
+    # changed within this long of a scan may not get a new mtime
+    MTIME_SLACK_NS = 1_000_000_000
+
+    def __init__(self, name: str, config_options: dict) -> None:
+        super().__init__(name, config_options)
+        path = cast(str, self.get_config_option("path", required=True))
+        if os.path.isdir(path):
+            self.directory, self.pattern = path, "*"
+        else:
+            self.directory, self.pattern = os.path.split(path)
+            if not self.pattern:
+                self.pattern = "*"
+        if any(char in self.directory for char in "*?["):
+            raise ValueError("only the last component of path may be a glob")
+        self.path = os.path.join(self.directory, self.pattern)
+        self._regexp = re.compile(fnmatch.translate(os.path.normcase(self.pattern)))
+        self.maxage = self.get_config_option("maxage", required_type="int", minimum=0)
+        _minsize = self.get_config_option(
+            "minsize", required_type="str", allow_empty=True
+        )
+        self.minsize = size_string_to_bytes(_minsize) if _minsize else None
+        _maxsize = self.get_config_option(
+            "maxsize", required_type="str", allow_empty=True
+        )
+        self.maxsize = size_string_to_bytes(_maxsize) if _maxsize else None
+        self.min_count = cast(
+            int,
+            self.get_config_option(
+                "min_count", required_type="int", minimum=0, default=1
+            ),
+        )
+        self._dir_mtime = None  # type: Optional[int]
+        self._scanned_at = 0
+        # name -> (size, mtime) for the matching files
+        self._files = {}  # type: Dict[str, Tuple[int, float]]
+
+    def _scan(self) -> None:
+        """Re-read the directory."""
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not self._regexp.match(os.path.normcase(entry.name)):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    statinfo = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files[entry.name] = (statinfo.st_size, statinfo.st_mtime)
+        self._files = files
+
+    def _restat(self, names: List[str]) -> None:
+        for name in names:
+            try:
+                statinfo = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                self._files.pop(name, None)
+                continue
+            self._files[name] = (statinfo.st_size, statinfo.st_mtime)
+
+    def _problem(self, size: int, age: float) -> Optional[Tuple[float, str]]:
+        """Check one file, returning how bad it is and why, or None if it's OK.
+
+        The badness is only used to pick the worst file; age problems rank by
+        age, and are worse than size problems."""
+        if self.maxage and age > self.maxage:
+            return (age, "age is %d, should be < %d seconds" % (age, self.maxage))
+        if self.minsize and size < self.minsize:
+            return (-1, "size is %d, should be >= %d bytes" % (size, self.minsize))
+        if self.maxsize and size > self.maxsize:
+            return (-1, "size is %d, should be <= %d bytes" % (size, self.maxsize))
+        return None
+
+    def _failures(self, now: float) -> Dict[str, Tuple[float, str]]:
+        failures = {}
+        for name, (size, mtime) in self._files.items():
+            problem = self._problem(size, now - mtime)
+            if problem is not None:
+                failures[name] = problem
+        return failures
+
+    def run_test(self) -> bool:
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime_ns
+            if (
+                dir_mtime != self._dir_mtime
+                or dir_mtime >= self._scanned_at - self.MTIME_SLACK_NS
+            ):
+                scanned_at = time.time_ns()
+                self._scan()
+                self._dir_mtime = dir_mtime
+                self._scanned_at = scanned_at
+            elif self.minsize or self.maxsize:
+                # files may have changed size without the directory changing
+                self._restat(list(self._files))
+            else:
+                # files can only have become younger since we last looked, so
+                # only the ones which were too old need checking again
+                self._restat(list(self._failures(time.time())))
+        except FileNotFoundError:
+            self._dir_mtime = None
+            return self.record_fail("Directory %s does not exist" % self.directory)
+        except Exception as error:
+            self._dir_mtime = None
+            return self.record_fail("Unable to check files: %s" % error)
+
+        count = len(self._files)
+        if count < self.min_count:
+            return self.record_fail(
+                "Found %d files matching %s, wanted at least %d"
+                % (count, self.path, self.min_count)
+            )
+        now = time.time()
+        failures = self._failures(now)
+        if failures:
+            worst = max(failures, key=lambda name: failures[name][0])
+            return self.record_fail(
+                "%d of %d files failed; worst is %s: %s"
+                % (len(failures), count, worst, failures[worst][1])
+            )
+        if count == 0:
+            return self.record_success("No files match %s" % self.path)
+        oldest = min(mtime for _, mtime in self._files.values())
+        return self.record_success(
+            "%d files OK (oldest: %d seconds)" % (count, now - oldest)
+        )
+
+    def describe(self) -> str:
+        clauses = []
+        if self.maxage:
+            clauses.append("not older than %d seconds" % self.maxage)
+        if self.minsize:
+            clauses.append("not smaller than %d bytes" % self.minsize)
+        if self.maxsize:
+            clauses.append("not larger than %d bytes" % self.maxsize)
+        desc = "Checking files matching %s" % self.path
+        if clauses:
+            desc = desc + " are " + " and ".join(clauses)
+        return desc
+
+    def get_params(self) -> Tuple:
+        return (self.path, self.minsize, self.maxsize, self.maxage, self.min_count)
+
+
 @register
 class MonitorApcupsd(Monitor):
     """Monitor an APC UPS (with apcupsd) to make sure it's ONLINE.
@@ -181,10 +522,7 @@ class MonitorApcupsd(Monitor):
             else:
                 executable = "apcaccess"
         try:
-            _output = subprocess.check_output(executable)  # nosec
-            output = _output.decode("utf-8")  # type: str
-        except subprocess.CalledProcessError as error:
-            output = error.output
+            output = run_command([executable]).text
         except OSError as error:
             return self.record_fail("Could not run {0}: {1}".format(executable, error))
         except Exception as error:
@@ -246,26 +584,23 @@ class MonitorPortAudit(Monitor):
             if self.path == "":
                 self.path = "/usr/local/sbin/portaudit"
             try:
-                # nosec
-                _output = subprocess.check_output([self.path, "-a", "-X", "1"])  # nosec
-                output = _output.decode("utf-8")
-            except subprocess.CalledProcessError as error:
-                output = error.output
+                result = run_command(
+                    [self.path, "-a", "-X", "1"], patterns=[self.regexp], anchored=True
+                )
             except OSError as error:
                 return self.record_fail("Error running %s: %s" % (self.path, error))
             except Exception as error:
                 return self.record_fail("Error running portaudit: %s" % error)
 
-            for line in output.splitlines():
-                matches = self.regexp.match(line)
-                if matches:
-                    count = int(matches.group(1))
-                    # sanity check
-                    if count == 0:
-                        return self.record_success()
-                    if count == 1:
-                        return self.record_fail("1 problem")
-                    return self.record_fail("%d problems" % count)
+            matches = result.match(self.regexp)
+            if matches:
+                count = int(matches.group(1))
+                # sanity check
+                if count == 0:
+                    return self.record_success()
+                if count == 1:
+                    return self.record_fail("1 problem")
+                return self.record_fail("%d problems" % count)
             return self.record_success()
         except Exception as error:
             return self.record_fail("Could not run portaudit: %s" % error)
@@ -294,10 +629,9 @@ class MonitorPkgAudit(Monitor):
             if self.path == "":
                 self.path = "/usr/local/sbin/pkg"
             try:
-                _output = subprocess.check_output([self.path, "audit"])  # nosec
-                output = _output.decode("utf-8")
-            except subprocess.CalledProcessError as error:
-                output = error.output.decode("utf-8")
+                result = run_command(
+                    [self.path, "audit"], patterns=[self.regexp], anchored=True
+                )
             except OSError as error:
                 return self.record_fail(
                     "Failed to run %s audit: {0} {1}".format(self.path, error)
@@ -305,16 +639,15 @@ class MonitorPkgAudit(Monitor):
             except Exception as error:
                 return self.record_fail("Error running pkg audit: {0}".format(error))
 
-            for line in output.splitlines():
-                matches = self.regexp.match(line)
-                if matches:
-                    count = int(matches.group(1))
-                    # sanity check
-                    if count == 0:
-                        return self.record_success()
-                    if count == 1:
-                        return self.record_fail("1 problem")
-                    return self.record_fail("%d problems" % count)
+            matches = result.match(self.regexp)
+            if matches:
+                count = int(matches.group(1))
+                # sanity check
+                if count == 0:
+                    return self.record_success()
+                if count == 1:
+                    return self.record_fail("1 problem")
+                return self.record_fail("%d problems" % count)
             return self.record_success()
         except Exception as error:
             return self.record_fail("Could not run pkg: %s" % error)
@@ -338,6 +671,12 @@ class MonitorLoadAvg(Monitor):
             "max", required_type="float", default=1.00, minimum=0
         )
 
+    def post_config_setup(self) -> None:
+        if self.enabled:
+            host_sampler.want(self, metrics=["loadavg"])
+        else:
+            host_sampler.forget(self)
+
     def describe(self) -> str:
         if self.which == 0:
             return "Checking 1min loadavg is <= %0.2f" % self.max
@@ -347,7 +686,7 @@ class MonitorLoadAvg(Monitor):
 
     def run_test(self) -> bool:
         try:
-            loadavg = os.getloadavg()
+            loadavg = host_sampler.metric("loadavg")
         except Exception as error:
             return self.record_fail("Exception getting loadavg: %s" % error)
 
@@ -355,6 +694,9 @@ class MonitorLoadAvg(Monitor):
             return self.record_fail("%0.2f" % loadavg[self.which])
         return self.record_success("%0.2f" % loadavg[self.which])
 
+    def unload(self) -> None:
+        host_sampler.forget(self)
+
     def get_params(self) -> Tuple:
         return (self.which, self.max)
 
@@ -374,17 +716,38 @@ class MonitorMemory(Monitor):
             int,
             self.get_config_option("percent_free", required_type="int", required=True),
         )
+        self.window = cast(
+            int,
+            self.get_config_option("window", required_type="int", default=0, minimum=0),
+        )
+
+    def post_config_setup(self) -> None:
+        if self.enabled:
+            host_sampler.want(self, metrics=["memory"], window=self.window)
+        else:
+            host_sampler.forget(self)
+
+    @staticmethod
+    def _percent_free(stats: Any) -> int:
+        return int(stats.available / stats.total * 100)
 
     def run_test(self) -> bool:
         if psutil is None:
             return self.record_fail("psutil is not installed")
-        stats = psutil.virtual_memory()
-        percent = int(stats.available / stats.total * 100)
+        percent: float = self._percent_free(host_sampler.metric("memory"))
         message = "{}% free".format(percent)
+        if self.window:
+            average = host_sampler.average("memory", self._percent_free, self.window)
+            if average is not None:
+                percent = average
+                message = "{:.0f}% free (average over {}s)".format(average, self.window)
         if percent < self.percent_free:
             return self.record_fail(message)
         return self.record_success(message)
 
+    def unload(self) -> None:
+        host_sampler.forget(self)
+
     def get_params(self) -> Tuple:
         return (self.percent_free,)
 
@@ -407,17 +770,38 @@ class MonitorSwap(Monitor):
             int,
             self.get_config_option("percent_free", required_type="int", required=True),
         )
+        self.window = cast(
+            int,
+            self.get_config_option("window", required_type="int", default=0, minimum=0),
+        )
+
+    def post_config_setup(self) -> None:
+        if self.enabled:
+            host_sampler.want(self, metrics=["swap"], window=self.window)
+        else:
+            host_sampler.forget(self)
+
+    @staticmethod
+    def _percent_free(stats: Any) -> float:
+        return 100 - stats.percent
 
     def run_test(self) -> bool:
         if psutil is None:
             return self.record_fail("psutil is not installed")
-        stats = psutil.swap_memory()
-        percent = 100 - stats.percent
+        percent = self._percent_free(host_sampler.metric("swap"))
         message = f"{percent:.2f}% free"
+        if self.window:
+            average = host_sampler.average("swap", self._percent_free, self.window)
+            if average is not None:
+                percent = average
+                message = f"{average:.2f}% free (average over {self.window}s)"
         if percent < self.percent_free:
             return self.record_fail(message)
         return self.record_success(message)
 
+    def unload(self) -> None:
+        host_sampler.forget(self)
+
     def get_params(self) -> Tuple:
         return (self.percent_free,)
 
@@ -440,15 +824,14 @@ class MonitorZap(Monitor):
 
     def run_test(self) -> bool:
         try:
-            _output = subprocess.check_output(["ztscan", str(self.span)])  # nosec
-            output = _output.decode("utf-8")
-            for line in output:
-                matches = self.r.match(line)
-                if matches:
-                    status = matches.group("status")
-                    if status != "OK":
-                        return self.record_fail("status is %s" % status)
-                    return self.record_success()
+            result = run_command(["ztscan", str(self.span)], patterns=[self.r])
+            result.check_returncode()
+            matches = result.match(self.r)
+            if matches:
+                status = matches.group("status")
+                if status != "OK":
+                    return self.record_fail("status is %s" % status)
+                return self.record_success()
             return self.record_fail("Error getting status")
         except Exception as error:
             return self.record_fail("Error running ztscan: %s" % error)
@@ -490,15 +873,27 @@ class MonitorCommand(Monitor):
 
         command = self.get_config_option("command", required=True, allow_empty=False)
         self.command = shlex.split(command)
+        self.timeout = self.get_config_option(
+            "timeout", required_type="float", minimum=1
+        )
 
     def run_test(self) -> bool:
         try:
-            _out = subprocess.check_output(self.command)  # nosec
+            result = run_command(self.command, timeout=self.timeout)
+            result.check_returncode()
+            _out = result.output
             if self.result_regexp is not None:
-                out = _out.decode("utf-8")
+                # the regexp may span lines, so it's matched against the
+                # (capped) output rather than line by line
+                out = _out.decode("utf-8", errors="replace")
                 matches = self.result_regexp.search(out)
                 if matches:
                     return self.record_success()
+                if result.truncated:
+                    return self.record_fail(
+                        "could not match regexp in the first %d bytes of out"
+                        % len(_out)
+                    )
                 return self.record_fail("could not match regexp in out")
             if self.result_max is not None:
                 outasinteger = int(_out)
@@ -15,13 +15,16 @@ import logging
 import platform
 import subprocess  # nosec
 import time
+import weakref
 from typing import (
     TYPE_CHECKING,
     Any,
+    Callable,
     Dict,
     List,
     NoReturn,
     Optional,
+    Sequence,
     Tuple,
     Union,
     cast,
@@ -55,6 +58,7 @@ class Monitor:
     last_error_count = 0
     last_run_duration = 0
     skip_dep = None  # type: Optional[str]
+    probe_ttl = 0
 
     failures = 0
     last_failure = None  # type: Optional[arrow.Arrow]
@@ -75,6 +79,7 @@ class Monitor:
         self._config_options = config_options
         self.name = name
         self._deps = []  # type: List[str]
+        self._state_listeners = []  # type: List[weakref.WeakMethod]
         self.monitor_logger = logging.getLogger("simplemonitor.monitor-" + self.name)
         self._dependencies = cast(
             List[str],
@@ -116,6 +121,12 @@ class Monitor:
             self.gps = None
 
         self.slug = cast(Optional[str], self.get_config_option("slug"))
+        self.probe_ttl = cast(
+            int,
+            self.get_config_option(
+                "probe_ttl", required_type="int", minimum=0, default=0
+            ),
+        )
 
         self.running_on = short_hostname()
         self._state = MonitorState.UNKNOWN
@@ -226,12 +237,37 @@ class Monitor:
         """Override this method to return a list of parameters (for logging)"""
         raise NotImplementedError
 
+    def probe_key(self) -> Optional[Tuple]:
+        """Override this method to let identical monitors share a probe.
+
+        Return a hashable key which is the same for any two monitors whose
+        run_test() would do exactly the same check (including the message
+        they'd record), or None to always run the test."""
+        return None
+
     def set_mon_refs(self, mmm: Dict[str, "Monitor"]) -> None:
         """Save a weak reference to all Monitors.
 
         Only used by CompoundMonitor for now."""
         pass
 
+    def add_state_listener(self, listener: Callable[["Monitor"], None]) -> None:
+        """Call a method whenever this monitor records a result.
+
+        The listener is called with this monitor as its argument. Only a weak
+        reference to the (bound) method is kept."""
+        ref = weakref.WeakMethod(listener)
+        if ref not in self._state_listeners:
+            self._state_listeners.append(ref)
+
+    def _notify_state_listeners(self) -> None:
+        for ref in list(self._state_listeners):
+            listener = ref()
+            if listener is None:
+                self._state_listeners.remove(ref)
+            else:
+                listener(self)
+
     def set_sm_ref(self, sm: "SimpleMonitor") -> None:
         """Save a weak reference to the SimpleMonitor instance.
 
@@ -290,6 +326,7 @@ class Monitor:
         self.success_count = 0
         self.tests_run += 1
         self.uptime_start = None
+        self._notify_state_listeners()
         return False
 
     def record_success(self, message: str = "") -> bool:
@@ -305,6 +342,7 @@ class Monitor:
         self.success_count += 1
         self.tests_run += 1
         self.last_result = message
+        self._notify_state_listeners()
         return True
 
     def record_skip(self, which_dep: Optional[str]) -> bool:
@@ -465,17 +503,23 @@ class Monitor:
         """any post config setup needed"""
         pass
 
+    def unload(self) -> None:
+        """Tidy up when the monitor is removed (e.g. by a config reload)."""
+        pass
+
     def __getstate__(self) -> dict:
         """Loggers (the Python kind, not the SimpleMonitor kind) can't be serialized.
         In order to work around that, we omit them when getting serialized (for
-        being sent over the network).
+        being sent over the network). The same goes for the state listeners.
         """
         serialize_dict = dict(self.__dict__)
         del serialize_dict["monitor_logger"]
+        serialize_dict.pop("_state_listeners", None)
         return serialize_dict
 
     def __setstate__(self, state: dict) -> None:
         self.__dict__.update(state)
+        self._state_listeners = []
         self._set_monitor_logger()
 
     def _set_monitor_logger(self) -> None:
@@ -495,6 +539,10 @@ class Monitor:
         monitor.__setstate__(load_dict)
         return monitor
 
+    def update_from_python_dict(self, changes: dict) -> None:
+        """Update the monitor state from part of a to_python_dict() dict"""
+        self.__dict__.update(changes)
+
     def get_downtime(self) -> UpDownTime:
         """Get monitor downtime"""
         first_failure_time = self.first_failure_time()
@@ -540,6 +588,159 @@ class Monitor:
         return self.describe()
 
 
+class RemoteMonitor(Monitor):
+    """The state of a monitor on a remote instance.
+
+    Remote monitors are never run here, so rather than recreate the remote
+    monitor's own class (which we might not have), we just keep the state
+    alerters and loggers look at.
+
+    Once a record has been published in SimpleMonitor.remote_monitors, other
+    threads may be reading it, so it must not be changed; use updated() to
+    make a new record with the changes instead.
+
+    The Monitor methods which only make sense for a monitor we run (such as
+    should_run() and the recovery commands) are overridden to do nothing.
+    """
+
+    # the fields of a monitor's to_python_dict() we keep, and their defaults
+    defaults = {
+        "name": "unnamed",
+        "_state": MonitorState.UNKNOWN,
+        "error_count": 0,
+        "last_result": "",
+        "_tolerance": 0,
+        "_failed_at": None,
+        "uptime_start": None,
+        "success_count": 0,
+        "tests_run": 0,
+        "last_error_count": 0,
+        "last_run_duration": 0,
+        "skip_dep": None,
+        "failures": 0,
+        "last_failure": None,
+        "last_update": None,
+        "_first_load": None,
+        "unavailable_seconds": 0,
+        "_urgent": True,
+        "_notify": True,
+        "group": ["default"],
+        "remote_alerting": False,
+        "recover_info": "",
+        "recovered_info": "",
+        "_minimum_gap": 0,
+        "failure_doc": None,
+        "enabled": True,
+        "gps": None,
+        "slug": None,
+        "running_on": "",
+        "_dependencies": [],
+        "ran_this_time": False,
+    }  # type: Dict[str, Any]
+    fields = frozenset(defaults)
+
+    # Monitor has no __slots__, so records still get a __dict__, but keeping
+    # the fields in slots means it's only created if something sets another
+    # attribute
+    __slots__ = tuple(defaults) + (
+        "monitor_type",
+        "description",
+        "origin",
+        "via",
+        "_deps",
+        "_state_listeners",
+    )
+
+    monitor_logger = logging.getLogger("simplemonitor.monitor-remote")
+    probe_ttl = 0
+
+    def __init__(
+        self,
+        name: str,
+        monitor_type: str,
+        data: dict,
+        description: Optional[str] = None,
+        origin: Optional[str] = None,
+        via: Sequence[str] = (),
+    ) -> None:
+        # Monitor.__init__ would parse config options we don't have
+        for key, value in self.defaults.items():
+            setattr(self, key, value)
+        self.name = name
+        self.monitor_type = monitor_type
+        self.description = description
+        # the name of the instance we got this monitor from, and the hostnames
+        # of the instances it was relayed through to get here (if any)
+        self.origin = origin
+        self.via = tuple(via)
+        self._deps = []
+        self._state_listeners = []
+        self.update_from_python_dict(data)
+
+    def update_from_python_dict(self, changes: dict) -> None:
+        for key in self.fields.intersection(changes):
+            setattr(self, key, changes[key])
+
+    def updated(
+        self,
+        changes: dict,
+        description: Optional[str] = None,
+        via: Optional[Sequence[str]] = None,
+    ) -> "RemoteMonitor":
+        """Return a copy of this record with the changes applied."""
+        record = RemoteMonitor.__new__(RemoteMonitor)
+        for key in self.__slots__:
+            setattr(record, key, getattr(self, key))
+        record._state_listeners = list(self._state_listeners)
+        if description is not None:
+            record.description = description
+        if via is not None:
+            record.via = tuple(via)
+        record.update_from_python_dict(changes)
+        return record
+
+    def to_python_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.defaults}
+
+    def __getstate__(self) -> dict:
+        return {
+            key: getattr(self, key)
+            for key in self.__slots__
+            if key != "_state_listeners"
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        for key, value in state.items():
+            setattr(self, key, value)
+        self._state_listeners = []
+
+    def get_config_option(self, key: str, **kwargs: Any) -> Any:
+        raise RuntimeError("Remote monitors have no config")
+
+    def run_test(self) -> bool:
+        raise RuntimeError("Remote monitors can't be run")
+
+    def should_run(self) -> bool:
+        return False
+
+    def attempt_recover(self) -> None:
+        # recovery commands are run by the instance which runs the monitor
+        pass
+
+    def run_recovered(self) -> None:
+        pass
+
+    def describe(self) -> str:
+        if self.description is None:
+            return "(Remote {} monitor did not send a description.)".format(
+                self.monitor_type
+            )
+        return self.description
+
+    def get_params(self) -> Tuple:
+        return ()
+
+
 (register, get_class, all_types) = subclass_dict_handler(
     "simplemonitor.Monitors.monitor", Monitor, "monitor_type"
 )
@@ -9,12 +9,15 @@ import socket
 import ssl
 import subprocess  # nosec
 import sys
-from typing import List, Optional, Pattern, Tuple, Union, cast
+import threading
+import time
+from typing import Dict, List, Optional, Pattern, Tuple, Union, cast
 
 import arrow
 import requests
 from requests.auth import HTTPBasicAuth
 
+from ..util.resolver import create_connection, resolver
 from .monitor import Monitor, register
 
 try:
@@ -199,6 +202,24 @@ class MonitorHTTP(Monitor):
     def get_params(self) -> Tuple:
         return (self.url, self.regexp_text, self.allowed_codes)
 
+    def probe_key(self) -> Optional[Tuple]:
+        return (
+            self.monitor_type,
+            self.method,
+            self.url,
+            self.regexp_text,
+            tuple(self.allowed_codes),
+            self.allow_redirects,
+            self.verify_hostname,
+            self.request_timeout,
+            self.username,
+            self.password,
+            self.cert,
+            json.dumps(self.headers, sort_keys=True),
+            self.data,
+            json.dumps(self.json, sort_keys=True),
+        )
+
 
 @register
 class MonitorTCP(Monitor):
@@ -221,14 +242,22 @@ class MonitorTCP(Monitor):
 
     def run_test(self) -> bool:
         """Check the port is open on the remote host"""
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            sock.settimeout(5.0)
-            sock.connect((self.host, self.port))
+            sock, resolve_time, connect_time = create_connection(
+                (self.host, self.port), timeout=5.0
+            )
+        except socket.gaierror as exception:
+            return self.record_fail(
+                "Failed to resolve {}: {}".format(self.host, exception)
+            )
         except OSError as exception:
             return self.record_fail(str(exception))
         sock.close()
-        return self.record_success()
+        return self.record_success(
+            "connected in {:0.3f}s (resolved in {:0.3f}s)".format(
+                connect_time, resolve_time
+            )
+        )
 
     def describe(self) -> str:
         """Explains what this instance is checking"""
@@ -237,6 +266,9 @@ class MonitorTCP(Monitor):
     def get_params(self) -> Tuple:
         return (self.host, self.port)
 
+    def probe_key(self) -> Optional[Tuple]:
+        return (self.monitor_type, self.host.lower(), self.port)
+
 
 @register
 class MonitorHost(Monitor):
@@ -320,6 +352,14 @@ class MonitorHost(Monitor):
     def get_params(self) -> Tuple:
         return (self.host,)
 
+    def probe_key(self) -> Optional[Tuple]:
+        return (
+            self.monitor_type,
+            self.ping_command % self.host.lower(),
+            self.ping_regexp,
+            self.time_regexp,
+        )
+
 
 @register
 class MonitorDNS(Monitor):
@@ -402,6 +442,9 @@ class MonitorDNS(Monitor):
     def get_params(self) -> Tuple:
         return (self.path,)
 
+    def probe_key(self) -> Optional[Tuple]:
+        return (self.monitor_type, tuple(self.params), self.desired_val)
+
 
 @register
 class MonitorPing(Monitor):
@@ -426,13 +469,17 @@ class MonitorPing(Monitor):
         if "icmplib" not in sys.modules:
             return self.record_fail("Missing required icmplib module")
         try:
-            result = ping(self.host, count=self.count, timeout=self.timeout)
+            addresses, resolve_time = resolver.resolve(self.host, None)
+            address = addresses[0][4][0]
+            result = ping(address, count=self.count, timeout=self.timeout)
             if result.is_alive:
                 return self.record_success(
-                    "RTT for {}: {:0.3f}ms".format(result.address, result.avg_rtt)
+                    "RTT for {}: {:0.3f}ms (resolved in {:0.3f}s)".format(
+                        result.address, result.avg_rtt, resolve_time
+                    )
                 )
             return self.record_fail(f"Host {result.address} is not alive")
-        except NameLookupError:
+        except (NameLookupError, socket.gaierror):
             return self.record_fail(f"Failed to resolve {self.host}")
         except SocketPermissionError:
             return self.record_fail(
@@ -443,6 +490,9 @@ class MonitorPing(Monitor):
     def get_params(self) -> Tuple:
         return (self.host, self.timeout, self.count)
 
+    def probe_key(self) -> Optional[Tuple]:
+        return (self.monitor_type, self.host.lower(), self.timeout, self.count)
+
     def describe(self) -> str:
         return "Checking {} pings within {} seconds ({} attempt(s))".format(
             self.host, self.timeout, self.count
@@ -455,6 +505,15 @@ class MonitorTLSCert(Monitor):
 
     monitor_type = "tls_expiry"
 
+    # SSLContexts are expensive to build (load_default_certs() parses the whole
+    # CA bundle), so they are shared by all instances, one per hostname-check
+    # setting.
+    _ssl_contexts = {}  # type: Dict[bool, ssl.SSLContext]
+    _ssl_contexts_lock = threading.Lock()
+
+    # The expiry date of each host:port:sni we've seen, and when we fetched it.
+    _expiry_cache = {}  # type: Dict[Tuple[str, int, Optional[str]], Tuple[datetime.datetime, float]]
+
     def __init__(self, name: str, config_options: Optional[dict]) -> None:
         if config_options is None:
             config_options = {}
@@ -470,60 +529,110 @@ class MonitorTLSCert(Monitor):
         if self.min_days < 0:
             raise ValueError("min_days must be 0 or greater")
         self.sni = cast(Optional[str], self.get_config_option("sni", required=False))
+        self.refresh_interval = cast(
+            int,
+            self.get_config_option(
+                "refresh_interval", required_type="int", default=86400, minimum=0
+            ),
+        )
+
+    @classmethod
+    def _get_ssl_context(cls, check_hostname: bool) -> ssl.SSLContext:
+        with cls._ssl_contexts_lock:
+            if check_hostname not in cls._ssl_contexts:
+                ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+                ssl_context.verify_mode = ssl.CERT_REQUIRED
+                ssl_context.check_hostname = check_hostname
+                ssl_context.load_default_certs()
+                cls._ssl_contexts[check_hostname] = ssl_context
+            return cls._ssl_contexts[check_hostname]
+
+    def _cached_expiry(self) -> Optional[datetime.datetime]:
+        """Get the cached expiry date, if it's recent and not close to the limit."""
+        cached = self._expiry_cache.get((self.host, self.port, self.sni))
+        if cached is None:
+            return None
+        expiry, fetched = cached
+        if time.time() - fetched >= self.refresh_interval:
+            return None
+        if (expiry - datetime.datetime.utcnow()).days <= self.min_days:
+            # close to (or past) the limit; check the real thing
+            return None
+        return expiry
 
     def run_test(self) -> bool:
-        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-        ssl_context.verify_mode = ssl.CERT_REQUIRED
-        ssl_context.check_hostname = bool(self.sni)
-        ssl_context.load_default_certs()
-
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            with ssl_context.wrap_socket(
-                sock, server_hostname=self.sni if self.sni else None
-            ) as ssl_sock:
-                try:
-                    ssl_sock.connect((self.host, self.port))
-                except socket.gaierror as error:
-                    self.monitor_logger.exception("Failed to connect socket")
-                    return self.record_fail("Failed to connect: {}".format(error))
-                except ssl.CertificateError as error:
-                    self.monitor_logger.exception(
-                        "SSL certification validation error: %s", error.verify_message
-                    )
-                    return self.record_fail(
-                        "SSL validation error: {}".format(error.verify_message)
-                    )
-                except ssl.SSLError as error:
-                    self.monitor_logger.exception("SSL Error: %s", error.reason)
-                    return self.record_fail("SSL Error: {}".format(error.reason))
+        expiry = self._cached_expiry()
+        if expiry is not None:
+            self.monitor_logger.debug("Using cached expiry date %s", expiry)
+            return self._check_expiry(expiry)
+
+        ssl_context = self._get_ssl_context(bool(self.sni))
+        try:
+            sock, resolve_time, _ = create_connection((self.host, self.port))
+        except socket.gaierror as error:
+            self.monitor_logger.exception("Failed to resolve %s", self.host)
+            return self.record_fail("Failed to connect: {}".format(error))
+        except OSError as error:
+            self.monitor_logger.exception("Failed to connect socket")
+            return self.record_fail("Failed to connect: {}".format(error))
+        self.monitor_logger.debug("Resolved %s in %0.3fs", self.host, resolve_time)
+        with sock:
+            try:
+                ssl_sock = ssl_context.wrap_socket(
+                    sock, server_hostname=self.sni if self.sni else None
+                )
+            except ssl.CertificateError as error:
+                self.monitor_logger.exception(
+                    "SSL certification validation error: %s", error.verify_message
+                )
+                return self.record_fail(
+                    "SSL validation error: {}".format(error.verify_message)
+                )
+            except ssl.SSLError as error:
+                self.monitor_logger.exception("SSL Error: %s", error.reason)
+                return self.record_fail("SSL Error: {}".format(error.reason))
+            with ssl_sock:
                 cert = ssl_sock.getpeercert()
-                if not cert:
-                    return self.record_fail("Did not receive certificate")
-                not_after = str(cert["notAfter"])
-                expiry = datetime.datetime.strptime(not_after, r"%b %d %H:%M:%S %Y %Z")
-                delta = expiry - datetime.datetime.utcnow()
-                days_left = delta.days
-                if days_left < self.min_days:
-                    if days_left < 0:
-                        return self.record_fail(
-                            "Certificate at {}:{} expired {} days ago".format(
-                                self.host, self.port, abs(days_left)
-                            )
-                        )
-                    return self.record_fail(
-                        "Certificate at {}:{} expires in {} days".format(
-                            self.host, self.port, days_left
-                        )
-                    )
-                return self.record_success(
-                    "Certificate at {}:{} has {} days left to expiry".format(
-                        self.host, self.port, days_left
+        if not cert:
+            return self.record_fail("Did not receive certificate")
+        not_after = str(cert["notAfter"])
+        expiry = datetime.datetime.strptime(not_after, r"%b %d %H:%M:%S %Y %Z")
+        self._expiry_cache[(self.host, self.port, self.sni)] = (expiry, time.time())
+        return self._check_expiry(expiry)
+
+    def _check_expiry(self, expiry: datetime.datetime) -> bool:
+        delta = expiry - datetime.datetime.utcnow()
+        days_left = delta.days
+        if days_left < self.min_days:
+            if days_left < 0:
+                return self.record_fail(
+                    "Certificate at {}:{} expired {} days ago".format(
+                        self.host, self.port, abs(days_left)
                     )
                 )
+            return self.record_fail(
+                "Certificate at {}:{} expires in {} days".format(
+                    self.host, self.port, days_left
+                )
+            )
+        return self.record_success(
+            "Certificate at {}:{} has {} days left to expiry".format(
+                self.host, self.port, days_left
+            )
+        )
 
     def get_params(self) -> Tuple:
         return (self.host, self.port, self.min_days)
 
+    def probe_key(self) -> Optional[Tuple]:
+        return (
+            self.monitor_type,
+            self.host.lower(),
+            self.port,
+            self.sni,
+            self.min_days,
+        )
+
     def describe(self) -> str:
         return "Checking TLS cert at {}:{} {}has at least {} days until expiry".format(
             self.host,
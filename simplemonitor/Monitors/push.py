@@ -0,0 +1,282 @@
+"""
+Push (heartbeat) monitoring for SimpleMonitor
+
+Jobs which can't be polled, such as cron jobs and batch workers, make an HTTP
+request to /ping/<slug> when they run. The requests are received by a small
+HTTP server running in its own thread, which just records when each slug was
+last pinged; the monitors only look at that table.
+"""
+
+import hmac
+import logging
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple, cast
+from urllib.parse import parse_qs, urlsplit
+
+from .monitor import Monitor, register
+
+_SLUG = re.compile(r"^[A-Za-z0-9_.~-]+$")
+
+module_logger = logging.getLogger("simplemonitor.monitor-push")
+
+
+class HeartbeatTable:
+    """When each slug was last pinged, and whether the job said it failed.
+
+    Only slugs which a monitor has asked for are recorded, so the table can't
+    be grown by pinging random URLs."""
+
+    def __init__(self) -> None:
+        self._last_seen = {}  # type: Dict[str, Optional[Tuple[float, bool]]]
+        # monitor -> the slug it expects
+        self._wanted = {}  # type: Dict[Monitor, str]
+        self._lock = threading.Lock()
+        self.started = None  # type: Optional[float]
+
+    def expect(self, slug: str, monitor: Optional[Monitor] = None) -> None:
+        """Start accepting pings for a slug (for a monitor, which replaces any
+        slug it expected before)."""
+        with self._lock:
+            if monitor is not None:
+                old_slug = self._wanted.get(monitor)
+                self._wanted[monitor] = slug
+                if old_slug is not None and old_slug != slug:
+                    self._drop_unwanted(old_slug)
+            self._last_seen.setdefault(slug, None)
+
+    def forget(self, monitor: Monitor) -> None:
+        """Stop accepting pings for a monitor's slug, unless another monitor
+        also expects it."""
+        with self._lock:
+            slug = self._wanted.pop(monitor, None)
+            if slug is not None:
+                self._drop_unwanted(slug)
+
+    def _drop_unwanted(self, slug: str) -> None:
+        if slug not in self._wanted.values():
+            self._last_seen.pop(slug, None)
+
+    def ping(self, slug: str, failed: bool = False) -> bool:
+        """Record a ping. Returns False if the slug isn't expected."""
+        with self._lock:
+            if slug not in self._last_seen:
+                return False
+            self._last_seen[slug] = (time.time(), failed)
+        return True
+
+    def last_seen(self, slug: str) -> Optional[Tuple[float, bool]]:
+        """Get the time of the last ping for a slug and if it reported failure."""
+        return self._last_seen.get(slug)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._last_seen.clear()
+            self._wanted.clear()
+
+
+heartbeats = HeartbeatTable()
+
+
+class _PingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # send each response in one packet, rather than waiting for delayed ACKs
+    wbufsize = 4096
+    disable_nagle_algorithm = True
+    server: "_PushServer"
+
+    def _handle(self) -> None:
+        if not self._discard_body():
+            self._respond(400, b"bad Content-Length\n")
+            return
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        failed = len(parts) == 3 and parts[2] == "fail"
+        if (
+            len(parts) not in [2, 3]
+            or parts[0] != "ping"
+            or (len(parts) == 3 and not failed)
+        ):
+            self._respond(404, b"not found\n")
+            return
+        if self.server.key is not None:
+            supplied = (
+                self.headers.get("X-Push-Key")
+                or parse_qs(url.query).get("key", [""])[0]
+            )
+            if not hmac.compare_digest(supplied.encode(), self.server.key):
+                self._respond(403, b"forbidden\n")
+                return
+        if not self.server.table.ping(parts[1], failed):
+            self._respond(404, b"unknown slug\n")
+            return
+        self._respond(200, b"OK\n")
+
+    def _discard_body(self) -> bool:
+        """Read any body the client sent, so the connection can be reused.
+
+        If it can't be (cheaply) read, the connection is closed after the
+        response instead. Returns False if the Content-Length is invalid."""
+        if self.headers.get("Transfer-Encoding"):
+            # not worth decoding a chunked body just to throw it away
+            self.close_connection = True
+            return True
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            return False
+        if length > 65536:
+            self.close_connection = True
+        elif length > 0:
+            self.rfile.read(length)
+        return True
+
+    def _respond(self, code: int, body: bytes) -> None:
+        self.send_response_only(code)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_GET = _handle
+    do_POST = _handle
+    do_HEAD = _handle
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        # logging every ping is too expensive at high rates
+        pass
+
+
+class _PushServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        table: HeartbeatTable,
+        key: Optional[bytes],
+        ipv4_only: bool,
+    ) -> None:
+        self.table = table
+        self.key = key
+        if not ipv4_only and (address[0] == "" or ":" in address[0]):
+            self.address_family = socket.AF_INET6
+        super().__init__(address, _PingHandler)
+
+    def server_bind(self) -> None:
+        if self.address_family == socket.AF_INET6:
+            self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, False)
+        super().server_bind()
+
+
+class PushListener(threading.Thread):
+    """Receive heartbeat pings over HTTP.
+
+    Like the network Listener, this isn't a Monitor itself; it runs in a
+    daemon thread and updates the table the push monitors read."""
+
+    def __init__(
+        self,
+        port: int,
+        bind_host: str = "",
+        key: Optional[str] = None,
+        ipv4_only: bool = False,
+        table: HeartbeatTable = heartbeats,
+    ) -> None:
+        super().__init__(daemon=True)
+        self.table = table
+        self.settings = (port, bind_host, key, ipv4_only)
+        _key = key.encode("utf-8") if key else None
+        try:
+            self.server = _PushServer((bind_host, port), table, _key, ipv4_only)
+        except OSError:
+            if ipv4_only or bind_host != "":
+                raise
+            # no IPv6 support; fall back to IPv4
+            self.server = _PushServer((bind_host, port), table, _key, True)
+
+    @property
+    def port(self) -> int:
+        return cast(int, self.server.server_address[1])
+
+    def run(self) -> None:
+        if self.table.started is None:
+            self.table.started = time.time()
+        module_logger.info("Listening for pushes on port %d", self.port)
+        self.server.serve_forever()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.table.started = None
+
+
+@register
+class MonitorPush(Monitor):
+    """Check a job has pinged us recently."""
+
+    monitor_type = "push"
+
+    def __init__(self, name: str, config_options: dict) -> None:
+        super().__init__(name, config_options)
+        self.push_slug = cast(
+            str, self.get_config_option("push_slug", default=self.name)
+        )
+        if not _SLUG.match(self.push_slug):
+            raise ValueError(
+                "push_slug {} must only contain letters, digits, '-', '_', '.' "
+                "and '~'".format(self.push_slug)
+            )
+        self.max_age = cast(
+            int,
+            self.get_config_option(
+                "max_age", required_type="int", required=True, minimum=1
+            ),
+        )
+        self._created = time.time()
+        heartbeats.expect(self.push_slug, self)
+
+    def run_test(self) -> bool:
+        if heartbeats.started is None:
+            return self.record_fail(
+                "Push listener is not running; set push_port in [monitor]"
+            )
+        now = time.time()
+        seen = heartbeats.last_seen(self.push_slug)
+        if seen is None:
+            waited = now - max(heartbeats.started, self._created)
+            if waited > self.max_age:
+                return self.record_fail("No ping in %d seconds" % waited)
+            return self.record_success("Waiting for first ping")
+        last_ping, failed = seen
+        age = now - last_ping
+        if failed:
+            return self.record_fail("Job reported failure %d seconds ago" % age)
+        if age > self.max_age:
+            return self.record_fail(
+                "Last ping was %d seconds ago, should be < %d seconds"
+                % (age, self.max_age)
+            )
+        return self.record_success("Last ping was %d seconds ago" % age)
+
+    def unload(self) -> None:
+        heartbeats.forget(self)
+
+    def describe(self) -> str:
+        return "Checking /ping/%s is requested at least every %d seconds" % (
+            self.push_slug,
+            self.max_age,
+        )
+
+    def get_params(self) -> Tuple:
+        return (self.push_slug, self.max_age)
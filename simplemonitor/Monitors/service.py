@@ -7,11 +7,13 @@ import os
 import platform
 import re
 import subprocess
-import time
-from typing import Any, List, Optional, Tuple, Union, cast
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Pattern, Tuple, Union, cast
 
 import psutil
 
+from ..util.loopcache import LoopCache
+from ..util.runner import run_command
 from .monitor import Monitor, register
 
 try:
@@ -42,8 +44,10 @@ class MonitorSvc(Monitor):
         if self.path == "":
             return self.record_fail("Path is not configured")
         try:
-            result = subprocess.check_output(self.params).decode()
-            matches = self.regexp.search(result)
+            output = run_command(self.params, patterns=[self.regexp])
+            output.check_returncode()
+            result = output.text
+            matches = output.match(self.regexp)
             if not matches:
                 return self.record_fail(result)
 
@@ -172,13 +176,9 @@ class MonitorRC(Monitor):
         if platform.system() in ["Microsoft", "CYGWIN_NT-6.0"]:
             return self.record_fail("Cannot run this monitor on a non-UNIX host.")
         try:
-            returncode = subprocess.check_call([self.script_path, "status"])
+            returncode = run_command([self.script_path, "status"]).returncode
             if returncode == self.want_return_code:
                 return self.record_success()
-        except subprocess.CalledProcessError as error:
-            if error.returncode == self.want_return_code:
-                return self.record_success()
-            returncode = -1
         except Exception as error:
             return self.record_fail("Exception while executing script: %s" % error)
         return self.record_fail(
@@ -222,17 +222,15 @@ class MonitorUnixService(Monitor):
 
     def run_test(self) -> bool:
         try:
-            result = subprocess.run(
+            result = run_command(
                 [
                     "service",
                     *(["-j", self.jail] if self.jail else []),
                     self.service_name,
                     "status",
                 ],
-                check=False,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-            )  # nosec
+                stderr=subprocess.DEVNULL,
+            )
             returncode = result.returncode
         except subprocess.SubprocessError as exception:
             return self.record_fail(
@@ -253,6 +251,20 @@ class MonitorUnixService(Monitor):
         return "Checking service {} is {}".format(self.service_name, self.want_state)
 
 
+class _SystemdUnits:
+    """A snapshot of systemd's unit list, indexed by unit name."""
+
+    def __init__(self, units: List[Any]) -> None:
+        self.units = units
+        self.by_name = {unit[0]: unit for unit in units}  # type: Dict[str, Any]
+
+
+def _system_bus() -> Any:
+    if pydbus is None:
+        raise RuntimeError("pydbus module not installed")
+    return pydbus.SystemBus()
+
+
 @register
 class MonitorSystemdUnit(Monitor):
     """Monitor a systemd unit.
@@ -264,11 +276,8 @@ class MonitorSystemdUnit(Monitor):
 
     monitor_type = "systemd-unit"
 
-    # A cached shared by all instances of MonitorSystemdUnit, so a single
-    # call is done for all monitors at once.
-    _listunit_cache = []  # type: List[Any]
-    _listunit_cache_expiry = 0
-    CACHE_LIFETIME = 1  # in seconds
+    # Returns the bus to talk to systemd on; replaceable for testing
+    bus_factory = staticmethod(_system_bus)
 
     def __init__(self, name: str, config_options: dict) -> None:
         super().__init__(name, config_options)
@@ -276,8 +285,11 @@ class MonitorSystemdUnit(Monitor):
             self.monitor_logger.critical(
                 "pydbus package is not available, cannot use MonitorSystemdUnit."
             )
-            return
         self.unit_name = cast(str, self.get_config_option("name", required=True))
+        # only real globs need a pattern; plain names are looked up directly
+        self._unit_pattern: Optional[Pattern[str]] = None
+        if any(char in self.unit_name for char in "*?["):
+            self._unit_pattern = re.compile(fnmatch.translate(self.unit_name))
         self.want_load_states = cast(
             List[str],
             self.get_config_option(
@@ -295,39 +307,42 @@ class MonitorSystemdUnit(Monitor):
             self.get_config_option("sub_states", required_type="[str]", default=[]),
         )
 
+    @classmethod
+    def _load_units(cls) -> _SystemdUnits:
+        systemd = cls.bus_factory().get(".systemd1")
+        return _SystemdUnits(list(systemd.ListUnits()))
+
     @classmethod
     def _list_units(cls) -> List[Any]:
-        if pydbus is None:
-            raise RuntimeError("pydbus module not installed")
-        if cls._listunit_cache_expiry < time.time():
-            bus = pydbus.SystemBus()
-            systemd = bus.get(".systemd1")
-            cls._listunit_cache_expiry = int(time.time()) + cls.CACHE_LIFETIME
-            cls._listunit_cache = list(systemd.ListUnits())
-        return cls._listunit_cache
+        return _systemd_units.get().units
+
+    def _find_unit(self) -> Optional[Any]:
+        units = _systemd_units.get()
+        if self._unit_pattern is None:
+            return units.by_name.get(self.unit_name)
+        for unit in units.units:
+            if self._unit_pattern.match(unit[0]):
+                return unit
+        return None
 
     def run_test(self) -> bool:
         """Check the service is in the desired state."""
-        nb_matches = 0
-        for unit in self._list_units():
-            (
-                name,
-                desc,
-                load_state,
-                active_state,
-                sub_state,
-                follower,
-                unit_path,
-                job_id,
-                job_type,
-                job_path,
-            ) = unit
-            if fnmatch.fnmatch(name, self.unit_name):
-                result = self._check_unit(name, load_state, active_state, sub_state)
-                nb_matches += 1
-                # TODO: is this right?
-                return result
-        return self.record_fail("No unit %s" % self.unit_name)
+        unit = self._find_unit()
+        if unit is None:
+            return self.record_fail("No unit %s" % self.unit_name)
+        (
+            name,
+            desc,
+            load_state,
+            active_state,
+            sub_state,
+            follower,
+            unit_path,
+            job_id,
+            job_type,
+            job_path,
+        ) = unit
+        return self._check_unit(name, load_state, active_state, sub_state)
 
     def _check_unit(
         self, name: str, load_state: str, active_state: str, sub_state: str
@@ -365,6 +380,47 @@ class MonitorSystemdUnit(Monitor):
         return "Checks unit %s is running" % self.name
 
 
+# The unit list is fetched once per loop and shared by all MonitorSystemdUnit
+# instances, so a single D-Bus call is made for all of them.
+_systemd_units = LoopCache(
+    lambda: MonitorSystemdUnit._load_units()  # pylint: disable=protected-access
+)
+
+
+class _ProcessTable:
+    """A snapshot of the process table, shared by all MonitorProcess instances.
+
+    Processes are indexed by each of their names (process name, basename of the
+    executable, and argv[0]), and by name and username together, so each
+    monitor's check is a dictionary lookup."""
+
+    def __init__(self) -> None:
+        self._by_name: Dict[str, List[psutil.Process]] = defaultdict(list)
+        self._by_name_user: Dict[Tuple[str, Optional[str]], List[psutil.Process]] = (
+            defaultdict(list)
+        )
+        for process in psutil.process_iter(["name", "exe", "cmdline", "username"]):
+            names = {process.info["name"]}
+            if process.info["exe"]:
+                names.add(os.path.basename(process.info["exe"]))
+            if process.info["cmdline"]:
+                names.add(process.info["cmdline"][0])
+            names.discard(None)
+            names.discard("")
+            for name in names:
+                self._by_name[name].append(process)
+                self._by_name_user[(name, process.info["username"])].append(process)
+
+    def find(self, name: str, username: Optional[str] = None) -> List[psutil.Process]:
+        """Get the processes which match the name, and username if given."""
+        if username is None:
+            return list(self._by_name.get(name, []))
+        return list(self._by_name_user.get((name, username), []))
+
+
+_process_table = LoopCache(_ProcessTable)
+
+
 @register
 class MonitorProcess(Monitor):
     """Check for a running process."""
@@ -397,19 +453,7 @@ class MonitorProcess(Monitor):
     def _find_process_by_name(
         name: str, username: Optional[str] = None
     ) -> List[psutil.Process]:
-        processes = []
-        for process in psutil.process_iter(["name", "exe", "cmdline", "username"]):
-            if (
-                name == process.info["name"]
-                or (
-                    process.info["exe"]
-                    and os.path.basename(process.info["exe"]) == name
-                )
-                or (process.info["cmdline"] and process.info["cmdline"][0] == name)
-            ):
-                if username is None or username == process.info["username"]:
-                    processes.append(process)
-        return processes
+        return _process_table.get().find(name, username)
 
     def run_test(self) -> bool:
         if psutil is None:
@@ -459,20 +503,19 @@ class MonitorEximQueue(Monitor):
 
     def run_test(self) -> bool:
         try:
-            _output = subprocess.check_output([self.path, "-xc"])
-            output = _output.decode("utf-8")
-            for line in output.splitlines():
-                matches = self.r.match(line)
-                if matches:
-                    count = int(matches.group("count"))
-                    # total = int(matches.group("total"))
-                    if count > self.max_length:
-                        if count == 1:
-                            return self.record_fail("%d message queued" % count)
-                        return self.record_fail("%d messages queued" % count)
+            result = run_command([self.path, "-xc"], patterns=[self.r], anchored=True)
+            result.check_returncode()
+            matches = result.match(self.r)
+            if matches:
+                count = int(matches.group("count"))
+                # total = int(matches.group("total"))
+                if count > self.max_length:
                     if count == 1:
-                        return self.record_success("%d message queued" % count)
-                    return self.record_success("%d messages queued" % count)
+                        return self.record_fail("%d message queued" % count)
+                    return self.record_fail("%d messages queued" % count)
+                if count == 1:
+                    return self.record_success("%d message queued" % count)
+                return self.record_success("%d messages queued" % count)
             return self.record_fail("Error getting queue size")
         except Exception as error:
             return self.record_fail("Error running exiqgrep: %s" % error)
@@ -508,12 +551,12 @@ class MonitorWindowsDHCPScope(Monitor):
 
     def run_test(self) -> bool:
         try:
-            output = str(
-                subprocess.check_output(
-                    ["netsh", "dhcp", "server", "scope", self.scope, "show", "clients"]
-                )
+            result = run_command(
+                ["netsh", "dhcp", "server", "scope", self.scope, "show", "clients"],
+                patterns=[self.r],
             )
-            matches = self.r.search(output)
+            result.check_returncode()
+            matches = result.match(self.r)
             if matches:
                 clients = int(matches.group("clients"))
                 if clients > self.max_used:
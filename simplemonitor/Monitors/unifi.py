@@ -3,19 +3,161 @@ UniFi monitoring for SimpleMonitor
 """
 
 import re
-from typing import Dict, NoReturn, Union, cast
+import threading
+import time
+from typing import Callable, Dict, List, NoReturn, Optional, Tuple, Union, cast
 
 from paramiko.client import RejectPolicy, SSHClient
 from paramiko.ssh_exception import SSHException
 
 from .monitor import Monitor, register
 
+_SessionKey = Tuple[str, int, str, Optional[str], Optional[str]]
 
-@register
-class MonitorUnifiFailover(Monitor):
-    """Monitor USG WAN Failover"""
 
-    monitor_type = "unifi_failover"
+class _SSHSession:
+    """An SSH connection to one router, and when it was last used."""
+
+    def __init__(self) -> None:
+        self.client = None  # type: Optional[SSHClient]
+        self.last_used = 0.0
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+
+class SSHSessionPool:
+    """Keep one authenticated SSH connection open to each router.
+
+    Connections are shared by all the monitors which talk to the same router
+    (as the same user), and kept open between runs so that each check is just
+    one command on an existing connection. Keepalives are sent on idle
+    connections, and a connection which hasn't been used for idle_timeout
+    seconds is closed.
+    """
+
+    keepalive = 30
+    idle_timeout = 900
+    connect_timeout = 10
+    command_timeout = 30
+
+    def __init__(self, client_factory: Callable[[], SSHClient] = SSHClient) -> None:
+        self.client_factory = client_factory
+        self._sessions = {}  # type: Dict[_SessionKey, _SSHSession]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _connect(self, key: _SessionKey) -> SSHClient:
+        address, port, username, password, ssh_key = key
+        client = self.client_factory()
+        client.set_missing_host_key_policy(RejectPolicy)
+        client.load_system_host_keys()
+        try:
+            client.connect(
+                hostname=address,
+                port=port,
+                username=username,
+                password=password,
+                key_filename=ssh_key,
+                timeout=self.connect_timeout,
+            )
+        except Exception:
+            client.close()
+            raise
+        transport = client.get_transport()
+        if transport is not None:
+            transport.set_keepalive(self.keepalive)
+        return client
+
+    def _get_session(self, key: _SessionKey) -> _SSHSession:
+        now = time.monotonic()
+        with self._lock:
+            for other_key, session in list(self._sessions.items()):
+                if other_key == key or session.client is None:
+                    continue
+                if now - session.last_used > self.idle_timeout and (
+                    session.lock.acquire(blocking=False)
+                ):
+                    try:
+                        session.close()
+                    finally:
+                        session.lock.release()
+                    del self._sessions[other_key]
+            if key not in self._sessions:
+                self._sessions[key] = _SSHSession()
+            return self._sessions[key]
+
+    def run(
+        self,
+        address: str,
+        port: int,
+        username: str,
+        password: Optional[str],
+        ssh_key: Optional[str],
+        command: str,
+    ) -> List[str]:
+        """Run a command on a router, returning its output lines.
+
+        A connection which turns out to have died is reconnected once; any
+        other failure raises SSHException (or OSError if the router couldn't
+        be reached at all)."""
+        key = (address, port, username, password, ssh_key)
+        session = self._get_session(key)
+        with session.lock:
+            while True:
+                client = session.client
+                fresh = False
+                if client is None or not _is_active(client):
+                    session.close()
+                    client = session.client = self._connect(key)
+                    fresh = True
+                try:
+                    _, stdout, _ = client.exec_command(  # nosec
+                        command, timeout=self.command_timeout
+                    )
+                    output = stdout.read()
+                except (SSHException, EOFError, OSError) as error:
+                    session.close()
+                    if fresh:
+                        raise SSHException(str(error)) from error
+                    continue
+                session.last_used = time.monotonic()
+                return output.decode("utf-8", errors="replace").splitlines()
+
+    def close_all(self) -> None:
+        """Close every connection."""
+        with self._lock:
+            for session in self._sessions.values():
+                with session.lock:
+                    session.close()
+            self._sessions.clear()
+
+
+def _is_active(client: SSHClient) -> bool:
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+
+ssh_pool = SSHSessionPool()
+
+# Lines of the output of "ubnt-hal wlbGetStatus"
+_STATUS_LINE = re.compile(r"(interface|carrier|status|gateway) +: (\w+)")
+# Lines of the output of "ubnt-hal wlbGetWdStatus": an interface name, or one
+# of its properties
+_WATCHDOG_LINE = re.compile(
+    r"(?P<interface>[a-z]+[0-9])"
+    r"|status: (?P<status>\w+)"
+    r"|ping gateway: (?P<gateway>[^ ]+) - (?P<ping_status>\w+)"
+)
+
+
+class _UnifiMonitor(Monitor):
+    """Common setup for the monitors which SSH to a USG."""
 
     def __init__(self, name: str, config_options: dict) -> None:
         if "gap" not in config_options:
@@ -24,6 +166,12 @@ class MonitorUnifiFailover(Monitor):
         self._router_address = cast(
             str, self.get_config_option("router_address", required=True)
         )
+        self._router_port = cast(
+            int,
+            self.get_config_option(
+                "router_port", required_type="int", default=22, minimum=1
+            ),
+        )
         self._username = cast(
             str, self.get_config_option("router_username", required=True)
         )
@@ -31,51 +179,51 @@ class MonitorUnifiFailover(Monitor):
         self._ssh_key = self.get_config_option("ssh_key", required=False)
         if self._ssh_key is None and self._password is None:
             raise ValueError("must specify only one of router_password or ssh_key")
+
+    def _run_command(self, command: str) -> List[str]:
+        return ssh_pool.run(
+            self._router_address,
+            self._router_port,
+            self._username,
+            self._password,
+            self._ssh_key,
+            command,
+        )
+
+
+@register
+class MonitorUnifiFailover(_UnifiMonitor):
+    """Monitor USG WAN Failover"""
+
+    monitor_type = "unifi_failover"
+
+    def __init__(self, name: str, config_options: dict) -> None:
+        super().__init__(name, config_options)
         self._check_interface = cast(
             str, self.get_config_option("check_interface", default="eth2")
         )
 
+    @staticmethod
+    def _parse(lines: List[str]) -> Dict[str, Dict[str, str]]:
+        data = {}  # type: Dict[str, Dict[str, str]]
+        data_block = {}  # type: Dict[str, str]
+        for line in lines:
+            matches = _STATUS_LINE.match(line.strip())
+            if not matches:
+                continue
+            field, value = matches.groups()
+            if field == "interface":
+                data_block = data[value] = {}
+            else:
+                data_block[field] = value
+        return {interface: block for interface, block in data.items() if block}
+
     def run_test(self) -> Union[NoReturn, bool]:
         try:
-            with SSHClient() as client:
-                client.set_missing_host_key_policy(RejectPolicy)
-                client.load_system_host_keys()
-                client.connect(
-                    hostname=self._router_address,
-                    username=self._username,
-                    password=self._password,
-                    key_filename=self._ssh_key,
-                )
-                _, stdout, _ = client.exec_command(  # nosec
-                    "sudo /usr/sbin/ubnt-hal wlbGetStatus"
-                )
-                data = {}  # type: Dict[str, Dict[str, str]]
-                data_block = {}  # type: Dict[str, str]
-                interface = ""
-                for _line in stdout.readlines():
-                    line = _line.strip()
-                    matches = re.match(r"interface +: (\w+)", line)
-                    if matches:
-                        if interface != "" and len(data_block) > 0:
-                            data[interface] = data_block
-                            data_block = {}
-                        interface = matches.group(1)
-                        data_block = {}
-                        continue
-                    matches = re.match(r"carrier +: (\w+)", line)
-                    if matches:
-                        data_block["carrier"] = matches.group(1)
-                        continue
-                    matches = re.match(r"status +: (\w+)", line)
-                    if matches:
-                        data_block["status"] = matches.group(1)
-                        continue
-                    matches = re.match(r"gateway +: (\w+)", line)
-                    if matches:
-                        data_block["gateway"] = matches.group(1)
-                if interface != "" and len(data_block) > 0:
-                    data[interface] = data_block
-        except SSHException as error:
+            data = self._parse(
+                self._run_command("sudo /usr/sbin/ubnt-hal wlbGetStatus")
+            )
+        except (SSHException, OSError) as error:
             self.monitor_logger.exception("Failed to ssh to USG")
             return self.record_fail("Failed to ssh to USG: {}".format(error))
         if self._check_interface not in data:
@@ -116,25 +264,13 @@ class MonitorUnifiFailover(Monitor):
 
 
 @register
-class MonitorUnifiFailoverWatchdog(Monitor):
+class MonitorUnifiFailoverWatchdog(_UnifiMonitor):
     """Monitor UniFi WAN watchdog"""
 
     monitor_type = "unifi_watchdog"
 
     def __init__(self, name: str, config_options: dict) -> None:
-        if "gap" not in config_options:
-            config_options["gap"] = 300  # 5 mins
         super().__init__(name, config_options)
-        self._router_address = cast(
-            str, self.get_config_option("router_address", required=True)
-        )
-        self._username = cast(
-            str, self.get_config_option("router_username", required=True)
-        )
-        self._password = self.get_config_option("router_password", required=False)
-        self._ssh_key = self.get_config_option("ssh_key", required=False)
-        if self._ssh_key is None and self._password is None:
-            raise ValueError("must specify only one of router_password or ssh_key")
         self._primary_interface = cast(
             str, self.get_config_option("primary_interface", default="pppoe0")
         )
@@ -142,47 +278,27 @@ class MonitorUnifiFailoverWatchdog(Monitor):
             str, self.get_config_option("secondary_interface", default="eth2")
         )
 
+    @staticmethod
+    def _parse(lines: List[str]) -> Dict[str, Dict[str, str]]:
+        data = {}  # type: Dict[str, Dict[str, str]]
+        data_block = {}  # type: Dict[str, str]
+        for line in lines:
+            matches = _WATCHDOG_LINE.match(line.strip())
+            if not matches:
+                continue
+            if matches.group("interface"):
+                data_block = data[matches.group("interface")] = {}
+            elif matches.group("status"):
+                data_block["status"] = matches.group("status")
+            else:
+                data_block["gateway"] = matches.group("gateway")
+                data_block["ping_status"] = matches.group("ping_status")
+        return {interface: block for interface, block in data.items() if block}
+
     def run_test(self) -> Union[NoReturn, bool]:
         try:
-            with SSHClient() as client:
-                client.set_missing_host_key_policy(RejectPolicy)
-                client.load_system_host_keys()
-                client.connect(
-                    hostname=self._router_address,
-                    username=self._username,
-                    password=self._password,
-                    key_filename=self._ssh_key,
-                )
-                _, stdout, _ = client.exec_command(  # nosec
-                    "/usr/sbin/ubnt-hal wlbGetWdStatus"
-                )
-                data = {}  # type: Dict[str, Dict[str, str]]
-                data_block = {}  # type: Dict[str, str]
-                interface = ""
-                for _line in stdout.readlines():
-                    line = _line.strip()
-                    matches = re.match(
-                        r"([a-z]+[0-9])", line
-                    )  # two spaces and an if name
-                    if matches:
-                        if interface != "" and len(data_block) > 0:
-                            data[interface] = data_block
-                            data_block = {}
-                        interface = matches.group(1)
-                        data_block = {}
-                        continue
-                    matches = re.match(r"status: (\w+)", line)
-                    if matches:
-                        data_block["status"] = matches.group(1)
-                        continue
-                    matches = re.match(r"ping gateway: ([^ ]+) - (\w+)", line)
-                    if matches:
-                        data_block["gateway"] = matches.group(1)
-                        data_block["ping_status"] = matches.group(2)
-                        continue
-                if interface != "" and len(data_block) > 0:
-                    data[interface] = data_block
-        except SSHException as error:
+            data = self._parse(self._run_command("/usr/sbin/ubnt-hal wlbGetWdStatus"))
+        except (SSHException, OSError) as error:
             self.monitor_logger.exception("Failed to ssh to USG")
             return self.record_fail("Failed to ssh to USG: {}".format(error))
         for interface in [self._primary_interface, self._secondary_interface]:
@@ -7,6 +7,7 @@ import os
 import sys
 
 from .const import EXIT_CODE_CONFIG_FAILED
+from .oneshot import REPORT_FORMATS, check
 from .simplemonitor import SimpleMonitor
 from .version import VERSION
 
@@ -27,6 +28,7 @@ def main() -> None:
         "--version", action="version", version="%(prog)s {}".format(VERSION)
     )
     output_group = parser.add_argument_group(title="Output controls")
+    check_group = parser.add_argument_group(title="Checking from CI")
     testing_group = parser.add_argument_group(title="Test and debug tools")
     output_group.add_argument(
         "-v",
@@ -85,10 +87,11 @@ def main() -> None:
         "-j",
         "--threads",
         dest="threads",
-        default=os.cpu_count(),  # default used by the library anyway
+        default=None,
         type=int,
         help=(
-            f"number of threads to run for checking monitors (default (cpus): {os.cpu_count()})"
+            f"number of threads to run for checking monitors (default (cpus): {os.cpu_count()}; "
+            "128 with --check)"
         ),
     )
     output_group.add_argument(
@@ -110,6 +113,36 @@ def main() -> None:
             '"fail" in the name to succeed. Exit zero or non-zero accordingly'
         ),
     )
+    check_group.add_argument(
+        "--check",
+        action="store_true",
+        dest="check",
+        default=False,
+        help=(
+            "Run each monitor once, in parallel, without loggers or alerters, and "
+            "report the results. Exit non-zero if any failed"
+        ),
+    )
+    check_group.add_argument(
+        "--check-timeout",
+        dest="check_timeout",
+        default=60,
+        type=float,
+        help="Seconds each monitor may take with --check before it is failed (default: 60)",
+    )
+    check_group.add_argument(
+        "--report-format",
+        dest="report_format",
+        default="text",
+        choices=sorted(REPORT_FORMATS),
+        help="Format of the --check report (default: text)",
+    )
+    check_group.add_argument(
+        "--report-file",
+        dest="report_file",
+        default="-",
+        help="File to write the --check report to (default: standard output)",
+    )
     testing_group.add_argument(
         "--loops",
         dest="loops",
@@ -210,13 +243,31 @@ def main() -> None:
         main_logger.info("=== SimpleMonitor v%s", VERSION)
         main_logger.info("Loading main config from %s", options.config)
 
+    if options.check:
+        m = SimpleMonitor(config_file=options.config, monitors_only=True)
+        if not m.config_ok:
+            main_logger.error("Configuration not valid")
+            sys.exit(EXIT_CODE_CONFIG_FAILED)
+        if options.test:
+            main_logger.warning("Config test complete. Exiting.")
+            sys.exit(0)
+        sys.exit(
+            check(
+                m,
+                report_format=options.report_format,
+                report_file=options.report_file,
+                timeout=options.check_timeout if options.check_timeout > 0 else None,
+                max_workers=options.threads or 128,
+            )
+        )
+
     m = SimpleMonitor(
         config_file=options.config,
         no_network=options.no_network,
         max_loops=options.loops,
         heartbeat=not options.no_heartbeat,
         one_shot=options.one_shot,
-        max_workers=options.threads,
+        max_workers=options.threads or os.cpu_count(),
     )
 
     if m.config_ok:
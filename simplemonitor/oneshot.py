@@ -0,0 +1,265 @@
+"""Run every monitor once, as quickly as possible, and report the results.
+
+This is for using SimpleMonitor as a check from CI pipelines and the like. No
+loggers or alerters are set up; each monitor is started as soon as the
+monitors it depends on have finished, and the results are written as text,
+JSON or JUnit XML.
+"""
+
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET  # nosec
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple, cast
+
+from .Monitors.compound import CompoundMonitor
+from .Monitors.monitor import Monitor
+from .simplemonitor import SimpleMonitor
+from .util.loopcache import new_loop
+
+module_logger = logging.getLogger("simplemonitor.oneshot")
+
+STATUS_OK = "ok"
+STATUS_FAIL = "fail"
+STATUS_SKIP = "skip"
+STATUS_TIMEOUT = "timeout"
+
+
+class CheckResult:
+    """The outcome of one monitor's check."""
+
+    def __init__(self, name: str, monitor_type: str) -> None:
+        self.name = name
+        self.monitor_type = monitor_type
+        self.status = STATUS_SKIP
+        self.message = ""
+        self.duration = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """A skipped check doesn't count as a failure."""
+        return self.status in [STATUS_OK, STATUS_SKIP]
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "type": self.monitor_type,
+            "status": self.status,
+            "duration": round(self.duration, 3),
+            "message": self.message,
+        }
+
+
+def run_once(
+    simplemonitor: SimpleMonitor,
+    *,
+    timeout: Optional[float] = None,
+    max_workers: int = 128,
+) -> List[CheckResult]:
+    """Run each enabled monitor once, with up to max_workers at a time.
+
+    A monitor starts as soon as its dependencies have succeeded (and is
+    skipped as soon as one hasn't); compound monitors start once all their
+    monitors have finished. A monitor which takes longer than timeout seconds
+    is recorded as timed out and left running in the background."""
+    new_loop()
+    simplemonitor.reset_monitors()
+    monitors = {
+        name: monitor
+        for name, monitor in simplemonitor.monitors.items()
+        if monitor.enabled
+    }
+
+    # what each monitor is waiting for, and who is waiting for it
+    waiting = {}  # type: Dict[str, int]
+    dependents = {name: [] for name in monitors}  # type: Dict[str, List[Tuple[str, bool]]]
+    for name, monitor in monitors.items():
+        needs = {dep: True for dep in monitor.dependencies if dep in monitors}
+        if monitor.monitor_type == "compound":
+            for sub in cast(CompoundMonitor, monitor).monitors:
+                if sub in monitors:
+                    needs.setdefault(sub, False)
+        waiting[name] = len(needs)
+        for dep, is_dependency in needs.items():
+            dependents[dep].append((name, is_dependency))
+
+    results = {name: CheckResult(name, m.monitor_type) for name, m in monitors.items()}
+    blocked_by = {}  # type: Dict[str, str]
+    ready = deque(name for name, count in waiting.items() if count == 0)
+    finished = queue.Queue()  # type: queue.Queue[Tuple[str, float]]
+    running = {}  # type: Dict[str, float]
+
+    def _run(name: str) -> None:
+        start = time.monotonic()
+        try:
+            SimpleMonitor._run_monitor(monitors[name])
+        finally:
+            finished.put((name, time.monotonic() - start))
+
+    def _done(name: str) -> None:
+        succeeded = results[name].status == STATUS_OK
+        for dependent, is_dependency in dependents[name]:
+            if is_dependency and not succeeded:
+                blocked_by.setdefault(dependent, name)
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                ready.append(dependent)
+
+    while ready or running:
+        while ready and len(running) < max_workers:
+            name = ready.popleft()
+            if name in blocked_by:
+                monitors[name].record_skip(blocked_by[name])
+                results[name].message = "dependency {} did not succeed".format(
+                    blocked_by[name]
+                )
+                _done(name)
+                continue
+            running[name] = time.monotonic()
+            threading.Thread(
+                target=_run, args=(name,), name="check-" + name, daemon=True
+            ).start()
+        if not running:
+            continue
+        wait = None  # type: Optional[float]
+        if timeout is not None:
+            wait = max(0.0, min(running.values()) + timeout - time.monotonic())
+        try:
+            name, duration = finished.get(timeout=wait)
+        except queue.Empty:
+            pass
+        else:
+            if name in running:
+                del running[name]
+                _record(results[name], monitors[name], duration)
+                _done(name)
+        if timeout is None:
+            continue
+        now = time.monotonic()
+        for name, start in list(running.items()):
+            if now - start >= timeout:
+                del running[name]
+                module_logger.error("monitor %s timed out", name)
+                monitors[name].record_fail("Timed out after {}s".format(timeout))
+                results[name].status = STATUS_TIMEOUT
+                results[name].message = "Timed out after {}s".format(timeout)
+                results[name].duration = now - start
+                _done(name)
+
+    return [results[name] for name in sorted(results)]
+
+
+def _record(result: CheckResult, monitor: Monitor, duration: float) -> None:
+    result.duration = duration
+    result.message = monitor.get_result()
+    if monitor.skipped():
+        result.status = STATUS_SKIP
+    elif monitor.error_count > 0:
+        result.status = STATUS_FAIL
+    else:
+        result.status = STATUS_OK
+
+
+def _summary(results: List[CheckResult]) -> Dict[str, int]:
+    summary = {STATUS_OK: 0, STATUS_FAIL: 0, STATUS_SKIP: 0, STATUS_TIMEOUT: 0}
+    for result in results:
+        summary[result.status] += 1
+    return summary
+
+
+def format_text(results: List[CheckResult], duration: float) -> str:
+    lines = [
+        "{:<8} {} ({:.2f}s) {}".format(
+            result.status, result.name, result.duration, result.message
+        ).rstrip()
+        for result in results
+    ]
+    summary = _summary(results)
+    lines.append(
+        "{} checks: {} ok, {} failed, {} skipped, {} timed out in {:.2f}s".format(
+            len(results),
+            summary[STATUS_OK],
+            summary[STATUS_FAIL],
+            summary[STATUS_SKIP],
+            summary[STATUS_TIMEOUT],
+            duration,
+        )
+    )
+    return "\n".join(lines) + "\n"
+
+
+def format_json(results: List[CheckResult], duration: float) -> str:
+    return (
+        json.dumps(
+            {
+                "ok": all(result.ok for result in results),
+                "duration": round(duration, 3),
+                "summary": _summary(results),
+                "checks": [result.to_dict() for result in results],
+            },
+            indent=2,
+        )
+        + "\n"
+    )
+
+
+def format_junit(results: List[CheckResult], duration: float) -> str:
+    summary = _summary(results)
+    suites = ET.Element("testsuites")
+    suite = ET.SubElement(
+        suites,
+        "testsuite",
+        name="simplemonitor",
+        tests=str(len(results)),
+        failures=str(summary[STATUS_FAIL]),
+        errors=str(summary[STATUS_TIMEOUT]),
+        skipped=str(summary[STATUS_SKIP]),
+        time="{:.3f}".format(duration),
+    )
+    for result in results:
+        case = ET.SubElement(
+            suite,
+            "testcase",
+            classname="simplemonitor." + result.monitor_type,
+            name=result.name,
+            time="{:.3f}".format(result.duration),
+        )
+        if result.status == STATUS_FAIL:
+            ET.SubElement(case, "failure", message=result.message).text = result.message
+        elif result.status == STATUS_TIMEOUT:
+            ET.SubElement(case, "error", type="timeout", message=result.message)
+        elif result.status == STATUS_SKIP:
+            ET.SubElement(case, "skipped", message=result.message)
+    return ET.tostring(suites, encoding="unicode") + "\n"
+
+
+REPORT_FORMATS = {
+    "text": format_text,
+    "json": format_json,
+    "junit": format_junit,
+}  # type: Dict[str, Callable[[List[CheckResult], float], str]]
+
+
+def check(
+    simplemonitor: SimpleMonitor,
+    *,
+    report_format: str = "text",
+    report_file: str = "-",
+    timeout: Optional[float] = None,
+    max_workers: int = 128,
+) -> int:
+    """Run the monitors once and write a report. Returns the exit code."""
+    start = time.monotonic()
+    results = run_once(simplemonitor, timeout=timeout, max_workers=max_workers)
+    report = REPORT_FORMATS[report_format](results, time.monotonic() - start)
+    if report_file == "-":
+        sys.stdout.write(report)
+        sys.stdout.flush()
+    else:
+        with open(report_file, "w", encoding="utf-8") as file_handle:
+            file_handle.write(report)
+    return 0 if all(result.ok for result in results) else 1
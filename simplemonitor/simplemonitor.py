@@ -7,11 +7,25 @@ import logging
 import os
 import signal
 import sys
+import threading
 import time
+from collections import deque
 from datetime import datetime
 from pathlib import Path
 from socket import gethostname
-from typing import Any, Dict, List, Optional, Sequence, Tuple, Union, cast
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
 
 from .Alerters.alerter import Alerter
 from .Alerters.alerter import all_types as all_alerter_types
@@ -21,11 +35,16 @@ from .Loggers.logger import all_types as all_logger_types
 from .Loggers.logger import get_class as get_logger_class
 from .Loggers.network import Listener, RemoteHost
 from .Monitors.compound import CompoundMonitor
-from .Monitors.monitor import Monitor, MonitorState
+from .Monitors.monitor import Monitor, MonitorState, RemoteMonitor
 from .Monitors.monitor import all_types as all_monitor_types
 from .Monitors.monitor import get_class as get_monitor_class
+from .Monitors.push import PushListener
 from .util import check_group_match, get_config_dict
 from .util.envconfig import EnvironmentAwareConfigParser
+from .util.loopcache import new_loop
+from .util.probecache import probe_cache
+from .util.resolver import resolver
+from .util.runner import runner as command_runner
 
 module_logger = logging.getLogger("simplemonitor")
 
@@ -43,8 +62,12 @@ class SimpleMonitor:
         heartbeat: bool = True,
         one_shot: bool = False,
         max_workers: Optional[int] = None,
+        monitors_only: bool = False,
     ) -> None:
-        """Main class turn on."""
+        """Main class turn on.
+
+        With monitors_only, no loggers or alerters are set up and the network
+        listeners are disabled; only run_tests() is useful."""
         if isinstance(config_file, str):
             self._config_file = Path(config_file)
         elif isinstance(config_file, Path):
@@ -57,7 +80,13 @@ class SimpleMonitor:
         self.still_failing = []  # type: List[str]
         self.skipped = []  # type: List[str]
         self.warning = []  # type: List[str]
-        self.remote_monitors = {}  # type: Dict[str, Dict[str, Monitor]]
+        # this is replaced, rather than changed, when data arrives from a remote
+        # instance, so it can be used from other threads without a copy
+        self.remote_monitors = {}  # type: Mapping[str, Mapping[str, Monitor]]
+        self._remote_lock = threading.Lock()
+        # (time, records) for past results from remote instances, queued by
+        # the Listener thread for the loggers which keep history
+        self._backfill = deque()  # type: Deque[Tuple[float, Dict[str, Monitor]]]
 
         self.loggers = {}  # type: Dict[str, Logger]
         self.alerters = {}  # type: Dict[str, Alerter]
@@ -65,8 +94,10 @@ class SimpleMonitor:
         self._hup_file = hup_file
         self._need_hup = False
         self._hup_timestamp = None  # type: Optional[float]
-        self._no_network = no_network
+        self._no_network = no_network or monitors_only
+        self._monitors_only = monitors_only
         self._remote_listening_thread = None  # type: Optional[Listener]
+        self._push_listener = None  # type: Optional[PushListener]
         self._max_loops = max_loops
         self.config_ok = False
         self.heartbeat = heartbeat
@@ -74,6 +105,7 @@ class SimpleMonitor:
         self.pidfile = None  # type: Optional[str]
         self._max_workers = max_workers
         self._remote_hosts: dict[str, RemoteHost] = {}
+        self._compound_depth = {}  # type: Dict[str, int]
 
         self._setup_signals()
         self._load_config()
@@ -90,6 +122,20 @@ class SimpleMonitor:
         config.read(self._config_file)
 
         self.interval = config.getint("monitor", "interval")
+        resolver.configure(
+            ttl=config.getint("monitor", "dns_cache_ttl", fallback=300),
+            negative_ttl=config.getint(
+                "monitor", "dns_cache_negative_ttl", fallback=30
+            ),
+            max_size=config.getint("monitor", "dns_cache_size", fallback=1024),
+        )
+        command_runner.configure(
+            timeout=config.getfloat("monitor", "command_timeout", fallback=300),
+            max_output=config.getint(
+                "monitor", "command_max_output", fallback=1024 * 1024
+            ),
+            max_concurrent=config.getint("monitor", "max_commands", fallback=32),
+        )
         self.pidfile = config.get("monitor", "pidfile", fallback=None)
         hup_file = config.get("monitor", "hup_file", fallback=None)
         if hup_file is not None:
@@ -110,9 +156,26 @@ class SimpleMonitor:
             self._ipv4_only = cast(
                 bool, config.get("monitor", "ipv4_only", fallback=False)
             )
+            self._remote_workers = config.getint(
+                "monitor", "remote_workers", fallback=4
+            )
+            self._remote_processes = config.getint(
+                "monitor", "remote_processes", fallback=0
+            )
         else:
             self._network = False
 
+        push_port = config.getint("monitor", "push_port", fallback=0)
+        if not self._no_network and push_port > 0:
+            self._push_settings = (
+                push_port,
+                config.get("monitor", "push_bind_host", fallback=""),
+                config.get("monitor", "push_key", fallback=None),
+                config.getboolean("monitor", "ipv4_only", fallback=False),
+            )  # type: Optional[Tuple[int, str, Optional[str], bool]]
+        else:
+            self._push_settings = None
+
         monitors_files = [
             Path(config.get("monitor", "monitors", fallback="monitors.ini"))
         ]
@@ -131,11 +194,14 @@ class SimpleMonitor:
         count = self.count_monitors()
         if count == 0:
             module_logger.critical("No monitors loaded")
-        config_ok = config_ok & self._load_loggers(config)
-        config_ok = config_ok & self._load_alerters(config)
+        if not self._monitors_only:
+            config_ok = config_ok & self._load_loggers(config)
+            config_ok = config_ok & self._load_alerters(config)
         if not self._verify_dependencies():
             raise RuntimeError("Broken dependency configuration")
-        if not self.verify_alerting():
+        if not self._verify_compounds():
+            raise RuntimeError("Compound monitors form a loop")
+        if not self._monitors_only and not self.verify_alerting():
             module_logger.warning("No alerters defined and no remote logger found")
         self.config_ok = config_ok
 
@@ -154,9 +220,29 @@ class SimpleMonitor:
                 self._network_key,
                 bind_host=self._network_bind_host,
                 ipv4_only=self._ipv4_only,
+                workers=self._remote_workers,
+                processes=self._remote_processes,
             )
             self._remote_listening_thread.start()
 
+    def _start_push_thread(self) -> None:
+        if self._push_listener is not None:
+            if (
+                self._push_listener.is_alive()
+                and self._push_listener.settings == self._push_settings
+            ):
+                return
+            module_logger.info("Stopping push listener thread")
+            self._push_listener.stop()
+            self._push_listener = None
+        if self._push_settings is not None:
+            module_logger.info("Starting push listener thread")
+            port, bind_host, key, ipv4_only = self._push_settings
+            self._push_listener = PushListener(
+                port, bind_host, key=key, ipv4_only=ipv4_only
+            )
+            self._push_listener.start()
+
     def _load_monitors(self, filenames: Sequence[Union[Path, str]]) -> bool:
         """Load all the monitors from the config file."""
 
@@ -484,6 +570,40 @@ class SimpleMonitor:
                     ok = False
         return ok
 
+    def _verify_compounds(self) -> bool:
+        """Check compound monitors don't contain themselves, and work out the
+        order to run them in."""
+        depth = {}  # type: Dict[str, int]
+        in_progress = []  # type: List[str]
+
+        def _visit(name: str) -> int:
+            if name in depth:
+                return depth[name]
+            if name in in_progress:
+                loop = in_progress[in_progress.index(name) :] + [name]
+                raise ValueError(" -> ".join(loop))
+            monitor = self.monitors.get(name)
+            if monitor is None or monitor.monitor_type != "compound":
+                return 0
+            in_progress.append(name)
+            depth[name] = 1 + max(
+                (_visit(sub) for sub in cast(CompoundMonitor, monitor).monitors),
+                default=0,
+            )
+            in_progress.pop()
+            return depth[name]
+
+        for name in self.monitors:
+            try:
+                _visit(name)
+            except ValueError as error:
+                module_logger.critical(
+                    "Configuration error: compound monitors form a loop: %s", error
+                )
+                return False
+        self._compound_depth = depth
+        return True
+
     def verify_alerting(self) -> bool:
         """Sanity check the configuration to see if we have at least an
         alerter, or network logging."""
@@ -497,7 +617,8 @@ class SimpleMonitor:
         return sane
 
     def sort_joblist(self, joblist: List[str]) -> List[str]:
-        """Order a list of monitors so that compound monitors are at the end"""
+        """Order a list of monitors so that compound monitors are at the end,
+        after any compound monitors they contain"""
         new_list = []  # type: List[str]
         late_list = []  # type: List[str]
         for monitor in joblist:
@@ -505,6 +626,7 @@ class SimpleMonitor:
                 late_list.append(monitor)
             else:
                 new_list.append(monitor)
+        late_list.sort(key=lambda monitor: self._compound_depth.get(monitor, 0))
         new_list.extend(late_list)
         return new_list
 
@@ -519,6 +641,34 @@ class SimpleMonitor:
         ]
         return failed
 
+    @staticmethod
+    def _run_test(monitor: Monitor) -> None:
+        """Run a monitor's test, sharing the result with identical monitors."""
+        key = monitor.probe_key()
+        if key is None:
+            monitor.run_test()
+            return
+
+        def _probe() -> Tuple[bool, str]:
+            monitor.run_test()
+            return (monitor.error_count == 0, monitor.last_result)
+
+        # only successes are reused from earlier loops, and a failing monitor
+        # probes again every loop, so it notices when things recover
+        (success, message), shared = probe_cache.run(
+            key,
+            _probe,
+            ttl=monitor.probe_ttl if monitor.error_count == 0 else 0,
+            reuse=lambda result: result[0],
+        )
+        if not shared:
+            return
+        monitor.monitor_logger.debug("Using result of an identical probe")
+        if success:
+            monitor.record_success(message)
+        else:
+            monitor.record_fail(message)
+
     @staticmethod
     def _run_monitor(monitor: Monitor) -> bool:
         """Run a single monitor."""
@@ -528,7 +678,7 @@ class SimpleMonitor:
                 did_run = True
                 monitor.ran_this_time = True
                 start_time = time.time()
-                monitor.run_test()
+                SimpleMonitor._run_test(monitor)
                 end_time = time.time()
                 monitor.last_run_duration = int(end_time - start_time)
             else:
@@ -560,6 +710,7 @@ class SimpleMonitor:
 
     def run_tests(self) -> None:
         """Run the tests for all the monitors."""
+        new_loop()
         self.reset_monitors()
 
         joblist = [k for (k, v) in self.monitors.items() if v.enabled]
@@ -605,6 +756,7 @@ class SimpleMonitor:
         )
         new_joblist = []  # List[str]
         skiplist = []  # List[str]
+        waiting = set(joblist)
         for monitor in joblist:
             if monitor in failed:
                 module_logger.error(
@@ -615,7 +767,7 @@ class SimpleMonitor:
                 # special case handling for compound monitors
                 compound_monitor = cast(CompoundMonitor, self.monitors[monitor])
                 needed_monitors = set(compound_monitor.monitors)
-                remaining_monitors = needed_monitors & set(joblist)
+                remaining_monitors = needed_monitors & waiting
                 if remaining_monitors:
                     module_logger.debug(
                         "Added compound monitor %s to new joblist due to outstanding deps %s",
@@ -670,11 +822,10 @@ class SimpleMonitor:
                     continue
                 logger.save_result2(key, monitor)
 
-            # need to work on a copy here to prevent the dicts changing under us
-            # during the loop, as remote instances can connect and update our data
-            # unpredictably
-            for host_monitors in self.remote_monitors.copy().values():
-                for name, monitor in host_monitors.copy().items():
+            # the Listener thread doesn't change these dicts, but replaces them,
+            # so they won't change under us
+            for host_monitors in self.remote_monitors.values():
+                for name, monitor in host_monitors.items():
                     try:
                         if check_group_match(monitor.group, logger.groups):
                             logger.save_result2(name, monitor)
@@ -709,8 +860,8 @@ class SimpleMonitor:
                     module_logger.warning("monitor %s has notifications disabled", name)
             except Exception:  # pragma: no cover
                 module_logger.exception("exception caught while alerting for %s", name)
-        for host_monitors in self.remote_monitors.copy().values():
-            for name, monitor in host_monitors.copy().items():
+        for host_monitors in self.remote_monitors.values():
+            for name, monitor in host_monitors.items():
                 try:
                     if monitor.remote_alerting:
                         alerter.send_alert(name, monitor)
@@ -756,6 +907,7 @@ class SimpleMonitor:
                 module_logger.info("Removing monitor %s", monitor)
                 delete_list.append(monitor)
         for monitor in delete_list:
+            self.monitors[monitor].unload()
             del self.monitors[monitor]
         if not self._verify_dependencies():
             module_logger.critical(
@@ -809,52 +961,160 @@ class SimpleMonitor:
 
     def do_logs(self) -> None:
         """Log result for each logger."""
+        backfill = []
+        while self._backfill:
+            backfill.append(self._backfill.popleft())
         for logger in self.loggers.values():
             self.log_result(logger)
+            if backfill and logger.supports_backfill:
+                self.log_backfill(logger, backfill)
+
+    def log_backfill(
+        self, logger: Logger, backfill: List[Tuple[float, Dict[str, Monitor]]]
+    ) -> None:
+        """Give the logger remote results from the past, each at its own time."""
+        with logger:
+            for timestamp, records in backfill:
+                for name, monitor in records.items():
+                    if check_group_match(monitor.group, logger.groups):
+                        logger.save_backfill(name, monitor, timestamp)
+
+    def queue_backfill(
+        self,
+        data: Dict[str, dict],
+        hostname: str,
+        timestamp: float,
+        via: Sequence[str] = (),
+    ) -> None:
+        """Queue the monitors a remote host saved while it couldn't reach us,
+        for the loggers which keep history.
 
-    def update_remote_monitor(self, data: Dict[str, dict], hostname: str) -> None:
-        """Process a list of monitors received from a remote host."""
-        seen_monitors = []  # type: List[str]
-        if hostname not in self.remote_monitors:
-            self.remote_monitors[hostname] = {}
+        They're older than what we have for the host, so they don't replace
+        its remote monitors (and aren't alerted on)."""
+        records = {}  # type: Dict[str, Monitor]
         for name, state in data.items():
-            module_logger.info(
-                "updating remote monitor %s from host %s", name, hostname
-            )
-            if isinstance(state, dict):
-                try:
-                    remote_monitor = get_monitor_class(
-                        state["cls_type"]
-                    ).from_python_dict(state["data"])
-                    self.remote_monitors[hostname][name] = remote_monitor
-                    seen_monitors.append(name)
-                except KeyError:
-                    module_logger.exception(
-                        "Could not add remote monitor from host %s; "
-                        "possibly a monitor type we don't know?",
-                        hostname,
-                    )
-            else:
-                module_logger.critical(
-                    "Could not deserialize state of monitor %s. "
-                    "If the remote host uses an old version of "
-                    "simplemonitor, you need to upgrade.",
-                    name,
+            self._update_remote_record(records, name, state, hostname, via)
+        self._backfill.append((timestamp, records))
+
+    def update_remote_monitor(
+        self, data: Dict[str, dict], hostname: str, via: Sequence[str] = ()
+    ) -> None:
+        """Process a list of monitors received from a remote host.
+
+        via is the hostnames of the instances the monitors were relayed
+        through, if they didn't come directly from the host."""
+        seen_monitors = set()  # type: Set[str]
+        with self._remote_lock:
+            host_monitors = dict(self.remote_monitors.get(hostname, {}))
+            for name, state in data.items():
+                module_logger.debug(
+                    "updating remote monitor %s from host %s", name, hostname
                 )
-        self._trim_remote_monitors(hostname, seen_monitors)
-
-    def _trim_remote_monitors(self, hostname: str, seen_monitors: List[str]) -> None:
-        """Remove remote monitors for a host which aren't in the given list."""
-        host_monitors = self.remote_monitors[hostname]
-        forget_monitors = []
-        for name in host_monitors.keys():
-            if name not in seen_monitors:
-                module_logger.info(
-                    "forgetting remote monitor %s from host %s", name, hostname
+                if self._update_remote_record(
+                    host_monitors, name, state, hostname, via
+                ):
+                    seen_monitors.add(name)
+            self._trim_remote_monitors(host_monitors, hostname, seen_monitors)
+            self._publish_remote_monitors(hostname, host_monitors)
+
+    def update_remote_monitor_delta(
+        self,
+        data: Dict[str, dict],
+        removed: List[str],
+        hostname: str,
+        via: Sequence[str] = (),
+    ) -> None:
+        """Process changes to a remote host's monitors.
+
+        A monitor's state either has everything (if it has a cls_type), or has
+        just the fields which changed. Monitors which aren't mentioned are left
+        alone. Raises KeyError for changes to a monitor we don't have, as we
+        must have missed something from the remote host."""
+        if not data and not removed:
+            return
+        with self._remote_lock:
+            host_monitors = dict(self.remote_monitors.get(hostname, {}))
+            for name, state in data.items():
+                module_logger.debug(
+                    "updating remote monitor %s from host %s", name, hostname
                 )
-                forget_monitors.append(name)
-        for name in forget_monitors:
-            del self.remote_monitors[hostname][name]
+                if isinstance(state, dict) and "cls_type" in state:
+                    self._update_remote_record(
+                        host_monitors, name, state, hostname, via
+                    )
+                    continue
+                record = host_monitors.get(name)
+                if not isinstance(record, RemoteMonitor):
+                    raise KeyError(
+                        "changes for unknown remote monitor {} from host {}".format(
+                            name, hostname
+                        )
+                    )
+                host_monitors[name] = record.updated(state["data"])
+            for name in removed:
+                if name in host_monitors:
+                    module_logger.info(
+                        "forgetting remote monitor %s from host %s", name, hostname
+                    )
+                    del host_monitors[name]
+            self._publish_remote_monitors(hostname, host_monitors)
+
+    @staticmethod
+    def _update_remote_record(
+        host_monitors: Dict[str, Monitor],
+        name: str,
+        state: dict,
+        hostname: str,
+        via: Sequence[str] = (),
+    ) -> bool:
+        """Update (or add) a remote monitor from its full state.
+
+        The record is replaced rather than changed, as readers may be using
+        the one in the published host_monitors."""
+        if not isinstance(state, dict):
+            module_logger.critical(
+                "Could not deserialize state of monitor %s. "
+                "If the remote host uses an old version of "
+                "simplemonitor, you need to upgrade.",
+                name,
+            )
+            return False
+        try:
+            monitor_type = str(state["cls_type"])
+            data = state["data"]
+        except KeyError:
+            module_logger.exception(
+                "Could not add remote monitor %s from host %s", name, hostname
+            )
+            return False
+        record = host_monitors.get(name)
+        if isinstance(record, RemoteMonitor) and record.monitor_type == monitor_type:
+            host_monitors[name] = record.updated(data, state.get("description"), via)
+        else:
+            module_logger.info("adding remote monitor %s from host %s", name, hostname)
+            host_monitors[name] = RemoteMonitor(
+                name, monitor_type, data, state.get("description"), hostname, via
+            )
+        return True
+
+    @staticmethod
+    def _trim_remote_monitors(
+        host_monitors: Dict[str, Monitor], hostname: str, seen_monitors: Set[str]
+    ) -> None:
+        """Remove remote monitors for a host which aren't in the given set."""
+        for name in [name for name in host_monitors if name not in seen_monitors]:
+            module_logger.info(
+                "forgetting remote monitor %s from host %s", name, hostname
+            )
+            del host_monitors[name]
+
+    def _publish_remote_monitors(
+        self, hostname: str, host_monitors: Dict[str, Monitor]
+    ) -> None:
+        """Replace a host's remote monitors. Call with _remote_lock held."""
+        remote_monitors = dict(self.remote_monitors)
+        remote_monitors[hostname] = host_monitors
+        self.remote_monitors = remote_monitors
 
     @property
     def remote_hosts(self) -> dict[str, RemoteHost]:
@@ -879,6 +1139,7 @@ class SimpleMonitor:
     def run(self) -> None:
         self._create_pid_file()
         self._start_network_thread()
+        self._start_push_thread()
         module_logger.info(
             "=== Starting... (loop runs every %ds) Hit ^C to stop", self.interval
         )
@@ -899,6 +1160,7 @@ class SimpleMonitor:
                         module_logger.warning("Reloading configuration")
                         self._load_config()
                         self._start_network_thread()
+                        self._start_push_thread()
                         self.hup_loggers()
                         self._need_hup = False
                     except Exception:
@@ -926,6 +1188,9 @@ class SimpleMonitor:
                 ):
                     module_logger.error("Listener thread died :(")
                     self._start_network_thread()
+            if loop and self._push_listener and not self._push_listener.is_alive():
+                module_logger.error("Push listener thread died")
+                self._start_push_thread()
             if self.one_shot:
                 break
 
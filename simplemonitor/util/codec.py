@@ -0,0 +1,185 @@
+"""Codecs for the monitor state sent between SimpleMonitor instances.
+
+The network logger can send its data as JSON (see json_encoding), or in a
+binary format which is much quicker to decode. Each payload starts with a byte
+saying which codec made it, so a listener can accept both.
+
+The binary format is a version byte followed by the data in marshal format,
+with Arrow objects and datetimes as (tag, epoch timestamp, UTC offset) tuples
+and MonitorStates as (tag, value) tuples. Tuples are only used for these;
+other tuples become lists, as they would in JSON. Field names are interned, so
+each one is only written once per payload and marshal refers back to it after
+that.
+
+marshal must only be used on data from a trusted source, so payloads must be
+authenticated (by their MAC) before being decoded.
+"""
+
+import datetime
+import marshal
+import re
+import sys
+from typing import Any, Callable, Dict, Tuple
+
+import arrow
+from dateutil import tz
+
+from . import MonitorState
+from .json_encoding import json_dumps, json_loads
+
+# marshal format 4 is the newest, and is understood by all supported Pythons
+_MARSHAL_VERSION = 4
+_BINARY_VERSION = 1
+
+_TAG_ARROW = 0
+_TAG_DATETIME = 1
+_TAG_STATE = 2
+
+_PLAIN_TYPES = (str, int, float, bool, type(None))
+_CONTAINER_TYPES = (dict, list, tuple)
+_REGEXP_TYPE = type(re.compile(""))
+
+
+class Codec:
+    """Turn the data to send to a remote instance into bytes and back."""
+
+    name = "unknown"
+    # the first byte of everything we encode
+    prefix = b""
+
+    def encode(self, data: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, payload: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    """JSON, with the custom types encoded as magic-token objects."""
+
+    name = "json"
+    prefix = b"{"
+
+    def encode(self, data: Any) -> bytes:
+        if not isinstance(data, dict):
+            raise TypeError("Can only encode dicts")
+        return json_dumps(data)
+
+    def decode(self, payload: bytes) -> Any:
+        return json_loads(payload)
+
+
+def _pack_timestamp(tag: int, value: datetime.datetime) -> Tuple[int, float, float]:
+    offset = value.utcoffset()
+    if offset is None:
+        # naive datetimes are UTC, as for JSON
+        return (tag, value.replace(tzinfo=datetime.timezone.utc).timestamp(), 0.0)
+    return (tag, value.timestamp(), offset.total_seconds())
+
+
+def _pack(value: Any) -> Any:
+    value_type = type(value)
+    if value_type is dict:
+        return {
+            (sys.intern(key) if type(key) is str else str(key)): (
+                item if type(item) in _PLAIN_TYPES else _pack(item)
+            )
+            for key, item in value.items()
+        }
+    if value_type is list or value_type is tuple:
+        return [item if type(item) in _PLAIN_TYPES else _pack(item) for item in value]
+    if value_type in _PLAIN_TYPES:
+        return value
+    if isinstance(value, arrow.Arrow):
+        return _pack_timestamp(_TAG_ARROW, value.datetime)
+    if isinstance(value, datetime.datetime):
+        return _pack_timestamp(_TAG_DATETIME, value)
+    if isinstance(value, MonitorState):
+        return (_TAG_STATE, value.value)
+    if isinstance(value, _REGEXP_TYPE):
+        return "<removed compiled regexp object>"
+    raise TypeError("Cannot encode {}".format(value_type.__name__))
+
+
+def _unpack_arrow(value: Tuple[int, float, float]) -> arrow.Arrow:
+    if value[2] == 0:
+        return arrow.Arrow.utcfromtimestamp(value[1])
+    return arrow.Arrow.fromtimestamp(value[1], tz.tzoffset(None, value[2]))
+
+
+def _unpack_state(value: Tuple[int, int]) -> MonitorState:
+    return MonitorState(value[1])
+
+
+# datetimes become Arrow objects when decoded, as they do from JSON
+_UNPACK_TAGS = {
+    _TAG_ARROW: _unpack_arrow,
+    _TAG_DATETIME: _unpack_arrow,
+    _TAG_STATE: _unpack_state,
+}  # type: Dict[int, Callable[[Any], Any]]
+
+
+def _unpack(value: Any) -> Any:
+    """Turn the tagged tuples back into objects, in place."""
+    value_type = type(value)
+    if value_type is dict:
+        for key, item in value.items():
+            if type(item) in _CONTAINER_TYPES:
+                value[key] = _unpack(item)
+        return value
+    if value_type is list:
+        for index, item in enumerate(value):
+            if type(item) in _CONTAINER_TYPES:
+                value[index] = _unpack(item)
+        return value
+    try:
+        return _UNPACK_TAGS[value[0]](value)
+    except (KeyError, IndexError, TypeError, ValueError) as error:
+        raise ValueError("Bad tagged value {!r}".format(value)) from error
+
+
+class BinaryCodec(Codec):
+    """marshal, with the custom types as tagged tuples."""
+
+    name = "binary"
+    prefix = b"B"
+
+    def encode(self, data: Any) -> bytes:
+        if not isinstance(data, dict):
+            raise TypeError("Can only encode dicts")
+        return (
+            self.prefix
+            + bytes([_BINARY_VERSION])
+            + marshal.dumps(_pack(data), _MARSHAL_VERSION)
+        )
+
+    def decode(self, payload: bytes) -> Any:
+        if payload[1:2] != bytes([_BINARY_VERSION]):
+            raise ValueError("Unknown binary format version {!r}".format(payload[1:2]))
+        try:
+            data = marshal.loads(payload[2:])
+        except (EOFError, TypeError, ValueError) as error:
+            raise ValueError("Bad binary data: {}".format(error)) from error
+        if type(data) is not dict:
+            raise ValueError("Binary data is not a dict")
+        return _unpack(data)
+
+
+CODECS = {codec.name: codec for codec in [JSONCodec(), BinaryCodec()]}  # type: Dict[str, Codec]
+_CODECS_BY_PREFIX = {codec.prefix: codec for codec in CODECS.values()}
+
+
+def encode(data: Any, codec: str = "json") -> bytes:
+    """Encode data with the named codec."""
+    return CODECS[codec].encode(data)
+
+
+def decode(payload: bytes) -> Any:
+    """Decode data with whichever codec made it."""
+    try:
+        codec = _CODECS_BY_PREFIX[payload[:1]]
+    except KeyError as error:
+        raise ValueError(
+            "Unknown encoding {!r}; is the sender newer than us?".format(payload[:1])
+        ) from error
+    return codec.decode(payload)
@@ -0,0 +1,258 @@
+"""Watch files for changes with inotify, instead of stat()ing them every loop.
+
+The watcher subscribes to the directory containing each watched file (once per
+directory), and keeps the size and mtime of each watched file in memory,
+refreshing them only when inotify says the file changed. Monitors then read
+from that cache.
+
+inotify is only available on Linux; elsewhere (or if a directory can't be
+watched) stat() is used as before. inotify only sees changes made through the
+local kernel, so files on network filesystems which are changed by other hosts
+(for example, by another NFS client) will not be seen to change.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+from typing import Any, Dict, NamedTuple, Optional, Set
+
+module_logger = logging.getLogger("simplemonitor.util.inotify")
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+_GONE_MASK = IN_DELETE | IN_MOVED_FROM
+_DIR_GONE_MASK = IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED
+
+_EVENT = struct.Struct("iIII")
+
+
+class FileState(NamedTuple):
+    """The parts of a stat() result the file monitors use."""
+
+    st_size: int
+    st_mtime: float
+
+
+def _load_libc() -> Optional[Any]:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class FileWatcher:
+    """Keep the size and mtime of watched files up to date using inotify."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._libc = None  # type: Optional[Any]
+        self._fd = -1
+        self._thread = None  # type: Optional[threading.Thread]
+        self._unavailable = False
+        self._wds = {}  # type: Dict[int, str]
+        self._dirs = {}  # type: Dict[str, int]
+        self._names = {}  # type: Dict[str, Set[str]]
+        self._files = {}  # type: Dict[str, Optional[FileState]]
+
+    def _start(self) -> bool:
+        """Set up inotify, if we haven't already. Must hold the lock."""
+        if self._fd >= 0:
+            return True
+        if self._unavailable:
+            return False
+        self._libc = _load_libc()
+        if self._libc is None:
+            module_logger.info("inotify is not available; using stat()")
+            self._unavailable = True
+            return False
+        fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            module_logger.warning(
+                "inotify_init1 failed: %s; using stat()",
+                os.strerror(ctypes.get_errno()),
+            )
+            self._unavailable = True
+            return False
+        self._fd = fd
+        self._thread = threading.Thread(
+            target=self._read_events, name="inotify", daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def close(self) -> None:
+        """Stop watching everything."""
+        with self._lock:
+            if self._fd >= 0:
+                os.close(self._fd)
+            self._fd = -1
+            self._wds.clear()
+            self._dirs.clear()
+            self._names.clear()
+            self._files.clear()
+
+    def watch(self, path: str) -> bool:
+        """Start watching a file. Returns False if it can't be watched."""
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self._files:
+                return True
+            if not self._start():
+                return False
+            directory, name = os.path.split(path)
+            if directory not in self._dirs:
+                assert self._libc is not None
+                wd = self._libc.inotify_add_watch(
+                    self._fd, os.fsencode(directory), _WATCH_MASK
+                )
+                if wd < 0:
+                    module_logger.warning(
+                        "Could not watch %s: %s; using stat()",
+                        directory,
+                        os.strerror(ctypes.get_errno()),
+                    )
+                    return False
+                self._dirs[directory] = wd
+                self._wds[wd] = directory
+                self._names[directory] = set()
+            # stat after the watch is in place, so we can't miss a change
+            try:
+                self._files[path] = _stat(path)
+            except OSError:
+                return False
+            self._names[directory].add(name)
+        return True
+
+    def stat(self, path: str) -> FileState:
+        """Get the size and mtime of a file, from the cache if it's watched.
+
+        Raises FileNotFoundError if the file doesn't exist."""
+        path = os.path.abspath(path)
+        if self.watch(path):
+            with self._lock:
+                watched = path in self._files
+                state = self._files.get(path)
+            if watched:
+                if state is None:
+                    raise FileNotFoundError(
+                        errno.ENOENT, os.strerror(errno.ENOENT), path
+                    )
+                return state
+            # dropped by the event thread since we started watching it
+        statinfo = os.stat(path)
+        return FileState(statinfo.st_size, statinfo.st_mtime)
+
+    def _read_events(self) -> None:
+        fd = self._fd
+        while self._fd == fd:
+            try:
+                # wake up now and then to notice if we've been closed
+                readable, _, _ = select.select([fd], [], [], 1.0)
+                if not readable:
+                    continue
+                data = os.read(fd, 65536)
+            except OSError:
+                return
+            with self._lock:
+                if self._fd != fd:
+                    return
+                self._handle_events(data)
+
+    def _handle_events(self, data: bytes) -> None:
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                module_logger.warning("inotify queue overflowed; re-reading all files")
+                for path in list(self._files):
+                    self._refresh(path)
+                continue
+            directory = self._wds.get(wd)
+            if directory is None:
+                continue
+            if mask & _DIR_GONE_MASK:
+                self._forget_directory(directory)
+                continue
+            decoded = os.fsdecode(name)
+            if decoded not in self._names[directory]:
+                continue
+            path = os.path.join(directory, decoded)
+            if mask & _GONE_MASK:
+                self._files[path] = None
+            else:
+                self._refresh(path)
+
+    def _refresh(self, path: str) -> None:
+        try:
+            self._files[path] = _stat(path)
+        except OSError:
+            # let the next stat() report the problem
+            directory, name = os.path.split(path)
+            del self._files[path]
+            self._names[directory].discard(name)
+
+    def _forget_directory(self, directory: str) -> None:
+        """Stop using the cache for a directory which has gone away.
+
+        The files in it will be watched again (or stat()ed) when next asked for."""
+        module_logger.info("Watched directory %s has gone", directory)
+        wd = self._dirs.pop(directory)
+        del self._wds[wd]
+        for name in self._names.pop(directory):
+            self._files.pop(os.path.join(directory, name), None)
+        assert self._libc is not None
+        self._libc.inotify_rm_watch(self._fd, wd)
+
+
+def _stat(path: str) -> Optional[FileState]:
+    try:
+        statinfo = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return FileState(statinfo.st_size, statinfo.st_mtime)
+
+
+file_watcher = FileWatcher()
@@ -0,0 +1,70 @@
+"""Caches which live for a single run of the monitors.
+
+SimpleMonitor calls new_loop() at the start of each run of the monitors. A
+LoopCache loads its value the first time it's asked for in a loop, and every
+monitor which asks during the rest of that loop gets the same value. This lets
+many monitors share one expensive read (the process table, the systemd unit
+list, etc) without the result going stale between loops.
+"""
+
+import threading
+import time
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def new_loop() -> None:
+    """Mark the start of a new run of the monitors, expiring all LoopCaches."""
+    global _generation  # pylint: disable=global-statement
+    with _generation_lock:
+        _generation += 1
+
+
+def current_loop() -> int:
+    """Get the number of the current loop."""
+    return _generation
+
+
+class LoopCache(Generic[T]):
+    """Hold a value which is loaded at most once per loop.
+
+    If max_age is given, the value also expires after that many seconds, even
+    if no new loop has started.
+    """
+
+    def __init__(self, loader: Callable[[], T], max_age: Optional[float] = None):
+        self._loader = loader
+        self._max_age = max_age
+        self._value = None  # type: Optional[T]
+        self._generation = -1
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _is_valid(self) -> bool:
+        if self._generation != _generation:
+            return False
+        if self._max_age is not None:
+            return time.monotonic() - self._loaded_at < self._max_age
+        return True
+
+    def get(self) -> T:
+        """Get the value, loading it if needed.
+
+        Threads which ask while another is loading wait for that load."""
+        with self._lock:
+            if not self._is_valid():
+                generation = _generation
+                self._value = self._loader()
+                self._generation = generation
+                self._loaded_at = time.monotonic()
+            return self._value  # type: ignore
+
+    def invalidate(self) -> None:
+        """Forget the value, so the next get() loads it again."""
+        with self._lock:
+            self._generation = -1
+            self._value = None
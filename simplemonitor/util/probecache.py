@@ -0,0 +1,127 @@
+"""Share the results of identical probes between monitors.
+
+Several monitors often check exactly the same thing (the same URL, host:port
+or DNS record) because they're grouped or alerted on differently. A monitor
+which supports this returns a key describing its probe from probe_key(); the
+first monitor with a given key to run in a loop does the probe, and any others
+with the same key wait for and share its result instead of probing again.
+
+A monitor can also accept a result from an earlier loop if it's no older than
+its probe_ttl, which lets monitors with different gaps share a probe. Only
+results the caller's reuse check accepts (for monitors, successes) are used
+across loops.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+from .loopcache import current_loop
+
+T = TypeVar("T")
+
+
+class _Probe:
+    """A probe which is running or has finished."""
+
+    __slots__ = ("done", "error", "finished_at", "generation", "result")
+
+    def __init__(self, generation: int) -> None:
+        self.generation = generation
+        self.done = threading.Event()
+        self.result = None  # type: Any
+        self.error = None  # type: Optional[BaseException]
+        self.finished_at = 0.0
+
+
+class ProbeCache:
+    """Run each distinct probe at most once per loop (or per TTL)."""
+
+    def __init__(self) -> None:
+        self._probes = {}  # type: Dict[Hashable, _Probe]
+        self._lock = threading.Lock()
+        self._generation = -1
+        # ttl -> when it was last asked for, so results are kept for as long
+        # as a caller might still want them
+        self._ttls = {}  # type: Dict[float, float]
+
+    def clear(self) -> None:
+        """Forget all results."""
+        with self._lock:
+            self._probes.clear()
+
+    def __len__(self) -> int:
+        return len(self._probes)
+
+    @staticmethod
+    def _usable(
+        probe: _Probe,
+        generation: int,
+        ttl: float,
+        now: float,
+        reuse: Optional[Callable[[Any], bool]],
+    ) -> bool:
+        if probe.generation == generation:
+            return True
+        if ttl <= 0 or not probe.done.is_set() or probe.error is not None:
+            return False
+        if reuse is not None and not reuse(probe.result):
+            return False
+        return now - probe.finished_at <= ttl
+
+    def _prune(self, now: float) -> None:
+        for ttl in [ttl for ttl, asked in self._ttls.items() if now - asked > ttl]:
+            del self._ttls[ttl]
+        max_ttl = max(self._ttls, default=0.0)
+        for key in [
+            key
+            for key, probe in self._probes.items()
+            if probe.done.is_set() and now - probe.finished_at > max_ttl
+        ]:
+            del self._probes[key]
+
+    def run(
+        self,
+        key: Hashable,
+        run_probe: Callable[[], T],
+        ttl: float = 0,
+        reuse: Optional[Callable[[T], bool]] = None,
+    ) -> Tuple[T, bool]:
+        """Get the result of the probe with the given key, running it if needed.
+
+        A result from an earlier loop is only used if it's within ttl and, if
+        reuse is given, reuse(result) is true. Returns the result and whether
+        it came from another caller. If the probe raised, the exception is
+        raised to everyone sharing it."""
+        generation = current_loop()
+        now = time.monotonic()
+        with self._lock:
+            if ttl > 0:
+                self._ttls[ttl] = now
+            if generation != self._generation:
+                self._generation = generation
+                self._prune(now)
+            probe = self._probes.get(key)
+            if probe is not None and self._usable(probe, generation, ttl, now, reuse):
+                leader = False
+            else:
+                probe = _Probe(generation)
+                self._probes[key] = probe
+                leader = True
+        if leader:
+            try:
+                probe.result = run_probe()
+            except BaseException as exception:
+                probe.error = exception
+                raise
+            finally:
+                probe.finished_at = time.monotonic()
+                probe.done.set()
+            return (probe.result, False)
+        probe.done.wait()
+        if probe.error is not None:
+            raise probe.error
+        return (probe.result, True)
+
+
+probe_cache = ProbeCache()
@@ -0,0 +1,211 @@
+"""Caching hostname resolution for SimpleMonitor.
+
+All the network monitors share one resolver, so a host which is checked by
+several monitors (or every loop) is only looked up once per TTL. Failed lookups
+are cached too, for a shorter time, so a broken name doesn't make every check
+wait on the local resolver.
+
+getaddrinfo() doesn't tell us the TTL of the records it found, so the TTLs here
+are configured (``dns_cache_ttl`` and ``dns_cache_negative_ttl`` in the
+``[monitor]`` section) rather than taken from the answers.
+"""
+
+import logging
+import socket
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+module_logger = logging.getLogger("simplemonitor.util.resolver")
+
+AddrInfo = Tuple[Any, ...]
+_CacheKey = Tuple[str, Any, int, int, int, int]
+
+
+class _CacheEntry:
+    """A cached result (or failure) of getaddrinfo()."""
+
+    __slots__ = ("addresses", "error", "expires", "hits", "refreshing")
+
+    def __init__(
+        self,
+        addresses: List[AddrInfo],
+        error: Optional[socket.gaierror],
+        expires: float,
+    ) -> None:
+        self.addresses = addresses
+        self.error = error
+        self.expires = expires
+        self.hits = 0
+        self.refreshing = False
+
+
+class CachingResolver:
+    """A getaddrinfo() cache with TTLs, negative caching and LRU eviction.
+
+    Entries which are used often are refreshed in the background shortly
+    before they expire, so busy hosts never see a lookup in the check itself.
+    Hits are counted afresh for each answer, so a name which stops being used
+    is left to expire.
+    """
+
+    # fraction of the TTL before expiry during which a hit triggers a refresh
+    REFRESH_WINDOW = 0.2
+    # number of hits during an entry's TTL before it counts as hot
+    HOT_HITS = 2
+
+    def __init__(
+        self, ttl: int = 300, negative_ttl: int = 30, max_size: int = 1024
+    ) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._cache = OrderedDict()  # type: OrderedDict[_CacheKey, _CacheEntry]
+        self._lock = threading.Lock()
+
+    def configure(
+        self,
+        *,
+        ttl: Optional[int] = None,
+        negative_ttl: Optional[int] = None,
+        max_size: Optional[int] = None,
+    ) -> None:
+        """Change the cache settings. Existing entries are kept."""
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+            if negative_ttl is not None:
+                self.negative_ttl = negative_ttl
+            if max_size is not None:
+                self.max_size = max_size
+            self._trim()
+
+    def clear(self) -> None:
+        """Forget everything."""
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def resolve(
+        self,
+        host: str,
+        port: Any,
+        family: int = 0,
+        type: int = 0,  # pylint: disable=redefined-builtin
+        proto: int = 0,
+        flags: int = 0,
+    ) -> Tuple[List[AddrInfo], float]:
+        """Resolve a host, returning the addresses and the time spent resolving.
+
+        The time is 0 when the answer came from the cache. Failures raise
+        socket.gaierror, whether cached or not."""
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry.expires > now:
+                self._cache.move_to_end(key)
+                entry.hits += 1
+                if self._wants_refresh(entry, now):
+                    entry.refreshing = True
+                    threading.Thread(
+                        target=self._refresh, args=(key,), daemon=True
+                    ).start()
+                if entry.error is not None:
+                    raise entry.error
+                return (entry.addresses, 0.0)
+        start = time.monotonic()
+        entry = self._lookup(key)
+        duration = time.monotonic() - start
+        if entry.error is not None:
+            raise entry.error
+        return (entry.addresses, duration)
+
+    def getaddrinfo(
+        self,
+        host: str,
+        port: Any,
+        family: int = 0,
+        type: int = 0,  # pylint: disable=redefined-builtin
+        proto: int = 0,
+        flags: int = 0,
+    ) -> List[AddrInfo]:
+        """Drop-in replacement for socket.getaddrinfo()."""
+        return self.resolve(host, port, family, type, proto, flags)[0]
+
+    def _wants_refresh(self, entry: _CacheEntry, now: float) -> bool:
+        if entry.refreshing or entry.error is not None:
+            return False
+        if entry.hits < self.HOT_HITS:
+            return False
+        return entry.expires - now < self.ttl * self.REFRESH_WINDOW
+
+    def _query(self, key: _CacheKey) -> _CacheEntry:
+        """Resolve a key, without touching the cache."""
+        try:
+            addresses = socket.getaddrinfo(*key)
+            return _CacheEntry(addresses, None, time.monotonic() + self.ttl)
+        except socket.gaierror as error:
+            module_logger.debug("Failed to resolve %s: %s", key[0], error)
+            return _CacheEntry([], error, time.monotonic() + self.negative_ttl)
+
+    def _lookup(self, key: _CacheKey) -> _CacheEntry:
+        return self._store(key, self._query(key))
+
+    def _store(self, key: _CacheKey, entry: _CacheEntry) -> _CacheEntry:
+        with self._lock:
+            self._cache[key] = entry
+            self._cache.move_to_end(key)
+            self._trim()
+        return entry
+
+    def _refresh(self, key: _CacheKey) -> None:
+        module_logger.debug("Refreshing cached address for %s", key[0])
+        entry = self._query(key)
+        if entry.error is None:
+            self._store(key, entry)
+            return
+        # keep serving the last good answer until it expires
+        module_logger.warning(
+            "Background refresh for %s failed: %s", key[0], entry.error
+        )
+        with self._lock:
+            old_entry = self._cache.get(key)
+            if old_entry is not None:
+                old_entry.refreshing = False
+
+    def _trim(self) -> None:
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+
+resolver = CachingResolver()
+
+
+def create_connection(
+    address: Tuple[str, int], timeout: Optional[float] = None
+) -> Tuple[socket.socket, float, float]:
+    """Connect a TCP socket using the shared resolver cache.
+
+    Like socket.create_connection(), each resolved address is tried in turn.
+    Returns the socket, the time spent resolving and the time spent connecting.
+    """
+    host, port = address
+    addresses, resolve_time = resolver.resolve(host, port, 0, socket.SOCK_STREAM)
+    start = time.monotonic()
+    error = None  # type: Optional[OSError]
+    for family, socktype, proto, _, sockaddr in addresses:
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(sockaddr)
+            return (sock, resolve_time, time.monotonic() - start)
+        except OSError as exception:
+            error = exception
+            sock.close()
+    if error is not None:
+        raise error
+    raise OSError("getaddrinfo returned no addresses for {}".format(host))
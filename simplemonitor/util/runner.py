@@ -0,0 +1,255 @@
+"""Run external commands for SimpleMonitor.
+
+All the command-style monitors start their processes through run_command(), so
+that every child:
+
+* has a timeout, after which it (and anything it started) is killed
+* has its output captured into a buffer of bounded size
+* counts towards a global limit on concurrently-running children
+
+Output is matched against any given regexps line by line as it arrives, so a
+match is found even if it's past the point where the buffer was capped.
+
+subprocess already uses vfork()/posix_spawn() to start children where the
+platform allows, so that is left to it.
+"""
+
+import logging
+import os
+import re
+import signal
+import subprocess  # nosec
+import threading
+from typing import IO, Any, Dict, List, Optional, Pattern, Sequence, Union
+
+module_logger = logging.getLogger("simplemonitor.util.runner")
+
+_READ_SIZE = 65536
+
+
+class CommandResult:
+    """The outcome of running a command."""
+
+    def __init__(self, args: Sequence[str]) -> None:
+        self.args = list(args)
+        self.returncode = -1
+        self.output = b""
+        self.truncated = False
+        self.matches = {}  # type: Dict[Pattern[str], re.Match]
+
+    @property
+    def text(self) -> str:
+        """The captured output, decoded."""
+        return self.output.decode("utf-8", errors="replace")
+
+    def match(self, pattern: Pattern[str]) -> Optional[re.Match]:
+        """The first line match for one of the patterns given to run_command()."""
+        return self.matches.get(pattern)
+
+    def check_returncode(self) -> None:
+        """Raise CalledProcessError if the command exited non-zero."""
+        if self.returncode:
+            raise subprocess.CalledProcessError(
+                self.returncode, self.args, output=self.output
+            )
+
+
+class _CommandRunner:
+    """Settings and concurrency limit shared by all commands."""
+
+    def __init__(
+        self,
+        timeout: float = 300,
+        max_output: int = 1024 * 1024,
+        max_concurrent: int = 32,
+    ) -> None:
+        self.timeout = timeout
+        self.max_output = max_output
+        self.max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    def configure(
+        self,
+        *,
+        timeout: Optional[float] = None,
+        max_output: Optional[int] = None,
+        max_concurrent: Optional[int] = None,
+    ) -> None:
+        if timeout is not None:
+            self.timeout = timeout
+        if max_output is not None:
+            self.max_output = max_output
+        if max_concurrent is not None and max_concurrent != self.max_concurrent:
+            # commands already running hold slots on the old semaphore, which is
+            # fine: they release them back to it
+            self.max_concurrent = max_concurrent
+            self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    def run(
+        self,
+        args: Sequence[str],
+        *,
+        timeout: Optional[float] = None,
+        max_output: Optional[int] = None,
+        patterns: Sequence[Pattern[str]] = (),
+        anchored: bool = False,
+        stderr: Union[None, int, IO[Any]] = None,
+    ) -> CommandResult:
+        if timeout is None:
+            timeout = self.timeout
+        if max_output is None:
+            max_output = self.max_output
+        with self._slots:
+            return self._run(args, timeout, max_output, patterns, anchored, stderr)
+
+    @staticmethod
+    def _run(
+        args: Sequence[str],
+        timeout: float,
+        max_output: int,
+        patterns: Sequence[Pattern[str]],
+        anchored: bool,
+        stderr: Union[None, int, IO[Any]],
+    ) -> CommandResult:
+        result = CommandResult(args)
+        process = subprocess.Popen(  # nosec
+            args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            start_new_session=(os.name == "posix"),
+        )
+        timed_out = threading.Event()
+        # set (under the lock) once the child has exited, after which it mustn't
+        # be signalled as its pid may be reused once it's reaped
+        exited = threading.Event()
+        lock = threading.Lock()
+
+        def _kill() -> bool:
+            with lock:
+                if exited.is_set():
+                    return False
+                try:
+                    if os.name == "posix":
+                        os.killpg(process.pid, signal.SIGKILL)
+                    else:
+                        process.kill()
+                except OSError:
+                    pass
+                return True
+
+        def _timeout() -> None:
+            if _kill():
+                timed_out.set()
+                module_logger.warning(
+                    "Command %s timed out after %ss, killed it", args, timeout
+                )
+
+        def _reap() -> None:
+            _wait_exited(process)
+            with lock:
+                exited.set()
+            process.wait()
+
+        timer = threading.Timer(timeout, _timeout)
+        timer.daemon = True
+        timer.start()
+        buffer = bytearray()
+        pending = b""
+        unmatched = list(patterns)
+        try:
+            assert process.stdout is not None
+            while True:
+                chunk = process.stdout.read1(_READ_SIZE)  # type: ignore
+                if not chunk:
+                    break
+                room = max_output - len(buffer)
+                if len(chunk) > room:
+                    result.truncated = True
+                if room > 0:
+                    buffer += chunk[:room]
+                if not unmatched:
+                    continue
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()[:max_output]
+                _match_lines(lines, unmatched, anchored, result)
+            if pending and unmatched:
+                _match_lines([pending], unmatched, anchored, result)
+            _reap()
+        finally:
+            timer.cancel()
+            process.stdout.close()  # type: ignore
+            if not exited.is_set():
+                _kill()
+                _reap()
+        result.output = bytes(buffer)
+        result.returncode = process.returncode
+        # it may have exited by itself just before the timer fired
+        if timed_out.is_set() and (
+            os.name != "posix" or result.returncode == -signal.SIGKILL
+        ):
+            raise subprocess.TimeoutExpired(args, timeout, output=result.output)
+        return result
+
+
+def _wait_exited(process: subprocess.Popen) -> None:
+    """Wait for a child to exit, but leave it to be reaped by process.wait()."""
+    if hasattr(os, "waitid"):
+        try:
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        except ChildProcessError:
+            # already reaped (e.g. SIGCHLD is ignored)
+            pass
+    else:
+        # without waitid this reaps it, so there's a small window where the
+        # timer may signal a reaped pid
+        process.wait()
+
+
+def _match_lines(
+    lines: List[bytes],
+    unmatched: List[Pattern[str]],
+    anchored: bool,
+    result: CommandResult,
+) -> None:
+    for raw_line in lines:
+        line = raw_line.decode("utf-8", errors="replace").rstrip("\r")
+        for pattern in list(unmatched):
+            if anchored:
+                matches = pattern.match(line)
+            else:
+                matches = pattern.search(line)
+            if matches:
+                result.matches[pattern] = matches
+                unmatched.remove(pattern)
+        if not unmatched:
+            return
+
+
+runner = _CommandRunner()
+
+
+def run_command(
+    args: Sequence[str],
+    *,
+    timeout: Optional[float] = None,
+    max_output: Optional[int] = None,
+    patterns: Sequence[Pattern[str]] = (),
+    anchored: bool = False,
+    stderr: Union[None, int, IO[Any]] = None,
+) -> CommandResult:
+    """Run a command, capturing (up to max_output bytes of) its stdout.
+
+    Each pattern is searched for in each line of output (or, if anchored, must
+    match at the start of the line); the first match for each is available
+    from the result's match(). Raises OSError if the command
+    can't be started, and subprocess.TimeoutExpired if it was killed for taking
+    too long. A non-zero exit is not an error; see check_returncode()."""
+    return runner.run(
+        args,
+        timeout=timeout,
+        max_output=max_output,
+        patterns=patterns,
+        anchored=anchored,
+        stderr=stderr,
+    )
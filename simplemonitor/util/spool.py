@@ -0,0 +1,146 @@
+"""An on-disk queue of data waiting to be sent somewhere."""
+
+import logging
+import os
+import struct
+from typing import Callable, List, Optional, Tuple
+
+from . import codec
+
+module_logger = logging.getLogger("simplemonitor.util.spool")
+
+_LENGTH = struct.Struct(">I")
+
+
+class Spool:
+    """An append-only file of records (dicts) waiting to be sent.
+
+    Each record is written as its length followed by the record in the
+    binary codec. The file is kept under max_size bytes: when a record would
+    take it over, the records are passed through merge (if given), and then
+    the oldest are dropped until the rest fit.
+
+    A record only partly written (because we were killed part way through)
+    is cut off the end of the file when the spool is opened, so the records
+    appended after it can be read back."""
+
+    def __init__(
+        self,
+        path: str,
+        max_size: int,
+        merge: Optional[Callable[[List[dict]], List[dict]]] = None,
+    ) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.merge = merge
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        self._size = size
+        if size:
+            _, self._size = self._read()
+            if self._size != size:
+                module_logger.warning(
+                    "Removing %d bytes of partial record from the end of spool %s",
+                    size - self._size,
+                    self.path,
+                )
+                self._truncate()
+
+    def __len__(self) -> int:
+        """The size of the spool file in bytes."""
+        return self._size
+
+    @staticmethod
+    def _pack(record: dict) -> bytes:
+        data = codec.encode(record, "binary")
+        return _LENGTH.pack(len(data)) + data
+
+    def append(self, record: dict) -> None:
+        data = self._pack(record)
+        if self._size + len(data) > self.max_size:
+            records = self.load() + [record]
+            if self.merge is not None:
+                records = self.merge(records)
+            self.replace(records)
+            return
+        try:
+            with open(self.path, "ab") as spool_file:
+                spool_file.write(data)
+                spool_file.flush()
+                os.fsync(spool_file.fileno())
+        except OSError:
+            # don't leave part of the record behind for the next one to
+            # follow
+            self._truncate()
+            raise
+        self._size += len(data)
+
+    def _truncate(self) -> None:
+        """Cut the file back to the records we know are complete."""
+        try:
+            with open(self.path, "r+b") as spool_file:
+                spool_file.truncate(self._size)
+                spool_file.flush()
+                os.fsync(spool_file.fileno())
+        except OSError:
+            module_logger.exception("Could not truncate spool %s", self.path)
+
+    def load(self) -> List[dict]:
+        """Read all the records in the spool, oldest first."""
+        records, _ = self._read()
+        return records
+
+    def _read(self) -> Tuple[List[dict], int]:
+        """Read the complete records in the spool, and where they end."""
+        try:
+            with open(self.path, "rb") as spool_file:
+                contents = spool_file.read()
+        except FileNotFoundError:
+            return [], 0
+        records = []
+        offset = 0
+        while offset + _LENGTH.size <= len(contents):
+            (length,) = _LENGTH.unpack_from(contents, offset)
+            start = offset + _LENGTH.size
+            if start + length > len(contents):
+                break
+            try:
+                records.append(codec.decode(contents[start : start + length]))
+            except ValueError:
+                module_logger.exception("Ignoring bad record in spool %s", self.path)
+            offset = start + length
+        return records, offset
+
+    def replace(self, records: List[dict]) -> None:
+        """Replace the contents of the spool, dropping the oldest records if
+        they don't all fit."""
+        packed = [self._pack(record) for record in records]
+        total = sum(len(data) for data in packed)
+        dropped = 0
+        while packed and total > self.max_size:
+            total -= len(packed.pop(0))
+            dropped += 1
+        if dropped:
+            module_logger.warning(
+                "Spool %s is full; dropped the oldest %d records", self.path, dropped
+            )
+        if not packed:
+            self.clear()
+            return
+        temp_path = self.path + ".new"
+        with open(temp_path, "wb") as spool_file:
+            for data in packed:
+                spool_file.write(data)
+            spool_file.flush()
+            os.fsync(spool_file.fileno())
+        os.replace(temp_path, self.path)
+        self._size = total
+
+    def clear(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._size = 0
@@ -0,0 +1,64 @@
+# type: ignore
+import datetime
+import re
+import unittest
+
+import arrow
+
+from simplemonitor.Monitors.monitor import MonitorFail, MonitorNull
+from simplemonitor.util import MonitorState, codec
+
+
+class TestCodec(unittest.TestCase):
+    def round_trip(self, data, name):
+        payload = codec.encode(data, name)
+        self.assertEqual(payload[:1], codec.CODECS[name].prefix)
+        return codec.decode(payload)
+
+    def test_types(self):
+        data = {
+            "arrow": arrow.get("2020-01-02T03:04:05.123456+02:00"),
+            "utc": arrow.get("2020-01-02T03:04:05.654321+00:00"),
+            "datetime": datetime.datetime(2020, 1, 2, 3, 4, 5, 678901),
+            "state": MonitorState.FAILED,
+            "tuple": (1, "two"),
+            "nested": [{"a": None, "b": [1.5, True]}],
+            "regexp": re.compile("x"),
+        }
+        for name in codec.CODECS:
+            with self.subTest(codec=name):
+                result = self.round_trip(data, name)
+                self.assertEqual(result["arrow"], data["arrow"])
+                self.assertEqual(result["arrow"].utcoffset(), data["arrow"].utcoffset())
+                self.assertEqual(result["utc"], data["utc"])
+                self.assertEqual(
+                    result["datetime"], arrow.get("2020-01-02T03:04:05.678901+00:00")
+                )
+                self.assertIs(result["state"], MonitorState.FAILED)
+                self.assertEqual(result["tuple"], [1, "two"])
+                self.assertEqual(result["nested"], [{"a": None, "b": [1.5, True]}])
+                self.assertEqual(result["regexp"], "<removed compiled regexp object>")
+
+    def test_monitors_match(self):
+        monitors = [MonitorNull("ok", {}), MonitorFail("fail", {})]
+        for monitor in monitors:
+            monitor.run_test()
+        data = {
+            m.name: {"cls_type": m.monitor_type, "data": m.to_python_dict()}
+            for m in monitors
+        }
+        self.assertEqual(self.round_trip(data, "binary"), self.round_trip(data, "json"))
+
+    def test_bad_data(self):
+        for payload in [b"", b"X{}", b"B\x99{}", b"B\x01garbage", b"B\x01" + b"N"]:
+            with self.subTest(payload=payload):
+                with self.assertRaises(ValueError):
+                    codec.decode(payload)
+
+    def test_unknown_type(self):
+        with self.assertRaises(TypeError):
+            codec.encode({"a": object()}, "binary")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+# type: ignore
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from simplemonitor.Monitors import file
+
+
+class TestLogTail(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.log = os.path.join(self.tempdir.name, "app.log")
+        self.write("startup\nERROR: old problem\n", mode="w")
+
+    def write(self, text, mode="a"):
+        with open(self.log, mode) as f:
+            f.write(text)
+
+    def monitor(self, **options):
+        config = {"filename": self.log, "regexp": "^ERROR"}
+        config.update(options)
+        return file.MonitorLogTail("test", config)
+
+    def test_only_new_lines(self):
+        m = self.monitor()
+        m.run_test()
+        self.assertTrue(m.test_success(), m.get_result())
+        self.write("ERROR: new problem\nall fine\n")
+        m.run_test()
+        self.assertFalse(m.test_success())
+        self.assertIn("ERROR: new problem", m.get_result())
+        m.run_test()
+        self.assertTrue(m.test_success())
+
+    def test_from_start(self):
+        m = self.monitor(from_start="true")
+        with self.assertNoLogs(m.monitor_logger, "INFO"):
+            m.run_test()
+        self.assertFalse(m.test_success())
+
+    def test_max_matches(self):
+        m = self.monitor(max_matches="2")
+        m.run_test()
+        self.write("ERROR: one\nERROR: two\n")
+        m.run_test()
+        self.assertTrue(m.test_success(), m.get_result())
+        self.write("ERROR: one\nERROR: two\nERROR: three\n")
+        m.run_test()
+        self.assertFalse(m.test_success())
+
+    def test_partial_line(self):
+        m = self.monitor()
+        m.run_test()
+        self.write("ERR")
+        m.run_test()
+        self.assertTrue(m.test_success())
+        self.write("OR: finished later\n")
+        m.run_test()
+        self.assertFalse(m.test_success())
+
+    def test_window(self):
+        m = self.monitor(window="60", max_matches="1")
+        m.run_test()
+        with patch("time.time", return_value=1000):
+            self.write("ERROR: one\n")
+            m.run_test()
+            self.assertTrue(m.test_success())
+        with patch("time.time", return_value=1030):
+            self.write("ERROR: two\n")
+            m.run_test()
+            self.assertFalse(m.test_success())
+        with patch("time.time", return_value=1100):
+            m.run_test()
+            self.assertTrue(m.test_success(), m.get_result())
+
+    def test_truncated(self):
+        m = self.monitor()
+        m.run_test()
+        self.write("ERROR: after truncation\n", mode="w")
+        m.run_test()
+        self.assertFalse(m.test_success())
+
+    def test_rotated(self):
+        m = self.monitor()
+        m.run_test()
+        os.rename(self.log, self.log + ".1")
+        self.write("starting again\nERROR: in new file\n", mode="w")
+        with self.assertLogs(m.monitor_logger, "INFO") as logs:
+            m.run_test()
+        self.assertIn("was replaced", logs.output[0])
+        self.assertFalse(m.test_success())
+        self.assertIn("in new file", m.get_result())
+
+    def test_missing(self):
+        os.unlink(self.log)
+        m = self.monitor()
+        m.run_test()
+        self.assertFalse(m.test_success())
+
+    def test_state_file(self):
+        state_file = os.path.join(self.tempdir.name, "state.json")
+        m = self.monitor(state_file=state_file)
+        m.run_test()
+        self.write("ERROR: while we were down\n")
+        m = self.monitor(state_file=state_file)
+        m.run_test()
+        self.assertFalse(m.test_success())
+        m = self.monitor(state_file=state_file)
+        m.run_test()
+        self.assertTrue(m.test_success())
+        # nothing new, so the state file isn't rewritten
+        with patch("json.dump") as dump:
+            m.run_test()
+        dump.assert_not_called()
+
+    def test_matches_per_line(self):
+        m = self.monitor(regexp="error|fail")
+        m.run_test()
+        self.write("error: request failed\nerror fail error\nall fine\n")
+        m.run_test()
+        self.assertIn("2 lines matched", m.get_result())
+        m = self.monitor(regexp=r"\d+")
+        m.run_test()
+        self.write("a 1 2 3 4\n")
+        m.run_test()
+        self.assertIn("1 lines matched", m.get_result())
+        self.assertIn("a 1 2 3 4", m.get_result())
+
+    def test_chunks(self):
+        m = self.monitor()
+        m.chunk_size = 4096
+        m.run_test()
+        self.write(("x" * 100 + "\n") * 200 + "ERROR: at the end\n")
+        m.run_test()
+        self.assertFalse(m.test_success())
+        self.assertIn("1 lines matched", m.get_result())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,7 @@
 # type: ignore
-import subprocess
+import io
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import Mock, patch
 
 from simplemonitor.Monitors import gmirror
 
@@ -17,23 +17,31 @@ MOCK_OUTPUT_BAD = """gm0  DEGRADED  ada0 (ACTIVE)
 """
 
 
+def _fake_popen(output, returncode=0):
+    process = Mock()
+    process.stdout = io.BytesIO(output.encode("utf-8"))
+    # not a child of ours, so waiting for it returns at once
+    process.pid = 2**31 - 1
+    process.returncode = returncode
+    process.poll.return_value = returncode
+    process.wait.return_value = returncode
+    return process
+
+
 class TestGmirrorStatusMonitors(unittest.TestCase):
-    @patch("subprocess.run")
+    @patch("subprocess.Popen")
     def test_GmirrorStatus_success(self, mock_run):
         """Success / happy path tests."""
 
-        mock_stdout = MagicMock()
-        mock_stdout.configure_mock(**{"stdout.decode.return_value": MOCK_OUTPUT_GOOD})
-        mock_run.return_value = mock_stdout
+        mock_run.side_effect = lambda *args, **kwargs: _fake_popen(MOCK_OUTPUT_GOOD)
 
         m = gmirror.MonitorGmirrorStatus("test", DEFAULT_CONFIG_OPTIONS)
 
         m.run_test()
 
-        mock_run.assert_called_with(
+        self.assertEqual(
+            mock_run.call_args[0][0],
             ["gmirror", "status", "-gs", DEFAULT_CONFIG_OPTIONS.get("array_device")],
-            capture_output=True,
-            check=True,
         )
         self.assertEqual("Array gm0 is in state COMPLETE with 2 disks", m.get_result())
         self.assertTrue(m.test_success())
@@ -44,15 +52,13 @@ class TestGmirrorStatusMonitors(unittest.TestCase):
         self.assertTrue(m.test_success())
         self.assertEqual(m.error_count, 0)
 
-    @patch("subprocess.run")
+    @patch("subprocess.Popen")
     def test_GmirrorStatus_failedSynchronizing(self, mock_run):
         """Check failure test cases."""
 
-        mock_stdout = MagicMock()
-        mock_stdout.configure_mock(
-            **{"stdout.decode.return_value": MOCK_OUTPUT_SYNCHRONIZING}
+        mock_run.side_effect = lambda *args, **kwargs: _fake_popen(
+            MOCK_OUTPUT_SYNCHRONIZING
         )
-        mock_run.return_value = mock_stdout
 
         m = gmirror.MonitorGmirrorStatus("test", DEFAULT_CONFIG_OPTIONS)
 
@@ -68,13 +74,11 @@ class TestGmirrorStatusMonitors(unittest.TestCase):
         self.assertFalse(m.test_success())
         self.assertEqual(m.error_count, 2)
 
-    @patch("subprocess.run")
+    @patch("subprocess.Popen")
     def test_GmirrorStatus_failedMissingDisk(self, mock_run):
         """Check failure test cases."""
 
-        mock_stdout = MagicMock()
-        mock_stdout.configure_mock(**{"stdout.decode.return_value": MOCK_OUTPUT_BAD})
-        mock_run.return_value = mock_stdout
+        mock_run.side_effect = lambda *args, **kwargs: _fake_popen(MOCK_OUTPUT_BAD)
 
         m = gmirror.MonitorGmirrorStatus("test", DEFAULT_CONFIG_OPTIONS)
 
@@ -85,7 +89,7 @@ class TestGmirrorStatusMonitors(unittest.TestCase):
         self.assertFalse(m.test_success())
         self.assertEqual(m.error_count, 1)
 
-    @patch("subprocess.run")
+    @patch("subprocess.Popen")
     def test_GmirrorStatus_raiseFileNotFoundError(self, mock_run):
         """Make sure the program raises if the binary isn't present at all."""
 
@@ -95,14 +99,11 @@ class TestGmirrorStatusMonitors(unittest.TestCase):
         m = gmirror.MonitorGmirrorStatus("test", DEFAULT_CONFIG_OPTIONS)
         self.assertRaises(FileNotFoundError, m.run_test)
 
-    @patch("subprocess.run")
+    @patch("subprocess.Popen")
     def test_GmirrorStatus_failureSubprocessFailure(self, mock_run):
         """Handle failure based on command failing with non-0 exit code."""
 
-        mock_run.side_effect = subprocess.CalledProcessError(
-            1,
-            ["gmirror", "status", "-gs", DEFAULT_CONFIG_OPTIONS.get("array_device")],
-        )
+        mock_run.side_effect = lambda *args, **kwargs: _fake_popen("", returncode=1)
         m = gmirror.MonitorGmirrorStatus("test", DEFAULT_CONFIG_OPTIONS)
         m.run_test()
         self.assertFalse(m.test_success())
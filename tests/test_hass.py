@@ -0,0 +1,109 @@
+# type: ignore
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from simplemonitor.Monitors import hass
+from simplemonitor.util.loopcache import new_loop
+
+STATES = [
+    {
+        "entity_id": "sensor.temperature",
+        "state": "21.5",
+        "attributes": {},
+        "context": {"id": "1"},
+    },
+    {
+        "entity_id": "sensor.door",
+        "state": "unavailable",
+        "attributes": {},
+        "context": {"id": "2"},
+    },
+]
+
+
+class FakeHass(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.headers.get("Authorization") != "Bearer token":
+            self.send_response(401)
+            self.end_headers()
+            self.wfile.write(b"401: Unauthorized")
+            return
+        if self.path != "/api/states":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = json.dumps(STATES).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHassSensor(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeHass)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        hass._collectors.clear()
+        new_loop()
+
+    def monitor(self, sensor, token="token"):
+        return hass.MonitorSensor(
+            sensor, {"url": self.url, "sensor": sensor, "token": token}
+        )
+
+    def test_sensors(self):
+        ok = self.monitor("sensor.temperature")
+        unavailable = self.monitor("sensor.door")
+        missing = self.monitor("sensor.missing")
+        for m in [ok, unavailable, missing]:
+            m.run_test()
+        self.assertTrue(ok.test_success(), ok.get_result())
+        self.assertFalse(unavailable.test_success())
+        self.assertIn("unavailable", unavailable.get_result())
+        self.assertFalse(missing.test_success())
+        self.assertEqual(missing.get_result(), "sensor not found in hass")
+        # one request for all three sensors
+        self.assertEqual(self.server.requests, ["/api/states"])
+
+    def test_once_per_loop(self):
+        m = self.monitor("sensor.temperature")
+        m.run_test()
+        m.run_test()
+        self.assertEqual(len(self.server.requests), 1)
+        new_loop()
+        m.run_test()
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_bad_token(self):
+        m1 = self.monitor("sensor.temperature", token="wrong")
+        m2 = self.monitor("sensor.door", token="wrong")
+        m1.run_test()
+        m2.run_test()
+        self.assertFalse(m1.test_success())
+        self.assertIn("cannot get info from hass", m1.get_result())
+        self.assertFalse(m2.test_success())
+        # the failure is shared too
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_unreachable(self):
+        self.server.shutdown()
+        self.server.server_close()
+        m = self.monitor("sensor.temperature")
+        m.run_test()
+        self.assertFalse(m.test_success())
+        self.assertIn("cannot get info from hass", m.get_result())
+
+
+if __name__ == "__main__":
+    unittest.main()
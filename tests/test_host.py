@@ -1,7 +1,15 @@
 # type: ignore
+import os
+import sys
+import tempfile
+import time
 import unittest
+from collections import namedtuple
+from unittest.mock import patch
 
 from simplemonitor.Monitors import host
+from simplemonitor.util.inotify import FileWatcher
+from simplemonitor.util.loopcache import new_loop
 
 
 class TestHostMonitors(unittest.TestCase):
@@ -78,6 +86,29 @@ class TestHostMonitors(unittest.TestCase):
         m = host.MonitorFileStat("test", config_options)
         self.assertTupleEqual(m.get_params(), ("/test", 20, 10))
 
+    def test_Command_timeout(self):
+        with self.assertRaises(ValueError):
+            host.MonitorCommand("test", {"command": "true", "timeout": "0"})
+
+    @unittest.skipIf(sys.platform == "win32", "shlex mangles Windows paths")
+    def test_Command_regexp_cap(self):
+        code = "print('x' * 100); print('needle')"
+        m = host.MonitorCommand(
+            "test",
+            {
+                "command": '{} -c "{}"'.format(sys.executable, code),
+                "result_regexp": "x\nneedle",
+            },
+        )
+        m.run_test()
+        self.assertTrue(m.test_success(), m.get_result())
+        with patch("simplemonitor.util.runner.runner.max_output", 10):
+            m.run_test()
+        self.assertFalse(m.test_success())
+        self.assertEqual(
+            m.get_result(), "could not match regexp in the first 10 bytes of out"
+        )
+
     def test_Command_get_params(self):
         config_options = {"command": "ls /", "result_regexp": "moo", "result_max": "10"}
         m = host.MonitorCommand("test", config_options)
@@ -92,5 +123,307 @@ class TestHostMonitors(unittest.TestCase):
         self.assertTupleEqual(m.get_params(), (["ls", "/"], "", 10, True))
 
 
+class TestHostSampler(unittest.TestCase):
+    def setUp(self):
+        new_loop()
+        host.host_sampler.history.clear()
+
+    def disk_reads(self, read_disk):
+        return [call.args[0] for call in read_disk.call_args_list]
+
+    def test_disk_sampled_once_per_loop(self):
+        m1 = host.MonitorDiskSpace("m1", {"partition": "/", "limit": "1"})
+        m2 = host.MonitorDiskSpace("m2", {"partition": "/", "limit": "100000G"})
+        for m in [m1, m2]:
+            m.post_config_setup()
+            self.addCleanup(m.unload)
+        with patch(
+            "simplemonitor.Monitors.host._read_disk", return_value=(2**30, 50.0)
+        ) as read_disk:
+            m1.run_test()
+            m2.run_test()
+            self.assertTrue(m1.test_success())
+            self.assertFalse(m2.test_success())
+            self.assertEqual(self.disk_reads(read_disk).count("/"), 1)
+            new_loop()
+            m1.run_test()
+            self.assertEqual(self.disk_reads(read_disk).count("/"), 2)
+
+    def test_unload(self):
+        m = host.MonitorDiskSpace("m", {"partition": "/gone", "limit": "1"})
+        m.post_config_setup()
+        m.unload()
+        with patch(
+            "simplemonitor.Monitors.host._read_disk", return_value=(2**30, 50.0)
+        ) as read_disk:
+            host.host_sampler.sample()
+        self.assertNotIn("/gone", self.disk_reads(read_disk))
+
+    def test_disabled_not_sampled(self):
+        m = host.MonitorDiskSpace(
+            "m", {"partition": "/disabled", "limit": "1", "enabled": "0"}
+        )
+        m.post_config_setup()
+        self.addCleanup(m.unload)
+        with patch(
+            "simplemonitor.Monitors.host._read_disk", return_value=(2**30, 50.0)
+        ) as read_disk:
+            host.host_sampler.sample()
+        self.assertNotIn("/disabled", self.disk_reads(read_disk))
+
+    @unittest.skipIf(host.psutil is None, "psutil not installed")
+    def test_memory_window(self):
+        vmem = namedtuple("vmem", ["available", "total"])
+        m = host.MonitorMemory("m", {"percent_free": "50", "window": "600"})
+        m.post_config_setup()
+        self.addCleanup(m.unload)
+        with patch("psutil.virtual_memory") as virtual_memory:
+            virtual_memory.return_value = vmem(80, 100)
+            m.run_test()
+            self.assertTrue(m.test_success())
+            new_loop()
+            virtual_memory.return_value = vmem(30, 100)
+            m.run_test()
+            # average of 80% and 30% is still above 50%
+            self.assertTrue(m.test_success())
+            self.assertEqual(m.get_result(), "55% free (average over 600s)")
+            new_loop()
+            m.run_test()
+            self.assertFalse(m.test_success())
+
+    def test_history_window(self):
+        m = host.MonitorLoadAvg("m", {})
+        m.post_config_setup()
+        self.addCleanup(m.unload)
+        with patch("time.time", return_value=1000):
+            host.host_sampler.sample()
+        new_loop()
+        with patch("time.time", return_value=2000):
+            host.host_sampler.sample()
+        # nothing averages over a window, so only the latest sample is kept
+        self.assertEqual(len(host.host_sampler.history), 1)
+
+        w = host.MonitorMemory("w", {"percent_free": "50", "window": "3600"})
+        w.post_config_setup()
+        self.addCleanup(w.unload)
+        for when in [3000, 9000]:
+            new_loop()
+            with patch("time.time", return_value=when):
+                host.host_sampler.sample()
+        self.assertEqual(
+            [sample.timestamp for sample in host.host_sampler.history], [9000]
+        )
+        new_loop()
+        with patch("time.time", return_value=10000):
+            host.host_sampler.sample()
+        self.assertEqual(len(host.host_sampler.history), 2)
+
+
 if __name__ == "__main__":
     unittest.main()
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux-only")
+class TestFileWatcher(unittest.TestCase):
+    def setUp(self):
+        self.watcher = FileWatcher()
+        self.addCleanup(self.watcher.close)
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.path = os.path.join(self.tempdir.name, "heartbeat")
+
+    def wait_for(self, check):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if check():
+                return
+            time.sleep(0.01)
+        self.fail("watcher did not see the change")
+
+    def test_dropped(self):
+        # the entry can be dropped between watch() and reading it
+        with open(self.path, "w") as f:
+            f.write("ab")
+        with patch.object(self.watcher, "watch", return_value=True):
+            self.assertEqual(self.watcher.stat(self.path).st_size, 2)
+
+    def test_watch(self):
+        with open(self.path, "w") as f:
+            f.write("a")
+        self.assertTrue(self.watcher.watch(self.path))
+        self.assertEqual(self.watcher.stat(self.path).st_size, 1)
+        with patch("os.stat") as mock_stat:
+            self.watcher.stat(self.path)
+        mock_stat.assert_not_called()
+
+        with open(self.path, "a") as f:
+            f.write("bcd")
+        self.wait_for(lambda: self.watcher.stat(self.path).st_size == 4)
+
+        os.unlink(self.path)
+
+        def gone():
+            try:
+                self.watcher.stat(self.path)
+            except FileNotFoundError:
+                return True
+            return False
+
+        self.wait_for(gone)
+
+    def test_created_later(self):
+        self.assertTrue(self.watcher.watch(self.path))
+        with self.assertRaises(FileNotFoundError):
+            self.watcher.stat(self.path)
+        with open(self.path, "w") as f:
+            f.write("abc")
+        self.wait_for(lambda: self._size() == 3)
+
+    def _size(self):
+        try:
+            return self.watcher.stat(self.path).st_size
+        except FileNotFoundError:
+            return None
+
+    def test_fallback(self):
+        with open(self.path, "w") as f:
+            f.write("abc")
+        with patch("simplemonitor.util.inotify._load_libc", return_value=None):
+            self.assertFalse(self.watcher.watch(self.path))
+            self.assertEqual(self.watcher.stat(self.path).st_size, 3)
+
+    def test_filestat_monitor(self):
+        with open(self.path, "w") as f:
+            f.write("abc")
+        m = host.MonitorFileStat(
+            "test", {"filename": self.path, "minsize": "2", "watch": "true"}
+        )
+        with patch("simplemonitor.Monitors.host.file_watcher", self.watcher):
+            m.run_test()
+        self.assertTrue(m.test_success())
+
+
+class TestFileStatGlob(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+    def make_file(self, name, content="data", age=0):
+        path = os.path.join(self.tempdir.name, name)
+        with open(path, "w") as f:
+            f.write(content)
+        if age:
+            when = time.time() - age
+            os.utime(path, (when, when))
+        return path
+
+    def monitor(self, **options):
+        options.setdefault("path", os.path.join(self.tempdir.name, "*.csv"))
+        return host.MonitorFileStatGlob("test", options)
+
+    def test_all_ok(self):
+        self.make_file("a.csv")
+        self.make_file("b.csv")
+        self.make_file("old.txt", age=1000)
+        m = self.monitor(maxage="60")
+        m.run_test()
+        self.assertTrue(m.test_success(), m.get_result())
+        self.assertTrue(m.get_result().startswith("2 files OK"))
+
+    def test_worst_offender(self):
+        self.make_file("a.csv", age=100)
+        self.make_file("b.csv", age=500)
+        self.make_file("c.csv")
+        m = self.monitor(maxage="60")
+        m.run_test()
+        self.assertFalse(m.test_success())
+        self.assertIn("2 of 3 files failed", m.get_result())
+        self.assertIn("b.csv", m.get_result())
+
+    def test_size(self):
+        self.make_file("a.csv", content="x")
+        m = self.monitor(minsize="2")
+        m.run_test()
+        self.assertFalse(m.test_success())
+        # the directory hasn't changed, but the file has
+        self.make_file("a.csv", content="xyz")
+        m.run_test()
+        self.assertTrue(m.test_success(), m.get_result())
+
+    def test_directory_cached(self):
+        self.make_file("a.csv", age=100)
+        self.make_file("b.csv")
+        # the directory hasn't changed since well before the scan
+        when = time.time() - 100
+        os.utime(self.tempdir.name, (when, when))
+        m = self.monitor(maxage="60")
+        m.run_test()
+        self.assertFalse(m.test_success())
+        with (
+            patch("os.scandir") as mock_scandir,
+            patch("os.stat", wraps=os.stat) as mock_stat,
+        ):
+            # only the failing file (and the directory) is looked at again
+            self.make_file("a.csv")
+            m.run_test()
+        mock_scandir.assert_not_called()
+        self.assertEqual(mock_stat.call_count, 2)
+        self.assertTrue(m.test_success(), m.get_result())
+
+    def test_new_file(self):
+        self.make_file("a.csv")
+        m = self.monitor(maxage="60")
+        m.run_test()
+        self.assertTrue(m.test_success())
+        self.make_file("b.csv", age=100)
+        # make sure the directory looks changed even on coarse filesystems
+        os.utime(self.tempdir.name, (time.time() + 10, time.time() + 10))
+        m.run_test()
+        self.assertFalse(m.test_success())
+
+    def test_new_file_same_mtime(self):
+        # a file created in the same mtime tick as the scan doesn't change the
+        # directory's mtime
+        when = time.time()
+        os.utime(self.tempdir.name, (when, when))
+        m = self.monitor(maxage="60")
+        m.run_test()
+        self.make_file("b.csv", age=100)
+        os.utime(self.tempdir.name, (when, when))
+        m.run_test()
+        self.assertFalse(m.test_success())
+
+    def test_describe(self):
+        path = os.path.join(self.tempdir.name, "*.csv")
+        self.assertEqual(
+            self.monitor(minsize="10").describe(),
+            "Checking files matching %s are not smaller than 10 bytes" % path,
+        )
+        self.assertEqual(
+            self.monitor(maxage="60", maxsize="20").describe(),
+            "Checking files matching %s are not older than 60 seconds and not "
+            "larger than 20 bytes" % path,
+        )
+        self.assertEqual(self.monitor().describe(), "Checking files matching %s" % path)
+
+    def test_min_count(self):
+        m = self.monitor()
+        m.run_test()
+        self.assertFalse(m.test_success())
+        m = self.monitor(min_count="0")
+        m.run_test()
+        self.assertTrue(m.test_success())
+
+    def test_directory(self):
+        self.make_file("a.txt")
+        m = host.MonitorFileStatGlob("test", {"path": self.tempdir.name})
+        m.run_test()
+        self.assertTrue(m.test_success(), m.get_result())
+
+    def test_missing_directory(self):
+        m = host.MonitorFileStatGlob(
+            "test", {"path": os.path.join(self.tempdir.name, "missing", "*")}
+        )
+        m.run_test()
+        self.assertFalse(m.test_success())
+        self.assertIn("does not exist", m.get_result())
@@ -7,11 +7,13 @@ import tempfile
 import time
 import unittest
 from pathlib import Path
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 from simplemonitor import Alerters, monitor, simplemonitor
 from simplemonitor.Loggers import network
-from simplemonitor.Monitors.monitor import MonitorFail, MonitorNull
+from simplemonitor.Monitors.monitor import MonitorFail, MonitorNull, RemoteMonitor
+from simplemonitor.Monitors.network import MonitorTCP
+from simplemonitor.util import MonitorState
 
 
 class TestMonitor(unittest.TestCase):
@@ -64,6 +66,51 @@ class TestMonitor(unittest.TestCase):
         mock_method.assert_called_once()
 
 
+class TestCompound(unittest.TestCase):
+    def load(self, s, monitors):
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".ini", delete=False
+        ) as monitors_file:
+            monitors_file.write(monitors)
+        self.addCleanup(os.unlink, monitors_file.name)
+        s._load_monitors([monitors_file.name])
+
+    def test_same_loop(self):
+        s = simplemonitor.SimpleMonitor(Path("tests/monitor-empty.ini"))
+        self.load(
+            s,
+            "[outer]\ntype=compound\nmonitors=inner,null\nmin_fail=1\n"
+            "[inner]\ntype=compound\nmonitors=fail1,fail2\n"
+            "[fail1]\ntype=fail\n[fail2]\ntype=fail\n[null]\ntype=null\n",
+        )
+        self.assertTrue(s._verify_compounds())
+        self.assertEqual(
+            s.sort_joblist(["outer", "fail1", "inner", "null"]),
+            ["fail1", "null", "inner", "outer"],
+        )
+        s.run_tests()
+        self.assertFalse(s.monitors["inner"].test_success())
+        self.assertFalse(s.monitors["outer"].test_success())
+
+    def test_loop(self):
+        s = simplemonitor.SimpleMonitor(Path("tests/monitor-empty.ini"))
+        self.load(
+            s,
+            "[a]\ntype=compound\nmonitors=b,null\n"
+            "[b]\ntype=compound\nmonitors=a\n[null]\ntype=null\n",
+        )
+        self.assertFalse(s._verify_compounds())
+
+    def test_reload(self):
+        s = simplemonitor.SimpleMonitor(Path("tests/monitor-empty.ini"))
+        config = "[compound]\ntype=compound\nmonitors=fail1\n[fail1]\ntype=fail\n"
+        self.load(s, config)
+        self.load(s, config)
+        s.run_tests()
+        self.assertEqual(s.monitors["compound"].fail_count(), 1)
+        self.assertFalse(s.monitors["compound"].test_success())
+
+
 class TestPidFile(unittest.TestCase):
     def test_pidfile(self):
         s = simplemonitor.SimpleMonitor("tests/monitor-empty.ini")
@@ -122,6 +169,79 @@ class TestNetworkMonitors(unittest.TestCase):
         self.assertIn("test1", s.remote_monitors["remote.host"])
         self.assertNotIn("test2", s.remote_monitors["remote.host"])
 
+    def test_snapshot(self):
+        s = simplemonitor.SimpleMonitor("tests/monitor-empty.ini")
+        m = MonitorNull()
+        entry = {"cls_type": m.monitor_type, "data": m.to_python_dict()}
+        s.update_remote_monitor({"test1": entry, "test2": entry}, "remote.host")
+        snapshot = s.remote_monitors
+        host_snapshot = snapshot["remote.host"]
+        # updates replace the dicts rather than changing them
+        s.update_remote_monitor({"test1": entry}, "remote.host")
+        s.update_remote_monitor({"test3": entry}, "other.host")
+        s.update_remote_monitor_delta({"test4": entry}, ["test1"], "remote.host")
+        self.assertEqual(list(snapshot), ["remote.host"])
+        self.assertEqual(sorted(host_snapshot), ["test1", "test2"])
+        self.assertEqual(sorted(s.remote_monitors), ["other.host", "remote.host"])
+        self.assertEqual(list(s.remote_monitors["remote.host"]), ["test4"])
+        # changes to existing monitors replace the record, leaving the one
+        # readers may hold alone
+        host_snapshot = s.remote_monitors["remote.host"]
+        s.update_remote_monitor_delta(
+            {"test4": {"data": {"last_result": "changed"}}}, [], "remote.host"
+        )
+        self.assertIsNot(s.remote_monitors["remote.host"], host_snapshot)
+        self.assertEqual(
+            s.remote_monitors["remote.host"]["test4"].get_result(), "changed"
+        )
+        self.assertNotEqual(host_snapshot["test4"].get_result(), "changed")
+
+    def test_records(self):
+        s = simplemonitor.SimpleMonitor("tests/monitor-empty.ini")
+        m = MonitorFail("fail", {"remote_alert": "1", "tolerance": "1"})
+        m.run_test()
+        data = {
+            "fail": {
+                "cls_type": m.monitor_type,
+                "data": m.to_python_dict(),
+                "description": m.describe(),
+            },
+            "mystery": {"cls_type": "not_a_type", "data": m.to_python_dict()},
+        }
+        s.update_remote_monitor(data, "remote.host")
+        record = s.remote_monitors["remote.host"]["fail"]
+        self.assertIsInstance(record, RemoteMonitor)
+        self.assertEqual(record.origin, "remote.host")
+        self.assertEqual(record.monitor_type, "fail")
+        self.assertEqual(record.describe(), m.describe())
+        self.assertTrue(record.remote_alerting)
+        self.assertTrue(record.test_success())
+        # we don't need to know a monitor's type to keep its state
+        self.assertIn(
+            "not_a_type", s.remote_monitors["remote.host"]["mystery"].describe()
+        )
+        # records are replaced, not changed
+        m.run_test()
+        data["fail"]["data"] = m.to_python_dict()
+        s.update_remote_monitor(data, "remote.host")
+        updated = s.remote_monitors["remote.host"]["fail"]
+        self.assertIsNot(updated, record)
+        self.assertTrue(record.test_success())
+        self.assertEqual(updated.origin, "remote.host")
+        self.assertEqual(updated.virtual_fail_count(), 1)
+        self.assertEqual(updated.get_result(), m.get_result())
+        self.assertEqual(updated.state(), MonitorState.FAILED)
+
+    def test_record_not_run(self):
+        m = MonitorFail("fail", {"recover_command": "false"})
+        m.run_test()
+        record = RemoteMonitor("fail", "fail", m.to_python_dict())
+        self.assertFalse(record.should_run())
+        record.attempt_recover()
+        record.run_recovered()
+        with self.assertRaises(RuntimeError):
+            record.run_test()
+
 
 class TestFailedLogic(unittest.TestCase):
     def test_disabled(self):
@@ -156,3 +276,36 @@ class TestFailedLogic(unittest.TestCase):
         m1.run_test()
         failed = s._failed_monitors()
         self.assertListEqual([], failed)
+
+
+class TestProbeSharing(unittest.TestCase):
+    @patch("simplemonitor.Monitors.network.create_connection")
+    def test_identical_probes_shared(self, mock_connect):
+        mock_connect.return_value = (Mock(), 0.0, 0.01)
+        s = simplemonitor.SimpleMonitor(Path("tests/monitor-empty.ini"))
+        s.add_monitor("tcp1", MonitorTCP("tcp1", {"host": "example.com", "port": "22"}))
+        s.add_monitor("tcp2", MonitorTCP("tcp2", {"host": "EXAMPLE.com", "port": "22"}))
+        s.add_monitor("tcp3", MonitorTCP("tcp3", {"host": "example.com", "port": "80"}))
+        s.run_tests()
+        self.assertEqual(mock_connect.call_count, 2)
+        for name in ["tcp1", "tcp2", "tcp3"]:
+            self.assertTrue(s.monitors[name].test_success())
+        self.assertEqual(
+            s.monitors["tcp1"].get_result(), s.monitors["tcp2"].get_result()
+        )
+
+        # each loop probes again
+        s.run_tests()
+        self.assertEqual(mock_connect.call_count, 4)
+
+    @patch("simplemonitor.Monitors.network.create_connection")
+    def test_shared_failure(self, mock_connect):
+        mock_connect.side_effect = ConnectionRefusedError("refused")
+        s = simplemonitor.SimpleMonitor(Path("tests/monitor-empty.ini"))
+        s.add_monitor("tcp1", MonitorTCP("tcp1", {"host": "example.com", "port": "22"}))
+        s.add_monitor("tcp2", MonitorTCP("tcp2", {"host": "example.com", "port": "22"}))
+        s.run_tests()
+        mock_connect.assert_called_once()
+        for name in ["tcp1", "tcp2"]:
+            self.assertEqual(s.monitors[name].error_count, 1)
+            self.assertEqual(s.monitors[name].get_result(), "refused")
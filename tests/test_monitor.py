@@ -364,6 +364,50 @@ class TestMonitor(unittest.TestCase):
             "compound monitor did not report failures properly",
         )
 
+    def test_compound_incremental(self):
+        m = MonitorNull()
+        m2 = MonitorFail("fail1", {})
+        compound_monitor = CompoundMonitor("compound", {"monitors": ["m", "m2"]})
+        compound_monitor.set_mon_refs({"m": m, "m2": m2})
+        compound_monitor.post_config_setup()
+        self.assertEqual(compound_monitor.fail_count(), 0)
+        m2.run_test()
+        self.assertEqual(compound_monitor.fail_count(), 1)
+        m2.record_success()
+        self.assertEqual(compound_monitor.fail_count(), 0)
+        m.record_fail()
+        m2.record_fail()
+        self.assertEqual(compound_monitor.fail_count(), 2)
+        self.assertFalse(compound_monitor.run_test())
+
+    def test_compound_nested(self):
+        m = MonitorFail("fail1", {})
+        m2 = MonitorFail("fail2", {})
+        m3 = MonitorNull()
+        inner = CompoundMonitor("inner", {"monitors": ["m", "m2"]})
+        outer = CompoundMonitor("outer", {"monitors": ["inner", "m3"], "min_fail": 1})
+        monitors = {"m": m, "m2": m2, "m3": m3, "inner": inner, "outer": outer}
+        for compound_monitor in [inner, outer]:
+            compound_monitor.set_mon_refs(monitors)
+            compound_monitor.post_config_setup()
+        m.run_test()
+        m2.run_test()
+        m3.run_test()
+        inner.run_test()
+        self.assertEqual(outer.fail_count(), 1)
+        self.assertFalse(outer.run_test())
+
+    def test_state_listener_not_serialized(self):
+        m = MonitorNull()
+        compound_monitor = CompoundMonitor("compound", {"monitors": ["m"]})
+        compound_monitor.set_mon_refs({"m": m})
+        compound_monitor.post_config_setup()
+        state = m.to_python_dict()
+        self.assertNotIn("_state_listeners", state)
+        m2 = MonitorNull.from_python_dict(state)
+        m2.record_fail()
+        self.assertEqual(compound_monitor.fail_count(), 0)
+
     @mock.patch("subprocess.Popen")
     def test_recovery(self, mock_popen):
         m = MonitorFail("fail1", {"recover_command": "touch did_recovery"})
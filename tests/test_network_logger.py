@@ -0,0 +1,410 @@
+# type: ignore
+import os
+import socket
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from simplemonitor.Loggers import network
+from simplemonitor.Loggers.logger import Logger
+from simplemonitor.Monitors.monitor import MonitorFail, MonitorNull
+from simplemonitor.simplemonitor import SimpleMonitor
+from simplemonitor.util.json_encoding import json_loads
+
+KEY = "secret"
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class TestNetwork(unittest.TestCase):
+    def setUp(self):
+        self.s = SimpleMonitor(Path("tests/monitor-empty.ini"))
+        self.listener = network.Listener(
+            self.s, 0, KEY, bind_host="127.0.0.1", ipv4_only=True
+        )
+        self.listener.start()
+        self.addCleanup(self.stop_listener)
+
+    def stop_listener(self):
+        self.listener.running = False
+        self.listener.join(5)
+
+    def network_logger(self, name="client", **options):
+        config = {
+            "host": "127.0.0.1",
+            "port": str(self.listener.port),
+            "key": KEY,
+            "client_name": name,
+        }
+        config.update(options)
+        return network.NetworkLogger(config)
+
+    def send(self, logger, monitors):
+        with logger:
+            for monitor in monitors:
+                monitor.run_test()
+                logger.save_result2(monitor.name, monitor)
+
+    def test_send(self):
+        logger = self.network_logger()
+        self.send(logger, [MonitorNull("ok", {}), MonitorFail("bad", {})])
+        self.assertTrue(
+            wait_for(lambda: len(self.s.remote_monitors.get("client", {})) == 2)
+        )
+        self.assertTrue(self.s.remote_monitors["client"]["ok"].test_success())
+        self.assertFalse(self.s.remote_monitors["client"]["bad"].test_success())
+        self.assertIn("client", self.s.remote_hosts)
+
+    def test_stalled_client(self):
+        # a client which connects but never finishes doesn't hold up the others
+        stalled = socket.create_connection(("127.0.0.1", self.listener.port))
+        self.addCleanup(stalled.close)
+        stalled.sendall(b"\x10partial")
+        for i in range(20):
+            self.send(self.network_logger("client%d" % i), [MonitorNull("ok", {})])
+        self.assertTrue(wait_for(lambda: len(self.s.remote_monitors) == 20, timeout=3))
+
+    def test_bad_key(self):
+        logger = self.network_logger(key="wrong")
+        self.send(logger, [MonitorNull("ok", {})])
+        good = self.network_logger("good")
+        self.send(good, [MonitorNull("ok", {})])
+        self.assertTrue(wait_for(lambda: "good" in self.s.remote_monitors))
+        self.assertNotIn("client", self.s.remote_monitors)
+
+    def test_idle_timeout(self):
+        self.listener.idle_timeout = 0
+        stalled = socket.create_connection(("127.0.0.1", self.listener.port))
+        self.addCleanup(stalled.close)
+        stalled.settimeout(5)
+        # the listener closes the connection
+        self.assertEqual(stalled.recv(1), b"")
+
+    def test_compress(self):
+        logger = self.network_logger(compress="1")
+        self.send(logger, [MonitorNull("ok", {}), MonitorFail("bad", {})])
+        self.assertTrue(
+            wait_for(lambda: len(self.s.remote_monitors.get("client", {})) == 2)
+        )
+        self.assertFalse(self.s.remote_monitors["client"]["bad"].test_success())
+        logger = self.network_logger(
+            "persistent", compress="1", persistent="1", acks="1"
+        )
+        self.addCleanup(logger.close)
+        self.send(logger, [MonitorNull("ok", {})])
+        self.send(logger, [MonitorNull("ok", {})])
+        self.assertIn("ok", self.s.remote_monitors["persistent"])
+
+    def test_binary(self):
+        logger = self.network_logger(codec="binary", compress="1")
+        self.send(logger, [MonitorNull("ok", {}), MonitorFail("bad", {})])
+        self.assertTrue(
+            wait_for(lambda: len(self.s.remote_monitors.get("client", {})) == 2)
+        )
+        self.assertFalse(self.s.remote_monitors["client"]["bad"].test_success())
+        logger = self.network_logger(
+            "persistent", codec="binary", persistent="1", acks="1"
+        )
+        self.addCleanup(logger.close)
+        self.send(logger, [MonitorNull("ok", {})])
+        self.send(logger, [MonitorNull("ok", {})])
+        self.assertIn("ok", self.s.remote_monitors["persistent"])
+
+    def test_processes(self):
+        self.stop_listener()
+        self.listener = network.Listener(
+            self.s, 0, KEY, bind_host="127.0.0.1", ipv4_only=True, processes=2
+        )
+        self.listener.start()
+        for name, options in [
+            ("json", {}),
+            ("binary", {"codec": "binary", "compress": "1"}),
+        ]:
+            self.send(
+                self.network_logger(name, **options),
+                [MonitorNull("ok", {}), MonitorFail("bad", {})],
+            )
+        logger = self.network_logger("persistent", persistent="1", acks="1")
+        self.addCleanup(logger.close)
+        bad = MonitorFail("bad", {})
+        self.send(logger, [bad])
+        self.send(logger, [bad])
+        self.send(self.network_logger("wrong", key="wrong"), [MonitorNull("ok", {})])
+        self.assertTrue(
+            wait_for(
+                lambda: len(self.s.remote_monitors.get("json", {})) == 2
+                and len(self.s.remote_monitors.get("binary", {})) == 2,
+                timeout=30,
+            )
+        )
+        self.assertFalse(self.s.remote_monitors["binary"]["bad"].test_success())
+        self.assertEqual(self.s.remote_monitors["persistent"]["bad"].error_count, 2)
+        self.assertNotIn("wrong", self.s.remote_monitors)
+
+    def test_decompress_limit(self):
+        self.listener.max_message_size = 1024
+        logger = self.network_logger(compress="1")
+        payload = logger._sign(b"{" + b" " * 4096 + b"}")
+        self.assertLess(len(payload), 1024)
+        with self.assertRaises(ValueError):
+            self.listener._decode(payload, "test")
+        self.listener.max_message_size = 8192
+        self.assertEqual(self.listener._decode(payload, "test"), {})
+
+    def test_persistent(self):
+        logger = self.network_logger(persistent="1", acks="1")
+        self.addCleanup(logger.close)
+        for i in range(5):
+            self.send(logger, [MonitorNull("m%d" % i, {})])
+        sock = logger._sock
+        self.assertIsNotNone(sock)
+        # acks mean each batch has been processed by the time send returns
+        self.assertEqual(len(self.s.remote_monitors["client"]), 1)
+        self.assertIn("m4", self.s.remote_monitors["client"])
+        self.send(logger, [MonitorNull("ok", {}), MonitorFail("bad", {})])
+        self.assertIs(logger._sock, sock)
+        self.assertFalse(self.s.remote_monitors["client"]["bad"].test_success())
+
+    def test_persistent_no_acks(self):
+        logger = self.network_logger(persistent="1")
+        self.addCleanup(logger.close)
+        monitors = [MonitorNull("m%d" % i, {}) for i in range(2000)]
+        self.send(logger, monitors)
+        self.send(logger, monitors[:10])
+        self.assertTrue(
+            wait_for(lambda: len(self.s.remote_monitors.get("client", {})) == 10)
+        )
+
+    def test_persistent_reconnect(self):
+        logger = self.network_logger(persistent="1", acks="1")
+        self.addCleanup(logger.close)
+        self.send(logger, [MonitorNull("first", {})])
+        self.listener.framed_idle_timeout = 0
+        self.assertTrue(wait_for(lambda: not network._is_open(logger._sock)))
+        self.listener.framed_idle_timeout = 3600
+        self.send(logger, [MonitorNull("second", {})])
+        self.assertIn("second", self.s.remote_monitors["client"])
+
+    def test_persistent_changes(self):
+        logger = self.network_logger(persistent="1", acks="1")
+        self.addCleanup(logger.close)
+        one = MonitorNull("one", {})
+        two = MonitorFail("two", {})
+        self.send(logger, [one, two])
+        self.send(logger, [one, two])
+        # the changes are applied on top of what we had
+        self.assertEqual(self.s.remote_monitors["client"]["one"].tests_run, 2)
+        self.assertEqual(self.s.remote_monitors["client"]["two"].error_count, 2)
+        self.send(logger, [one])
+        self.assertEqual(list(self.s.remote_monitors["client"]), ["one"])
+
+    def test_changes_message(self):
+        logger = self.network_logger(persistent="1")
+
+        def message(monitors, full=False):
+            logger.start_batch()
+            for monitor in monitors:
+                logger.save_result2(monitor.name, monitor)
+            serialized = logger._changes_message(full)
+            logger.doing_batch = False
+            return json_loads(serialized[serialized[0] + 1 :])
+
+        one = MonitorNull("one", {})
+        two = MonitorNull("two", {})
+        one.run_test()
+        two.run_test()
+        first = message([one, two], full=True)
+        self.assertTrue(first["full"])
+        self.assertEqual(first["monitors"]["one"]["cls_type"], "null")
+        # only what changed is sent
+        one.run_test()
+        second = message([one, two])
+        self.assertFalse(second["full"])
+        self.assertEqual(second["seq"], first["seq"] + 1)
+        self.assertEqual(list(second["monitors"]), ["one"])
+        self.assertEqual(
+            set(second["monitors"]["one"]["data"]),
+            {"last_update", "success_count", "tests_run"},
+        )
+        self.assertEqual(second["removed"], [])
+        third = message([one])
+        self.assertEqual(third["monitors"], {})
+        self.assertEqual(third["removed"], ["two"])
+
+    def test_persistent_resync(self):
+        logger = self.network_logger(persistent="1", acks="1")
+        self.addCleanup(logger.close)
+        self.send(logger, [MonitorNull("one", {})])
+        sock = logger._sock
+        # pretend a message went missing
+        logger._seq += 1
+        self.send(logger, [MonitorNull("two", {})])
+        self.assertIsNot(logger._sock, sock)
+        self.assertEqual(list(self.s.remote_monitors["client"]), ["two"])
+
+    def relay_site(self):
+        site = SimpleMonitor(Path("tests/monitor-empty.ini"))
+        site.add_monitor("local", MonitorNull("local", {}))
+        site.monitors["local"].run_test()
+        for origin, monitor in [
+            ("one", MonitorNull("ok", {})),
+            ("two", MonitorFail("bad", {})),
+        ]:
+            monitor.run_test()
+            data = monitor.to_python_dict()
+            data["running_on"] = origin
+            site.update_remote_monitor(
+                {monitor.name: {"cls_type": monitor.monitor_type, "data": data}},
+                origin,
+            )
+        return site
+
+    def test_relay(self):
+        site = self.relay_site()
+        for options in [{}, {"persistent": "1", "acks": "1"}]:
+            with self.subTest(**options):
+                self.s.remote_monitors = {}
+                logger = self.network_logger("site", relay="1", **options)
+                self.addCleanup(logger.close)
+                with patch.object(network, "short_hostname", return_value="site"):
+                    site.log_result(logger)
+                    site.log_result(logger)
+                self.assertTrue(wait_for(lambda: len(self.s.remote_monitors) == 3))
+                self.assertEqual(list(self.s.remote_monitors["site"]), ["local"])
+                record = self.s.remote_monitors["two"]["bad"]
+                self.assertFalse(record.test_success())
+                self.assertEqual(record.via, ("two", "site"))
+                self.assertTrue(self.s.remote_monitors["one"]["ok"].test_success())
+
+    def test_no_relay(self):
+        site = self.relay_site()
+        site.log_result(self.network_logger("site"))
+        self.assertTrue(wait_for(lambda: "site" in self.s.remote_monitors))
+        self.assertEqual(list(self.s.remote_monitors), ["site"])
+
+    def test_relay_loop(self):
+        site = self.relay_site()
+        # pretend the monitors have been through the listener's instance already
+        self.listener.hostname = "one"
+        site.log_result(self.network_logger("site", relay="1"))
+        self.assertTrue(wait_for(lambda: "two" in self.s.remote_monitors))
+        self.assertNotIn("one", self.s.remote_monitors)
+
+    def remote_error_count(self, name):
+        record = self.s.remote_monitors.get("client", {}).get(name)
+        return None if record is None else record.error_count
+
+    def closed_port(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def test_spool(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        for i, options in enumerate([{}, {"persistent": "1", "acks": "1"}]):
+            with self.subTest(**options):
+                spool_file = os.path.join(tempdir.name, "spool%d" % i)
+                self.s.remote_monitors = {}
+                self.s._backfill.clear()
+                logger = self.network_logger(
+                    spool_file=spool_file, spool_rate="1", **options
+                )
+                self.addCleanup(logger.close)
+                logger.port = self.closed_port()
+                monitor = MonitorFail("bad", {})
+                for _ in range(3):
+                    logger._next_attempt = 0
+                    self.send(logger, [monitor])
+                self.assertEqual(len(logger._spool.load()), 3)
+                logger.port = self.listener.port
+                logger._next_attempt = 0
+                # the current state goes first, then (rate limited) the oldest
+                # spooled batch
+                logger._spool_tokens = 0
+                logger._spool_refilled = time.monotonic() - 1
+                self.send(logger, [monitor])
+                self.assertEqual(len(logger._spool.load()), 2)
+                logger._spool_refilled = 0
+                self.send(logger, [monitor])
+                self.assertFalse(os.path.exists(spool_file))
+                self.assertTrue(wait_for(lambda: len(self.s._backfill) == 3))
+                # the spooled batches don't replace the current state
+                self.assertEqual(self.remote_error_count("bad"), 5)
+                self.assertEqual(
+                    [records["bad"].error_count for _, records in self.s._backfill],
+                    [1, 2, 3],
+                )
+
+    def test_backfill_loggers(self):
+        class HistoryLogger(Logger):
+            supports_backfill = True
+
+            def __init__(self):
+                super().__init__({})
+                self.logged = []
+
+            def save_result2(self, name, monitor):
+                self.logged.append((monitor.error_count, self._time()))
+
+        history = HistoryLogger()
+        self.s.add_logger("history", history)
+        self.s.queue_backfill(
+            {"bad": self.remote_entry(MonitorFail("bad", {}))}, "client", 1000.0
+        )
+        self.s.do_logs()
+        self.assertEqual(history.logged, [(1, 1000.0)])
+        # once only
+        history.logged = []
+        self.s.do_logs()
+        self.assertEqual(history.logged, [])
+        self.assertNotIn("client", self.s.remote_monitors)
+
+    def remote_entry(self, monitor):
+        monitor.run_test()
+        return {"cls_type": monitor.monitor_type, "data": monitor.to_python_dict()}
+
+    def test_spool_merge(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        logger = self.network_logger(
+            spool_file=os.path.join(tempdir.name, "spool"), spool_keep="merge"
+        )
+        logger.port = self.closed_port()
+        one = MonitorFail("one", {})
+        for monitor in [one, MonitorNull("two", {}), one]:
+            # as if the reconnect backoff has passed
+            logger._next_attempt = 0
+            self.send(logger, [monitor])
+        self.assertEqual(len(logger._spool.load()), 3)
+        logger.port = self.listener.port
+        logger._next_attempt = 0
+        self.send(logger, [MonitorNull("three", {})])
+        # the spool is merged into one batch when it's sent
+        self.assertTrue(wait_for(lambda: len(self.s._backfill) == 1))
+        _, records = self.s._backfill[0]
+        self.assertEqual(sorted(records), ["one", "two"])
+        self.assertEqual(records["one"].error_count, 2)
+
+    def test_persistent_bad_key(self):
+        logger = self.network_logger(persistent="1", acks="1", key="wrong")
+        self.addCleanup(logger.close)
+        self.send(logger, [MonitorNull("ok", {})])
+        self.assertNotIn("client", self.s.remote_monitors)
+        # and we back off before trying again
+        self.assertGreater(logger._next_attempt, time.monotonic())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,11 @@
+import datetime
 import unittest
 
 from requests import Response
 from requests.auth import HTTPBasicAuth
-from unittest.mock import patch, Mock
+from unittest.mock import MagicMock, patch, Mock
 
-from simplemonitor.Monitors import MonitorHTTP
+from simplemonitor.Monitors import MonitorHTTP, MonitorTLSCert
 from simplemonitor.util import MonitorState
 
 
@@ -85,3 +86,56 @@ class TestMonitorHTTP(unittest.TestCase):
         self.assertEqual(state, MonitorState.OK)
         self.assertIn("200", result)
         pass
+
+
+class TestMonitorTLSCert(unittest.TestCase):
+    def setUp(self):
+        MonitorTLSCert._expiry_cache.clear()
+
+    def _mock_context(self, days_left):
+        expiry = datetime.datetime.utcnow() + datetime.timedelta(
+            days=days_left, hours=1
+        )
+        ssl_sock = MagicMock()
+        ssl_sock.__enter__.return_value = ssl_sock
+        ssl_sock.getpeercert.return_value = {
+            "notAfter": expiry.strftime("%b %d %H:%M:%S %Y GMT")
+        }
+        context = Mock()
+        context.wrap_socket.return_value = ssl_sock
+        return context
+
+    def test_expiry_cached(self):
+        monitor = MonitorTLSCert("test", {"host": "example.com"})
+        with (
+            patch.object(
+                MonitorTLSCert, "_get_ssl_context", return_value=self._mock_context(30)
+            ),
+            patch(
+                "simplemonitor.Monitors.network.create_connection",
+                return_value=(MagicMock(), 0.0, 0.0),
+            ) as connect,
+        ):
+            monitor.run_test()
+            self.assertEqual(monitor.state(), MonitorState.OK)
+            other = MonitorTLSCert("other", {"host": "example.com"})
+            other.run_test()
+            self.assertEqual(other.state(), MonitorState.OK)
+            self.assertIn("30 days left", other.get_result())
+        connect.assert_called_once()
+
+    def test_close_expiry_not_cached(self):
+        monitor = MonitorTLSCert("test", {"host": "example.com", "min_days": 7})
+        with (
+            patch.object(
+                MonitorTLSCert, "_get_ssl_context", return_value=self._mock_context(7)
+            ),
+            patch(
+                "simplemonitor.Monitors.network.create_connection",
+                return_value=(MagicMock(), 0.0, 0.0),
+            ) as connect,
+        ):
+            monitor.run_test()
+            monitor.run_test()
+            self.assertEqual(monitor.state(), MonitorState.OK)
+        self.assertEqual(connect.call_count, 2)
@@ -0,0 +1,116 @@
+# type: ignore
+import json
+import os
+import tempfile
+import threading
+import unittest
+import xml.etree.ElementTree as ET  # nosec
+from pathlib import Path
+
+from simplemonitor import oneshot
+from simplemonitor.Monitors.compound import CompoundMonitor
+from simplemonitor.Monitors.monitor import Monitor, MonitorFail, MonitorNull
+from simplemonitor.simplemonitor import SimpleMonitor
+
+
+class MonitorBlocked(Monitor):
+    monitor_type = "blocked"
+
+    def __init__(self, name, config_options, wait):
+        super().__init__(name, config_options)
+        self.wait = wait
+
+    def run_test(self):
+        self.wait()
+        return self.record_success()
+
+
+class TestOneShot(unittest.TestCase):
+    def setUp(self):
+        self.s = SimpleMonitor(Path("tests/monitor-empty.ini"), monitors_only=True)
+
+    def add(self, name, monitor):
+        self.s.add_monitor(name, monitor)
+
+    def results(self, **kwargs):
+        for monitor in self.s.monitors.values():
+            monitor.set_mon_refs(self.s.monitors)
+            monitor.post_config_setup()
+        return {result.name: result for result in oneshot.run_once(self.s, **kwargs)}
+
+    def test_monitors_only(self):
+        self.assertEqual(self.s.loggers, {})
+        self.assertEqual(self.s.alerters, {})
+
+    def test_results(self):
+        self.add("ok", MonitorNull("ok", {}))
+        self.add("fail", MonitorFail("fail", {}))
+        self.add("dep", MonitorNull("dep", {"depend": "fail"}))
+        self.add("dep2", MonitorNull("dep2", {"depend": "dep"}))
+        self.add("compound", CompoundMonitor("compound", {"monitors": "ok,fail"}))
+        results = self.results()
+        self.assertEqual(results["ok"].status, oneshot.STATUS_OK)
+        self.assertEqual(results["fail"].status, oneshot.STATUS_FAIL)
+        self.assertEqual(results["dep"].status, oneshot.STATUS_SKIP)
+        self.assertEqual(results["dep2"].status, oneshot.STATUS_SKIP)
+        self.assertEqual(results["compound"].status, oneshot.STATUS_OK)
+        self.assertEqual(
+            results["compound"].message, "1 of 2 services failed. Fail after: 2"
+        )
+
+    def test_timeout(self):
+        event = threading.Event()
+        self.addCleanup(event.set)
+        self.add("slow", MonitorBlocked("slow", {}, lambda: event.wait(10)))
+        self.add("dep", MonitorNull("dep", {"depend": "slow"}))
+        self.add("ok", MonitorNull("ok", {}))
+        results = self.results(timeout=0.2)
+        self.assertEqual(results["slow"].status, oneshot.STATUS_TIMEOUT)
+        self.assertEqual(results["dep"].status, oneshot.STATUS_SKIP)
+        self.assertEqual(results["ok"].status, oneshot.STATUS_OK)
+
+    def test_parallel(self):
+        # each blocks until all of them are running
+        barrier = threading.Barrier(5, timeout=5)
+        for i in range(5):
+            self.add("m%d" % i, MonitorBlocked("m%d" % i, {}, barrier.wait))
+        results = self.results(timeout=5)
+        self.assertTrue(all(r.status == oneshot.STATUS_OK for r in results.values()))
+
+    def test_reports(self):
+        self.add("ok", MonitorNull("ok", {}))
+        self.add("fail", MonitorFail("fail", {}))
+        results = list(self.results().values())
+        report = json.loads(oneshot.format_json(results, 1.5))
+        self.assertFalse(report["ok"])
+        self.assertEqual(report["summary"]["fail"], 1)
+        self.assertEqual(
+            {check["name"]: check["status"] for check in report["checks"]},
+            {"ok": "ok", "fail": "fail"},
+        )
+        suite = ET.fromstring(oneshot.format_junit(results, 1.5)).find("testsuite")
+        self.assertEqual(suite.get("tests"), "2")
+        self.assertEqual(suite.get("failures"), "1")
+        self.assertIsNotNone(suite.find("testcase[@name='fail']/failure"))
+        self.assertIn("1 failed", oneshot.format_text(results, 1.5))
+
+    def test_check(self):
+        self.add("ok", MonitorNull("ok", {}))
+        with tempfile.TemporaryDirectory() as tempdir:
+            report_file = os.path.join(tempdir, "report.json")
+            self.assertEqual(
+                oneshot.check(self.s, report_format="json", report_file=report_file),
+                0,
+            )
+            with open(report_file) as f:
+                self.assertTrue(json.load(f)["ok"])
+        self.add("fail", MonitorFail("fail", {}))
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.assertEqual(
+                oneshot.check(self.s, report_file=os.path.join(tempdir, "report.txt")),
+                1,
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
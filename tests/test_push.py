@@ -0,0 +1,149 @@
+# type: ignore
+import http.client
+import socket
+import unittest
+from unittest.mock import patch
+
+from simplemonitor.Monitors import push
+
+
+class TestPush(unittest.TestCase):
+    def setUp(self):
+        self.table = push.HeartbeatTable()
+        patcher = patch.object(push, "heartbeats", self.table)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def listen(self, key=None):
+        listener = push.PushListener(
+            0, "127.0.0.1", key=key, ipv4_only=True, table=self.table
+        )
+        listener.start()
+        self.addCleanup(listener.stop)
+        return listener
+
+    def request(self, listener, path, method="GET", headers=None):
+        conn = http.client.HTTPConnection("127.0.0.1", listener.port, timeout=5)
+        self.addCleanup(conn.close)
+        conn.request(method, path, headers=headers or {})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+
+    def test_ping(self):
+        listener = self.listen()
+        m = push.MonitorPush("backup", {"max_age": "60"})
+        m.run_test()
+        self.assertTrue(m.test_success(), m.get_result())
+        self.assertEqual(m.get_result(), "Waiting for first ping")
+        self.assertEqual(self.request(listener, "/ping/backup"), 200)
+        m.run_test()
+        self.assertTrue(m.test_success(), m.get_result())
+        self.assertIn("Last ping was", m.get_result())
+
+    def test_stale(self):
+        listener = self.listen()
+        m = push.MonitorPush("test", {"push_slug": "backup", "max_age": "60"})
+        self.assertEqual(self.request(listener, "/ping/backup", "POST"), 200)
+        last_ping = self.table.last_seen("backup")[0]
+        with patch("time.time", return_value=last_ping + 61):
+            m.run_test()
+        self.assertFalse(m.test_success())
+        self.assertIn("should be < 60 seconds", m.get_result())
+
+    def test_never_pinged(self):
+        self.listen()
+        m = push.MonitorPush("backup", {"max_age": "60"})
+        with patch("time.time", return_value=self.table.started + 61):
+            m.run_test()
+        self.assertFalse(m.test_success())
+        self.assertIn("No ping in", m.get_result())
+
+    def test_fail(self):
+        listener = self.listen()
+        m = push.MonitorPush("backup", {"max_age": "60"})
+        self.assertEqual(self.request(listener, "/ping/backup/fail"), 200)
+        m.run_test()
+        self.assertFalse(m.test_success())
+        self.assertEqual(self.request(listener, "/ping/backup"), 200)
+        m.run_test()
+        self.assertTrue(m.test_success())
+
+    def test_unknown(self):
+        listener = self.listen()
+        push.MonitorPush("backup", {"max_age": "60"})
+        self.assertEqual(self.request(listener, "/ping/other"), 404)
+        self.assertEqual(self.request(listener, "/backup"), 404)
+        self.assertIsNone(self.table.last_seen("other"))
+
+    def test_key(self):
+        listener = self.listen(key="secret")
+        push.MonitorPush("backup", {"max_age": "60"})
+        self.assertEqual(self.request(listener, "/ping/backup"), 403)
+        self.assertEqual(self.request(listener, "/ping/backup?key=wrong"), 403)
+        self.assertEqual(self.request(listener, "/ping/backup?key=secret"), 200)
+        self.assertEqual(
+            self.request(listener, "/ping/backup", headers={"X-Push-Key": "secret"}),
+            200,
+        )
+
+    def test_keepalive(self):
+        listener = self.listen()
+        push.MonitorPush("backup", {"max_age": "60"})
+        conn = http.client.HTTPConnection("127.0.0.1", listener.port, timeout=5)
+        self.addCleanup(conn.close)
+        for _ in range(50):
+            conn.request("POST", "/ping/backup", body=b"some output")
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.status, 200)
+
+    def test_bad_body(self):
+        listener = self.listen()
+        push.MonitorPush("backup", {"max_age": "60"})
+        self.assertEqual(
+            self.request(
+                listener, "/ping/backup", "POST", headers={"Content-Length": "lots"}
+            ),
+            400,
+        )
+        # a chunked body isn't read, so the connection is closed after it
+        with socket.create_connection(("127.0.0.1", listener.port), timeout=5) as s:
+            s.sendall(
+                b"POST /ping/backup HTTP/1.1\r\nHost: localhost\r\n"
+                b"Transfer-Encoding: chunked\r\n\r\n4\r\nsome\r\n0\r\n\r\n"
+            )
+            response = b""
+            while True:
+                data = s.recv(4096)
+                if not data:
+                    break
+                response += data
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 "))
+        self.assertIn(b"Connection: close", response)
+        self.assertIsNotNone(self.table.last_seen("backup"))
+
+    def test_unload(self):
+        m1 = push.MonitorPush("m1", {"push_slug": "backup", "max_age": "60"})
+        m2 = push.MonitorPush("m2", {"push_slug": "backup", "max_age": "60"})
+        self.assertTrue(self.table.ping("backup"))
+        m1.unload()
+        # still wanted by m2
+        self.assertTrue(self.table.ping("backup"))
+        m2.unload()
+        self.assertFalse(self.table.ping("backup"))
+        self.assertIsNone(self.table.last_seen("backup"))
+
+    def test_not_listening(self):
+        m = push.MonitorPush("backup", {"max_age": "60"})
+        m.run_test()
+        self.assertFalse(m.test_success())
+        self.assertIn("push_port", m.get_result())
+
+    def test_bad_slug(self):
+        with self.assertRaises(ValueError):
+            push.MonitorPush("nightly backup", {"max_age": "60"})
+
+
+if __name__ == "__main__":
+    unittest.main()
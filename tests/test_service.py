@@ -1,18 +1,31 @@
 # type: ignore
+import io
 import subprocess
 import unittest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 from simplemonitor.Monitors import service
+from simplemonitor.util.loopcache import new_loop
+
+
+def _fake_popen(output, returncode=0):
+    process = Mock()
+    process.stdout = io.BytesIO(output)
+    # not a child of ours, so waiting for it returns at once
+    process.pid = 2**31 - 1
+    process.returncode = returncode
+    process.poll.return_value = returncode
+    process.wait.return_value = returncode
+    return process
 
 
 class TestUnixServiceMonitors(unittest.TestCase):
-    @patch("subprocess.run")
+    @patch("subprocess.Popen")
     def test_UnixService_ok(self, subprocess_run_fn):
         config_options = {"service": "unittest"}
 
-        subprocess_run_fn.return_value = subprocess.CompletedProcess(
-            ["service", config_options.get("service"), "status"], returncode=1
+        subprocess_run_fn.side_effect = lambda *args, **kwargs: _fake_popen(
+            b"", returncode=1
         )
         m = service.MonitorUnixService("unittest", config_options)
 
@@ -24,7 +37,7 @@ class TestUnixServiceMonitors(unittest.TestCase):
         self.assertFalse(m.test_success())
         self.assertEqual(m.error_count, 2)
 
-    @patch("subprocess.run")
+    @patch("subprocess.Popen")
     def test_UnixService_raiseFileNotFoundError(self, subprocess_run_fn):
         config_options = {"service": "unittest"}
 
@@ -35,7 +48,7 @@ class TestUnixServiceMonitors(unittest.TestCase):
 
         self.assertRaises(FileNotFoundError, m.run_test)
 
-    @patch("subprocess.run")
+    @patch("subprocess.Popen")
     def test_UnixService_raiseSubprocessError(self, subprocess_run_fn):
         config_options = {"service": "unittest"}
 
@@ -52,40 +65,194 @@ class TestUnixServiceMonitors(unittest.TestCase):
         self.assertFalse(m.test_success())
         self.assertEqual(m.error_count, 2)
 
-    @patch("subprocess.check_output")
+    @patch("subprocess.Popen")
     def test_svc_ok(self, subprocess_run_fn):
         config_options = {"path": "/var/service/thing"}
-        subprocess_run_fn.return_value = b"/var/service/thing: up (pid 1234) 10 seconds"
+        subprocess_run_fn.return_value = _fake_popen(
+            b"/var/service/thing: up (pid 1234) 10 seconds"
+        )
         m = service.MonitorSvc("unittest", config_options)
         m.run_test()
         self.assertTrue(m.test_success())
 
-    @patch("subprocess.check_output")
+    @patch("subprocess.Popen")
     def test_svc_down(self, subprocess_run_fn):
         config_options = {"path": "/var/service/thing"}
-        subprocess_run_fn.return_value = (
+        subprocess_run_fn.return_value = _fake_popen(
             b"/var/service/thing: down 10 seconds, normally up"
         )
         m = service.MonitorSvc("unittest", config_options)
         m.run_test()
         self.assertFalse(m.test_success())
 
-    @patch("subprocess.check_output")
+    @patch("subprocess.Popen")
+    def test_svc_failed(self, subprocess_run_fn):
+        config_options = {"path": "/var/service/thing"}
+        subprocess_run_fn.return_value = _fake_popen(
+            b"/var/service/thing: up (pid 1234) 10 seconds", returncode=1
+        )
+        m = service.MonitorSvc("unittest", config_options)
+        m.run_test()
+        self.assertFalse(m.test_success())
+
+    @patch("subprocess.Popen")
+    def test_eximqueue(self, subprocess_run_fn):
+        m = service.MonitorEximQueue("unittest", {"max_length": "5"})
+        subprocess_run_fn.return_value = _fake_popen(b"3 matches out of 10 messages\n")
+        m.run_test()
+        self.assertTrue(m.test_success())
+        self.assertEqual(m.get_result(), "3 messages queued")
+        # the count must be at the start of a line
+        subprocess_run_fn.return_value = _fake_popen(
+            b"warning: 3 matches out of 10 messages\n"
+        )
+        m.run_test()
+        self.assertFalse(m.test_success())
+
+    @patch("subprocess.Popen")
     def test_svc_up_enough(self, subprocess_run_fn):
         config_options = {"path": "/var/service/thing", "minimum_uptime": 5}
-        subprocess_run_fn.return_value = b"/var/service/thing: up (pid 1234) 10 seconds"
+        subprocess_run_fn.return_value = _fake_popen(
+            b"/var/service/thing: up (pid 1234) 10 seconds"
+        )
         m = service.MonitorSvc("unittest", config_options)
         m.run_test()
         self.assertTrue(m.test_success())
 
-    @patch("subprocess.check_output")
+    @patch("subprocess.Popen")
     def test_svc_up_not_enough(self, subprocess_run_fn):
         config_options = {"path": "/var/service/thing", "minimum_uptime": 15}
-        subprocess_run_fn.return_value = b"/var/service/thing: up (pid 1234) 10 seconds"
+        subprocess_run_fn.return_value = _fake_popen(
+            b"/var/service/thing: up (pid 1234) 10 seconds"
+        )
         m = service.MonitorSvc("unittest", config_options)
         m.run_test()
         self.assertFalse(m.test_success())
 
 
+def _fake_process(name, exe, cmdline, username):
+    process = Mock()
+    process.info = {
+        "name": name,
+        "exe": exe,
+        "cmdline": cmdline,
+        "username": username,
+    }
+    return process
+
+
+class TestProcessMonitors(unittest.TestCase):
+    processes = [
+        _fake_process("sshd", "/usr/sbin/sshd", ["sshd"], "root"),
+        _fake_process("python3", "/usr/bin/python3.11", ["gunicorn"], "www"),
+        _fake_process("python3", "/usr/bin/python3.11", ["gunicorn"], "root"),
+        _fake_process("kworker/0:1", None, [], "root"),
+    ]
+
+    def setUp(self):
+        new_loop()
+
+    @patch("psutil.process_iter")
+    def test_snapshot_shared(self, process_iter):
+        process_iter.return_value = self.processes
+        m1 = service.MonitorProcess("m1", {"process_name": "sshd"})
+        m2 = service.MonitorProcess(
+            "m2", {"process_name": "gunicorn", "min_count": "2"}
+        )
+        m3 = service.MonitorProcess(
+            "m3", {"process_name": "python3.11", "username": "www", "max_count": "1"}
+        )
+        m1.run_test()
+        m2.run_test()
+        m3.run_test()
+        self.assertTrue(m1.test_success())
+        self.assertTrue(m2.test_success())
+        self.assertTrue(m3.test_success())
+        process_iter.assert_called_once()
+
+        new_loop()
+        process_iter.return_value = []
+        m1.run_test()
+        self.assertFalse(m1.test_success())
+        self.assertEqual(process_iter.call_count, 2)
+
+    @patch("psutil.process_iter")
+    def test_process_counted_once(self, process_iter):
+        # name, exe basename and argv[0] all match, but it's still one process
+        process_iter.return_value = self.processes
+        m = service.MonitorProcess("m", {"process_name": "sshd", "max_count": "1"})
+        m.run_test()
+        self.assertTrue(m.test_success())
+        self.assertEqual(m.get_result(), "1 matching process running")
+
+
+def _unit(name, load_state="loaded", active_state="active", sub_state="running"):
+    return (name, "", load_state, active_state, sub_state, "", "", 0, "", "")
+
+
+class FakeSystemd:
+    def __init__(self, units):
+        self.units = units
+        self.calls = 0
+
+    def ListUnits(self):
+        self.calls += 1
+        return self.units
+
+
+class FakeBus:
+    def __init__(self, systemd):
+        self.systemd = systemd
+
+    def get(self, name):
+        return self.systemd
+
+
+class TestSystemdUnitMonitors(unittest.TestCase):
+    def setUp(self):
+        new_loop()
+        self.systemd = FakeSystemd(
+            [
+                _unit("sshd.service"),
+                _unit("cron.service", active_state="failed", sub_state="failed"),
+                _unit("getty@tty1.service"),
+            ]
+        )
+        patcher = patch.object(
+            service.MonitorSystemdUnit,
+            "bus_factory",
+            staticmethod(lambda: FakeBus(self.systemd)),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unit_states(self):
+        ok = service.MonitorSystemdUnit("ok", {"name": "sshd.service"})
+        failed = service.MonitorSystemdUnit("failed", {"name": "cron.service"})
+        missing = service.MonitorSystemdUnit("missing", {"name": "nope.service"})
+        ok.run_test()
+        failed.run_test()
+        missing.run_test()
+        self.assertTrue(ok.test_success())
+        self.assertFalse(failed.test_success())
+        self.assertEqual(missing.get_result(), "No unit nope.service")
+        self.assertEqual(self.systemd.calls, 1)
+
+    def test_glob(self):
+        m = service.MonitorSystemdUnit("glob", {"name": "getty@*.service"})
+        m.run_test()
+        self.assertTrue(m.test_success())
+        self.assertIn("getty@tty1.service", m.get_result())
+
+    def test_cache_follows_loop(self):
+        m = service.MonitorSystemdUnit("ok", {"name": "sshd.service"})
+        m.run_test()
+        m.run_test()
+        self.assertEqual(self.systemd.calls, 1)
+        new_loop()
+        m.run_test()
+        self.assertEqual(self.systemd.calls, 2)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,71 @@
+# type: ignore
+import os
+import tempfile
+import unittest
+
+from simplemonitor.util.spool import Spool
+
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.path = os.path.join(tempdir.name, "spool")
+
+    def test_append(self):
+        spool = Spool(self.path, 1024 * 1024)
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(spool.load(), [])
+        for i in range(3):
+            spool.append({"n": i})
+        self.assertEqual(spool.load(), [{"n": 0}, {"n": 1}, {"n": 2}])
+        # picks up where it left off
+        spool = Spool(self.path, 1024 * 1024)
+        self.assertEqual(len(spool), os.path.getsize(self.path))
+        spool.replace([{"n": 2}])
+        self.assertEqual(spool.load(), [{"n": 2}])
+        spool.replace([])
+        self.assertEqual(len(spool), 0)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_full(self):
+        spool = Spool(self.path, 100)
+        for i in range(20):
+            spool.append({"n": i})
+        self.assertLessEqual(len(spool), 100)
+        records = spool.load()
+        self.assertEqual(records[-1], {"n": 19})
+        self.assertEqual([r["n"] for r in records], list(range(20 - len(records), 20)))
+
+    def test_merge(self):
+        def merge(records):
+            return [{"n": sum(r["n"] for r in records)}]
+
+        spool = Spool(self.path, 30, merge)
+        for i in range(10):
+            spool.append({"n": i})
+        self.assertEqual(sum(r["n"] for r in spool.load()), 45)
+
+    def test_partial(self):
+        spool = Spool(self.path, 1024)
+        spool.append({"n": 1})
+        spool.append({"n": 2})
+        with open(self.path, "r+b") as spool_file:
+            spool_file.truncate(len(spool) - 2)
+        self.assertEqual(Spool(self.path, 1024).load(), [{"n": 1}])
+
+    def test_append_after_partial(self):
+        spool = Spool(self.path, 1024)
+        spool.append({"n": 1})
+        spool.append({"n": 2})
+        with open(self.path, "ab") as spool_file:
+            spool_file.write(b"\x00\x00\x01\x00torn")
+        spool = Spool(self.path, 1024)
+        self.assertEqual(len(spool), os.path.getsize(self.path))
+        for i in range(3, 8):
+            spool.append({"n": i})
+        self.assertEqual([r["n"] for r in spool.load()], list(range(1, 8)))
+
+
+if __name__ == "__main__":
+    unittest.main()
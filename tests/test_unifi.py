@@ -0,0 +1,217 @@
+# type: ignore
+import socket
+import threading
+import unittest
+
+import paramiko
+
+from simplemonitor.Monitors import unifi
+
+FAILOVER_OUTPUT = b"""load-balance group "wan_failover"
+  interface   : pppoe0
+  carrier     : up
+  status      : active
+  gateway     : pppoe0
+  weight      : 100
+  fo_priority : 60
+
+  interface   : eth2
+  carrier     : up
+  status      : failover
+  gateway     : 192.168.0.1
+  weight      : 0
+  fo_priority : 60
+"""
+
+WATCHDOG_OUTPUT = b"""Group wan_failover
+  pppoe0
+  status: Running
+  pings: 100
+  fails: 0
+  run fails: 0/3
+  route drops: 0
+  ping gateway: ping.ubnt.com - REACHABLE
+
+  eth2
+  status: Running
+  failover-only mode
+  pings: 100
+  fails: 0
+  run fails: 0/3
+  route drops: 0
+  ping gateway: ping.ubnt.com - REACHABLE
+"""
+
+HOST_KEY = paramiko.RSAKey.generate(2048)
+
+
+class FakeRouter(paramiko.ServerInterface):
+    """Just enough of an SSH server to run the ubnt-hal commands."""
+
+    outputs = {
+        b"sudo /usr/sbin/ubnt-hal wlbGetStatus": FAILOVER_OUTPUT,
+        b"/usr/sbin/ubnt-hal wlbGetWdStatus": WATCHDOG_OUTPUT,
+    }
+
+    def __init__(self, server):
+        self.server = server
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if (username, password) == ("admin", "secret"):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        self.server.commands.append(command)
+
+        def respond():
+            channel.sendall(self.outputs.get(command, b""))
+            channel.send_exit_status(0)
+            channel.close()
+
+        # reply once the exec request has been acknowledged
+        threading.Timer(0.05, respond).start()
+        return True
+
+
+class FakeRouterServer:
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.connections = 0
+        self.commands = []
+        self.transports = []
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(HOST_KEY)
+            transport.start_server(server=FakeRouter(self))
+            self.transports.append(transport)
+
+    def drop_connections(self):
+        for transport in self.transports:
+            transport.close()
+
+    def close(self):
+        self.sock.close()
+        self.drop_connections()
+
+
+class TestUnifi(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeRouterServer()
+        self.addCleanup(self.server.close)
+
+        def client_factory():
+            client = paramiko.SSHClient()
+            for host in ["127.0.0.1", "localhost"]:
+                client.get_host_keys().add(
+                    "[{}]:{}".format(host, self.server.port),
+                    HOST_KEY.get_name(),
+                    HOST_KEY,
+                )
+            return client
+
+        self.pool = unifi.SSHSessionPool(client_factory)
+        self.addCleanup(self.pool.close_all)
+        self.original_pool = unifi.ssh_pool
+        unifi.ssh_pool = self.pool
+        self.addCleanup(setattr, unifi, "ssh_pool", self.original_pool)
+        self.config = {
+            "router_address": "127.0.0.1",
+            "router_port": str(self.server.port),
+            "router_username": "admin",
+            "router_password": "secret",
+        }
+
+    def test_failover(self):
+        m = unifi.MonitorUnifiFailover("test", dict(self.config))
+        m.run_test()
+        self.assertTrue(m.test_success(), m.get_result())
+        self.assertEqual(m.get_result(), "Interface eth2 is up with status failover")
+
+    def test_watchdog(self):
+        m = unifi.MonitorUnifiFailoverWatchdog("test", dict(self.config))
+        m.run_test()
+        self.assertTrue(m.test_success(), m.get_result())
+
+    def test_session_shared(self):
+        m1 = unifi.MonitorUnifiFailover("test1", dict(self.config))
+        m2 = unifi.MonitorUnifiFailoverWatchdog("test2", dict(self.config))
+        for _ in range(3):
+            m1.run_test()
+            m2.run_test()
+        self.assertTrue(m1.test_success())
+        self.assertTrue(m2.test_success())
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.server.commands), 6)
+
+    def test_reconnect(self):
+        m = unifi.MonitorUnifiFailover("test", dict(self.config))
+        m.run_test()
+        self.server.drop_connections()
+        m.run_test()
+        self.assertTrue(m.test_success(), m.get_result())
+        self.assertEqual(self.server.connections, 2)
+
+    def test_idle_eviction(self):
+        self.pool.idle_timeout = -1
+        m = unifi.MonitorUnifiFailover("test", dict(self.config))
+        m.run_test()
+        other = unifi.MonitorUnifiFailover(
+            "other", dict(self.config, router_address="localhost")
+        )
+        other.run_test()
+        self.assertTrue(other.test_success(), other.get_result())
+        # the session for the first address was idle, so was closed
+        self.assertEqual(len(self.pool), 1)
+
+    def test_bad_password(self):
+        config = dict(self.config, router_password="wrong")
+        m = unifi.MonitorUnifiFailover("test", config)
+        m.run_test()
+        self.assertFalse(m.test_success())
+        self.assertIn("Failed to ssh to USG", m.get_result())
+
+
+class TestUnifiParsing(unittest.TestCase):
+    def test_failover(self):
+        data = unifi.MonitorUnifiFailover._parse(FAILOVER_OUTPUT.decode().splitlines())
+        self.assertEqual(
+            data["eth2"],
+            {"carrier": "up", "status": "failover", "gateway": "192"},
+        )
+        self.assertEqual(data["pppoe0"]["status"], "active")
+
+    def test_watchdog(self):
+        data = unifi.MonitorUnifiFailoverWatchdog._parse(
+            WATCHDOG_OUTPUT.decode().splitlines()
+        )
+        self.assertEqual(
+            data["eth2"],
+            {
+                "status": "Running",
+                "gateway": "ping.ubnt.com",
+                "ping_status": "REACHABLE",
+            },
+        )
+        self.assertIn("pppoe0", data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,22 @@
 # type: ignore
 import datetime
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
 import unittest
+from unittest.mock import patch
 
 import arrow
 
 from simplemonitor import util
+from simplemonitor.util.loopcache import new_loop
+from simplemonitor.util.probecache import ProbeCache
+from simplemonitor.util.resolver import CachingResolver
+from simplemonitor.util import runner as runner_module
+from simplemonitor.util.runner import run_command
 
 
 class TestUtil(unittest.TestCase):
@@ -245,3 +257,219 @@ class TestGroupMatch(unittest.TestCase):
 
     def test_all(self):
         self.assertTrue(util.check_group_match("test", ["_all"]))
+
+
+class TestResolver(unittest.TestCase):
+    answer = [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("192.0.2.1", 80))]
+
+    def test_cached(self):
+        resolver = CachingResolver()
+        with patch("socket.getaddrinfo", return_value=self.answer) as mock:
+            addresses, _ = resolver.resolve("example.com", 80)
+            self.assertEqual(addresses, self.answer)
+            addresses, duration = resolver.resolve("example.com", 80)
+            self.assertEqual(addresses, self.answer)
+            self.assertEqual(duration, 0.0)
+        mock.assert_called_once()
+
+    def test_expiry(self):
+        resolver = CachingResolver(ttl=0)
+        with patch("socket.getaddrinfo", return_value=self.answer) as mock:
+            resolver.resolve("example.com", 80)
+            resolver.resolve("example.com", 80)
+        self.assertEqual(mock.call_count, 2)
+
+    def test_negative(self):
+        resolver = CachingResolver()
+        with patch("socket.getaddrinfo", side_effect=socket.gaierror("nope")) as mock:
+            with self.assertRaises(socket.gaierror):
+                resolver.resolve("example.invalid", 80)
+            with self.assertRaises(socket.gaierror):
+                resolver.resolve("example.invalid", 80)
+        mock.assert_called_once()
+
+    def test_failed_refresh(self):
+        resolver = CachingResolver(ttl=60)
+        with patch("socket.getaddrinfo", return_value=self.answer):
+            resolver.resolve("example.com", 80)
+        key = ("example.com", 80, 0, 0, 0, 0)
+        resolver._cache[key].refreshing = True
+        with patch("socket.getaddrinfo", side_effect=socket.gaierror("nope")):
+            resolver._refresh(key)
+        self.assertFalse(resolver._cache[key].refreshing)
+        with patch("socket.getaddrinfo", side_effect=socket.gaierror("nope")) as mock:
+            addresses, _ = resolver.resolve("example.com", 80)
+        self.assertEqual(addresses, self.answer)
+        mock.assert_not_called()
+
+    def test_refresh_needs_new_hits(self):
+        resolver = CachingResolver(ttl=100)
+        key = ("example.com", 80, 0, 0, 0, 0)
+        with patch("socket.getaddrinfo", return_value=self.answer):
+            for _ in range(3):
+                resolver.resolve("example.com", 80)
+            resolver._refresh(key)
+        # the refreshed answer hasn't been used yet, so it isn't hot
+        entry = resolver._cache[key]
+        self.assertEqual(entry.hits, 0)
+        self.assertFalse(resolver._wants_refresh(entry, entry.expires - 1))
+
+    def test_lru(self):
+        resolver = CachingResolver(max_size=2)
+        with patch("socket.getaddrinfo", return_value=self.answer) as mock:
+            resolver.resolve("a.example.com", 80)
+            resolver.resolve("b.example.com", 80)
+            resolver.resolve("a.example.com", 80)
+            resolver.resolve("c.example.com", 80)
+            self.assertEqual(len(resolver), 2)
+            # b was the least recently used, so has been evicted
+            resolver.resolve("a.example.com", 80)
+            self.assertEqual(mock.call_count, 3)
+            resolver.resolve("b.example.com", 80)
+            self.assertEqual(mock.call_count, 4)
+
+
+class TestRunner(unittest.TestCase):
+    @staticmethod
+    def python(code):
+        return [sys.executable, "-c", code]
+
+    def test_output(self):
+        result = run_command(self.python("print('hello')"))
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.text.strip(), "hello")
+        self.assertFalse(result.truncated)
+        result.check_returncode()
+
+    def test_returncode(self):
+        result = run_command(self.python("import sys; sys.exit(3)"))
+        self.assertEqual(result.returncode, 3)
+        with self.assertRaises(subprocess.CalledProcessError):
+            result.check_returncode()
+
+    def test_output_cap(self):
+        pattern = re.compile(r"^needle (\d+)")
+        result = run_command(
+            self.python("print('x' * 10000); print('needle 42')"),
+            max_output=100,
+            patterns=[pattern],
+        )
+        self.assertEqual(len(result.output), 100)
+        self.assertTrue(result.truncated)
+        # lines past the cap are still matched
+        self.assertEqual(result.match(pattern).group(1), "42")
+
+    def test_anchored(self):
+        pattern = re.compile(r"(\d+) problems")
+        code = "print('not 3 problems'); print('4 problems')"
+        result = run_command(self.python(code), patterns=[pattern])
+        self.assertEqual(result.match(pattern).group(1), "3")
+        result = run_command(self.python(code), patterns=[pattern], anchored=True)
+        self.assertEqual(result.match(pattern).group(1), "4")
+
+    def test_timeout(self):
+        start = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            run_command(self.python("import time; time.sleep(30)"), timeout=0.5)
+        self.assertLess(time.monotonic() - start, 10)
+
+    def test_exit_before_timeout(self):
+        # the timer fires after the command exited but before it was reaped
+        wait_exited = runner_module._wait_exited
+
+        def slow_wait_exited(process):
+            wait_exited(process)
+            time.sleep(1)
+
+        with patch.object(runner_module, "_wait_exited", slow_wait_exited):
+            result = run_command(self.python("print('done')"), timeout=0.2)
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.text.strip(), "done")
+
+    def test_missing(self):
+        with self.assertRaises(FileNotFoundError):
+            run_command(["/nonexistent/simplemonitor-test-command"])
+
+
+class TestProbeCache(unittest.TestCase):
+    def test_once_per_loop(self):
+        cache = ProbeCache()
+        calls = []
+        new_loop()
+        self.assertEqual(cache.run("key", lambda: calls.append(1) or "a"), ("a", False))
+        self.assertEqual(cache.run("key", lambda: calls.append(1) or "b"), ("a", True))
+        self.assertEqual(len(calls), 1)
+        new_loop()
+        self.assertEqual(cache.run("key", lambda: "c"), ("c", False))
+
+    def test_ttl(self):
+        cache = ProbeCache()
+        new_loop()
+        cache.run("key", lambda: "a")
+        new_loop()
+        self.assertEqual(cache.run("key", lambda: "b", ttl=60), ("a", True))
+        self.assertEqual(cache.run("other", lambda: "c", ttl=60), ("c", False))
+
+    def test_concurrent(self):
+        cache = ProbeCache()
+        new_loop()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def probe():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(cache.run("k", probe)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(
+            target=lambda: results.append(cache.run("k", probe))
+        )
+        follower.start()
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertCountEqual(results, [("result", False), ("result", True)])
+
+    def test_failures_not_reused(self):
+        cache = ProbeCache()
+        new_loop()
+        cache.run("key", lambda: False, ttl=60)
+        new_loop()
+        ok = lambda result: result  # noqa: E731
+        self.assertEqual(
+            cache.run("key", lambda: True, ttl=60, reuse=ok), (True, False)
+        )
+        new_loop()
+        self.assertEqual(
+            cache.run("key", lambda: False, ttl=60, reuse=ok), (True, True)
+        )
+
+    def test_ttl_pruned(self):
+        cache = ProbeCache()
+        new_loop()
+        with patch("time.monotonic", return_value=1000):
+            cache.run("key", lambda: "a", ttl=60)
+        # nothing wants a result that old any more
+        new_loop()
+        with patch("time.monotonic", return_value=1100):
+            cache.run("other", lambda: "b")
+        self.assertEqual(len(cache), 1)
+
+    def test_error_shared(self):
+        cache = ProbeCache()
+        new_loop()
+
+        def probe():
+            raise ValueError("broken")
+
+        with self.assertRaises(ValueError):
+            cache.run("key", probe)
+        with self.assertRaises(ValueError):
+            cache.run("key", lambda: "ok")